@@ -0,0 +1,130 @@
+"""Text analysis shared by index building, spellchecking and query parsing.
+
+The same ``Analyzer`` configuration has to be used for a document and for
+the queries against it, so ``build_index`` saves it as ``analyzer.json``
+next to the index and the search side loads it from there.
+"""
+import json
+import os
+import re
+from collections import Counter
+
+# runs of letters: Cyrillic, Latin or any other script; digits, "_" and
+# punctuation split tokens, like word_tokenize + isalpha did before
+TOKEN_RE = re.compile(r"[^\W\d_]+")
+CYRILLIC_RE = re.compile("[а-яё]")
+
+_stopwords = None
+_analyzers = {}
+
+
+def get_stopwords():
+    """Russian and English NLTK stopwords, read once per process."""
+    global _stopwords
+    if _stopwords is None:
+        # nltk takes long to import, only processes analyzing text pay for it
+        from nltk.corpus import stopwords
+        _stopwords = frozenset(stopwords.words("russian")).union(stopwords.words("english"))
+    return _stopwords
+
+
+def get_analyzer(stemming=False):
+    """Shared ``Analyzer`` instance per configuration, one per process."""
+    if stemming not in _analyzers:
+        _analyzers[stemming] = Analyzer(stemming=stemming)
+    return _analyzers[stemming]
+
+
+class Analyzer:
+    def __init__(self, stemming=False):
+        self.stemming = stemming
+        self.stopwords = get_stopwords()
+        self._stems = {}
+        if stemming:
+            from nltk.stem.snowball import SnowballStemmer
+            self._russian = SnowballStemmer("russian")
+            self._english = SnowballStemmer("english")
+
+    @classmethod
+    def load(cls, path):
+        """Analyzer an index was built with, the default one for older indexes."""
+        if not os.path.exists(path):
+            return get_analyzer()
+        with open(path) as json_file:
+            return get_analyzer(**json.load(json_file))
+
+    def save(self, path):
+        with open(path + ".tmp", "w") as json_file:
+            json.dump({"stemming": self.stemming}, json_file)
+        os.replace(path + ".tmp", path)
+
+    def stem(self, word):
+        if not self.stemming:
+            return word
+        stem = self._stems.get(word)
+        if stem is None:
+            stemmer = self._russian if CYRILLIC_RE.search(word) else self._english
+            stem = self._stems[word] = stemmer.stem(word)
+        return stem
+
+    def words(self, text):
+        """Lowercased tokens of ``text`` without stopwords, not stemmed."""
+        stop = self.stopwords
+        return [w for w in TOKEN_RE.findall(text.lower()) if w not in stop]
+
+    def analyze(self, text):
+        """Index terms of ``text`` in order."""
+        if not self.stemming:
+            return self.words(text)
+        return [self.stem(w) for w in self.words(text)]
+
+    def positions(self, text, start=0):
+        """``(term, position)`` pairs of ``text``, stopwords are dropped but still take a position."""
+        stop = self.stopwords
+        return [(self.stem(w), i) for i, w in enumerate(TOKEN_RE.findall(text.lower()), start) if w not in stop]
+
+    @staticmethod
+    def whole_words(chunks):
+        """Re-cuts a stream of text chunks so that no word is split between two pieces."""
+        carry = ""
+        for chunk in chunks:
+            text = carry + chunk
+            cut = len(text)
+            while cut > 0 and text[cut - 1].isalpha():
+                cut -= 1
+            carry = text[cut:]
+            yield text[:cut]
+        if carry:
+            yield carry
+
+    def term_counts(self, chunks, counts=None, words=None):
+        """Counts terms of a stream of text chunks.
+
+        A word cut by a chunk boundary is carried over to the next chunk, so
+        the result is the same as for the joined text. The ``words`` Counter
+        gets the words as they are in the text, before stemming.
+        """
+        counts = Counter() if counts is None else counts
+        for text in self.whole_words(chunks):
+            if words is None:
+                counts.update(self.analyze(text))
+            else:
+                tokens = self.words(text)
+                words.update(tokens)
+                counts.update(self.stem(w) for w in tokens)
+        return counts
+
+    def term_positions(self, chunks, words=None):
+        """Term -> ascending positions for a stream of text chunks, see ``term_counts``."""
+        res = {}
+        start = 0
+        stop = self.stopwords
+        for text in self.whole_words(chunks):
+            tokens = TOKEN_RE.findall(text.lower())
+            for i, w in enumerate(tokens, start):
+                if w not in stop:
+                    res.setdefault(self.stem(w), []).append(i)
+                    if words is not None:
+                        words[w] += 1
+            start += len(tokens)
+        return res
@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import hmac
+import importlib
 import json
 import os
+import threading
+import time
 
-import google.oauth2.credentials
-import google_auth_oauthlib.flow
-import googleapiclient.discovery
-import requests
-from flask import Flask, url_for, render_template, request, redirect, session, jsonify
+from flask import Flask, Response, url_for, render_template, request, redirect, session, jsonify
 
+import metrics
+import query_engine
+from analyzer import get_analyzer
+from cache import IndexCache, QueryCache, SqliteQueryCache, SuggestCache
+from drive_service import delete_files, discovery_document, get_drive
 from gdriveloader import GDriveFiles, GDriveIndex
-from norwig_spellcheck import NorwigSpellcheck
+from jobs import JobRunner, client_lock, profile_path
+from profiler import Sampler
+from suggest import TOP_K
 
 # This variable specifies the name of a file that contains the OAuth 2.0
 # information for this application, including its client_id and client_secret.
@@ -21,8 +29,47 @@ SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly',
           'https://www.googleapis.com/auth/drive.readonly',
           'https://www.googleapis.com/auth/drive.file']
 
-API_SERVICE_NAME = 'drive'
-API_VERSION = 'v3'
+# Number of parallel Drive download threads used by /api/load and /api/reload.
+DOWNLOAD_WORKERS = int(os.environ.get("GDRIVE_DOWNLOAD_WORKERS", 8))
+# Size of the pieces a file is downloaded in, only one piece per download is held in memory.
+DOWNLOAD_CHUNK_MB = int(os.environ.get("GDRIVE_DOWNLOAD_CHUNK_MB", 8))
+# Files larger than this are not downloaded nor indexed, 0 disables the limit.
+MAX_FILE_MB = int(os.environ.get("GDRIVE_MAX_FILE_MB", 200))
+# Memory budget of postings collected while indexing, a segment is written each time it is reached.
+SEGMENT_MB = int(os.environ.get("GDRIVE_SEGMENT_MB", 64))
+# Number of processes extracting text while building the index, 1 is serial.
+INDEX_WORKERS = int(os.environ.get("GDRIVE_INDEX_WORKERS", os.cpu_count() or 1))
+# Whether a full load indexes word stems (Snowball, Russian and English) instead of words.
+STEMMING = os.environ.get("GDRIVE_STEMMING", "0") == "1"
+# Page size of /api/search when no limit is given.
+DEFAULT_SEARCH_LIMIT = int(os.environ.get("GDRIVE_SEARCH_LIMIT", 50))
+# Whether a full load indexes term positions for "phrase" and NEAR/k queries.
+POSITIONS = os.environ.get("GDRIVE_POSITIONS", "1") == "1"
+# Whether a full load keeps the text of the documents in a compressed store for result snippets.
+DOCSTORE = os.environ.get("GDRIVE_DOCSTORE", "1") == "1"
+# Memory budget of the per-process cache of loaded indexes, in megabytes.
+INDEX_CACHE_MB = int(os.environ.get("GDRIVE_INDEX_CACHE_MB", 256))
+# Memory budget of the cache of /api/search responses, in megabytes, 0 disables it.
+QUERY_CACHE_MB = int(os.environ.get("GDRIVE_QUERY_CACHE_MB", 32))
+# Seconds a cached /api/search response is served.
+QUERY_CACHE_TTL = int(os.environ.get("GDRIVE_QUERY_CACHE_TTL", 300))
+# "memory" for a cache per worker process, "sqlite" for one file shared by all workers.
+QUERY_CACHE_BACKEND = os.environ.get("GDRIVE_QUERY_CACHE_BACKEND", "memory")
+# Number of load jobs of different clients running at the same time in a worker process.
+LOAD_JOBS = int(os.environ.get("GDRIVE_LOAD_JOBS", 2))
+# Number of completions returned by /api/suggest when no limit is given.
+SUGGEST_LIMIT = int(os.environ.get("GDRIVE_SUGGEST_LIMIT", 10))
+# Whether ?profile=1 on /api/search, /api/load and /api/reload records a sampling profile.
+PROFILING = os.environ.get("GDRIVE_PROFILING", "0") == "1"
+# Interval between two stack samples of a profile, in milliseconds.
+PROFILE_INTERVAL_MS = float(os.environ.get("GDRIVE_PROFILE_INTERVAL_MS", 5))
+# Bearer token /metrics asks for, without one it only answers requests from the local host.
+METRICS_TOKEN = os.environ.get("GDRIVE_METRICS_TOKEN", "")
+
+# Imported on first use by the requests needing them, or by preload() in the gunicorn master.
+HEAVY_MODULES = ("google.oauth2.credentials", "google_auth_oauthlib.flow", "google_auth_httplib2", "httplib2",
+                 "googleapiclient.discovery", "googleapiclient.http", "requests", "textract",
+                 "pdfminer.high_level")
 
 app = Flask(__name__, template_folder="templates")
 # Note: A secret key is included in the sample so that it works.
@@ -30,6 +77,44 @@ app = Flask(__name__, template_folder="templates")
 # key. See https://palletsprojects.com/quickstart/#sessions.
 app.secret_key = os.environ["GAPP_SECRET"]
 
+index_cache = IndexCache(max_bytes=INDEX_CACHE_MB * 1024 * 1024)
+suggest_cache = SuggestCache(max_entries=64)
+if QUERY_CACHE_BACKEND == "sqlite":
+    query_cache = SqliteQueryCache(os.path.join("drive_files", ".cache", "queries.sqlite"),
+                                   max_bytes=QUERY_CACHE_MB * 1024 * 1024, ttl=QUERY_CACHE_TTL)
+else:
+    query_cache = QueryCache(max_bytes=QUERY_CACHE_MB * 1024 * 1024, ttl=QUERY_CACHE_TTL)
+job_runner = JobRunner(workers=LOAD_JOBS)
+metrics.Gauge("gdrive_index_cache_bytes", "Estimated memory of the indexes loaded by this process.",
+              function=lambda: {(): index_cache.stats()["size"]})
+
+
+def preload():
+    """Imports the heavy dependencies and reads the NLTK stopwords and the Drive discovery document.
+
+    Called by the gunicorn master before it forks the workers (see
+    ``gunicorn.conf.py``), which then share all of it copy-on-write instead
+    of loading it on their first requests.
+    """
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+    get_analyzer(STEMMING)
+    discovery_document()
+
+
+def profile_requested():
+    return PROFILING and request.args.get('profile', 0, type=int) == 1
+
+
+def invalidate(client_id):
+    """Drops cached state of the client after its index changed."""
+    index_cache.invalidate(client_id)
+    query_cache.invalidate(client_id)
+
+
+def update_index_size(client_id):
+    metrics.INDEX_BYTES.set(GDriveIndex(client_id).disk_size, client=client_id)
+
 
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
@@ -75,21 +160,50 @@ def site_map():
     return render_template("all_links.html", links=links)
 
 
-def load(fl):
+def load(fl, incremental=False):
     if 'credentials' not in session:
         return redirect(url_for('authorize'))
 
-    # Load credentials from the session.
-    credentials = google.oauth2.credentials.Credentials(
-        **session['credentials'])
-
-    drive = googleapiclient.discovery.build(
-        API_SERVICE_NAME, API_VERSION, credentials=credentials)
-    gfiles = GDriveFiles(drive, session['credentials']['client_id'], app.logger)
-    gfiles.load(fl=fl)
-    context = {"loaded": gfiles.index_exists}
-    context.update(gfiles.get_timers_load())
-    return jsonify(**context)
+    credentials = session['credentials']
+    client_id = credentials['client_id']
+    kind = "reload" if incremental else "load"
+    profile = profile_requested()
+
+    def run(job):
+        # the service of the job thread, httplib2 connections can not be shared between threads
+        gfiles = GDriveFiles(get_drive(credentials), client_id, app.logger,
+                             workers=DOWNLOAD_WORKERS, index_workers=INDEX_WORKERS, stemming=STEMMING,
+                             positions=POSITIONS, progress=job.advance,
+                             chunk_size=DOWNLOAD_CHUNK_MB * 1024 * 1024,
+                             max_file_size=MAX_FILE_MB * 1024 * 1024 if MAX_FILE_MB else None,
+                             segment_budget=SEGMENT_MB * 1024 * 1024, store=DOCSTORE)
+        job_thread = threading.current_thread()
+        # the job thread lists, extracts and builds, the download threads of the load fetch the files
+        sampler = Sampler(lambda: [job_thread] + gfiles.threads, PROFILE_INTERVAL_MS / 1000).start() \
+            if profile else None
+        try:
+            gfiles.load(fl=fl, incremental=incremental)
+        except Exception:
+            gfiles.discard()
+            metrics.LOADS.inc(kind=kind, result="failed")
+            raise
+        finally:
+            if sampler is not None:
+                sampler.stop()
+                job.save_profile(sampler.collapsed())
+        invalidate(client_id)
+        timers = gfiles.get_timers_load()
+        metrics.LOADS.inc(kind=kind, result="done")
+        for stage in ("list", "download", "build_index", "merge", "total"):
+            metrics.LOAD_STAGE_SECONDS.observe(timers[stage]["passed"], kind=kind, stage=stage)
+        update_index_size(client_id)
+        context = {"loaded": gfiles.index_exists}
+        context.update(timers)
+        return context
+
+    # a load already running for the client is returned instead of a new one
+    job = job_runner.submit(client_id, kind, run)
+    return jsonify(**job)
 
 
 @app.route('/api/load')
@@ -99,52 +213,211 @@ def load_index():
 
 @app.route('/api/reload')
 def reload_index():
-    return load(True)
+    # patches the index with Drive changes since the last load, falls back
+    # to a full load when there is no manifest from a previous one
+    return load(False, incremental=True)
 
 
-def search():
-    query = request.args.get('query')
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    if 'credentials' not in session:
+        return redirect(url_for('authorize'))
+    job = job_runner.get(session['credentials']['client_id'], job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
+    return jsonify(**job)
+
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    if 'credentials' not in session:
+        return redirect(url_for('authorize'))
+    client_id = session['credentials']['client_id']
+
+    def events():
+        # server-sent events: the job status whenever it changes, until the job ends
+        last = None
+        while True:
+            job = job_runner.get(client_id, job_id)
+            if job is None:
+                yield "event: error\ndata: {}\n\n".format(json.dumps({"error": "unknown job"}))
+                return
+            if job != last:
+                yield "data: {}\n\n".format(json.dumps(job))
+                last = job
+            if job["state"] in ("done", "failed"):
+                return
+            time.sleep(0.5)
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.route('/api/jobs/<job_id>/profile')
+def job_profile(job_id):
+    """Collapsed stacks of a load started with ?profile=1, for flamegraph.pl or speedscope."""
+    if 'credentials' not in session:
+        return redirect(url_for('authorize'))
+    client_id = session['credentials']['client_id']
+    job = job_runner.get(client_id, job_id)
+    path = profile_path(client_id, job_id)
+    if job is None or not os.path.exists(path):
+        return jsonify(error="no profile"), 404
+    with open(path) as profile_file:
+        return Response(profile_file.read(), mimetype="text/plain")
+
+
+def page_params():
+    """``(limit, offset, ranked)`` of a paginated search."""
+    return (max(1, request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int)),
+            max(0, request.args.get('offset', 0, type=int)),
+            request.args.get('ranked', 1, type=int) == 1)
+
+
+def spellchecked(cached, query):
+    if cached.spellchecker is None:
+        return query
+    with metrics.SEARCH_SECONDS.time(phase="spellcheck"):
+        return cached.spellchecker.correction(query)
+
+
+def search(paginate=True, query=None):
+    """Results of the request's query, ``query`` is one already spellchecked."""
+    cached = index_cache.get(session['credentials']['client_id'])
+    if query is None:
+        query = request.args.get('query')
+        if query is not None:
+            query = spellchecked(cached, query)
     context = {"search": query is not None, "docs": None, "query": None}
-    gindex = GDriveIndex(session['credentials']['client_id'])
+    limit, offset, ranked = None, 0, False
+    if paginate:
+        limit, offset, ranked = page_params()
+        context.update(limit=limit, offset=offset, has_more=False)
     if query is not None:
-        if gindex.exists:
-            spellchecker = NorwigSpellcheck(session['credentials']['client_id'])
-            query = spellchecker.correction(query)
         try:
-            context["docs"] = gindex.find(query)
+            # one more than asked to tell whether there is a next page
+            with metrics.SEARCH_SECONDS.time(phase="lookup"):
+                docs = cached.index.find(query, limit=limit + 1 if limit is not None else None,
+                                         offset=offset, ranked=ranked)
+            if limit is not None and docs is not None:
+                context["has_more"] = len(docs) > limit
+                docs = docs[:limit]
+            if paginate and docs is not None:
+                with metrics.SEARCH_SECONDS.time(phase="snippets"):
+                    context["snippets"] = cached.index.snippets(query, [doc[0] for doc in docs])
+            context["docs"] = docs
         except:
             context["docs"] = None
         context["query"] = query
     return context
 
 
+@app.route('/api/cache')
+def cache_stats():
+    return jsonify(**index_cache.stats(), query=query_cache.stats())
+
+
+@app.route('/metrics')
+def metrics_page():
+    # the metrics are labeled with client ids, they are not for everyone who can reach the app
+    if METRICS_TOKEN:
+        allowed = hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + METRICS_TOKEN)
+    else:
+        allowed = request.remote_addr in ("127.0.0.1", "::1")
+    if not allowed:
+        return Response("forbidden\n", status=403, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/api/search', methods=["GET"])
 def gdrive_search():
     if 'credentials' not in session:
         return redirect(url_for('authorize'))
 
-    context = search()
-    return jsonify(**context)
+    if profile_requested():
+        # the collapsed stacks of the search instead of its results
+        with Sampler(interval=PROFILE_INTERVAL_MS / 1000) as sampler:
+            context = search()
+            jsonify(**context)
+        return Response(sampler.collapsed(), mimetype="text/plain")
+    client_id = session['credentials']['client_id']
+    query = request.args.get('query')
+    if query is None:
+        return jsonify(**search())
+    cached = index_cache.get(client_id)
+    query = spellchecked(cached, query)
+    key = None
+    if cached.index.exists:
+        # queries analyzed the same have the same results, whatever their case, stopwords or
+        # word forms; the index version changes with every load and delete, older entries are
+        # not hit anymore
+        tree = query_engine.parse(query, cached.index.analyzer)
+        key = (client_id, hashlib.sha1(repr((tree, page_params(), cached.version)).encode("utf-8")).hexdigest())
+        body = query_cache.get(key)
+        if body is not None:
+            return Response(with_query(body, query), mimetype="application/json")
+    context = search(query=query)
+    del context["query"]
+    with metrics.SEARCH_SECONDS.time(phase="serialization"):
+        # app.json is Flask >= 2.2 only, the image runs Python 3.6
+        body = jsonify(**context).get_data(as_text=True)
+    if key is not None and context["docs"] is not None:
+        query_cache.put(key, body)
+    return Response(with_query(body, query), mimetype="application/json")
+
+
+def with_query(body, query):
+    """Serialized response ``body`` with the query shown to the user, which is not part of the cached body:
+    queries sharing an entry differ in their words as typed."""
+    return '{{"query": {}, {}'.format(json.dumps(query), body.lstrip()[1:])
+
+
+@app.route('/api/suggest', methods=["GET"])
+def suggest_terms():
+    """Most frequent index terms starting with ``prefix``, for typeahead."""
+    if 'credentials' not in session:
+        return redirect(url_for('authorize'))
+    prefix = request.args.get('prefix', '').strip().lower()
+    limit = max(1, min(request.args.get('limit', SUGGEST_LIMIT, type=int), TOP_K))
+    with metrics.SUGGEST_SECONDS.time():
+        suggester = suggest_cache.get(session['credentials']['client_id'])
+        suggestions = suggester.complete(prefix, limit) if suggester is not None else []
+    return jsonify(prefix=prefix, suggestions=[term for term, _ in suggestions])
+
 
+def remove(file_ids):
+    """Deletes files from the drive and from the local index.
 
-def remove(file_id):
-    credentials = google.oauth2.credentials.Credentials(**session['credentials'])
-    drive = googleapiclient.discovery.build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
+    Returns ``[{"id": ..., "status": 0 or -1, "error": ...}, ...]``.
+    """
+    client_id = session['credentials']['client_id']
     try:
-        drive.files().delete(fileId=file_id).execute()
-        return 0
-    except:
-        return -1
+        errors = delete_files(get_drive(session['credentials']), file_ids)
+    except Exception as e:
+        errors = {file_id: str(e) for file_id in file_ids}
+    deleted = [file_id for file_id, error in errors.items() if error is None]
+    if deleted:
+        gfiles = GDriveFiles(None, client_id, app.logger)
+        with client_lock(client_id) as locked:
+            # a running load is not touched, the next reload drops the files
+            if locked and gfiles.index_exists:
+                try:
+                    gfiles.remove_documents(deleted)
+                    invalidate(client_id)
+                    update_index_size(client_id)
+                except Exception as e:
+                    app.logger.error("removing deleted files from the index: {}".format(e))
+    return [{"id": file_id, "status": 0 if errors[file_id] is None else -1, "error": errors[file_id]}
+            for file_id in errors]
 
 
 @app.route('/api/search_delete', methods=["GET"])
 def search_delete():
     if 'credentials' not in session:
         return redirect(url_for('authorize'))
-    context = search()
+    # every document containing all query terms, not a page of ranked ones
+    context = search(paginate=False)
     if context["docs"] is not None:
-        for item in context["docs"]:
-            remove(item[1]["id"])
+        context["deleted"] = remove([item[1]["id"] for item in context["docs"]])
     return jsonify(**context)
 
 
@@ -155,7 +428,7 @@ def delete_file():
 
     data = json.loads(request.data)
     file_id = data['file_id']
-    status = remove(file_id)
+    status = remove([file_id])[0]["status"]
     return jsonify(status=status)
 
 
@@ -164,12 +437,9 @@ def test_api_request():
     if 'credentials' not in session:
         return redirect(url_for('authorize'))
 
-    # Load credentials from the session.
-    credentials = google.oauth2.credentials.Credentials(
-        **session['credentials'])
-
-    drive = googleapiclient.discovery.build(
-        API_SERVICE_NAME, API_VERSION, credentials=credentials)
+    drive = get_drive(session['credentials'])
+    # refreshed by the service when the access token expires
+    credentials = drive._http.credentials
 
     files = drive.files().list(q="'me' in owners",
                                fields='nextPageToken, files(id, name, mimeType, webViewLink)').execute()
@@ -184,6 +454,8 @@ def test_api_request():
 
 @app.route('/authorize')
 def authorize():
+    import google_auth_oauthlib.flow
+
     # Create flow instance to manage the OAuth 2.0 Authorization Grant Flow steps.
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         CLIENT_SECRETS_FILE, scopes=SCOPES)
@@ -213,6 +485,7 @@ def oauth2callback():
     # verified in the authorization server response.
     state = session['state']
 
+    import google_auth_oauthlib.flow
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         CLIENT_SECRETS_FILE, scopes=SCOPES, state=state)
     flow.redirect_uri = url_for('oauth2callback', _external=True)
@@ -234,6 +507,8 @@ def revoke():
     if 'credentials' not in session:
         return redirect(url_for('authorize'))
 
+    import google.oauth2.credentials
+    import requests
     credentials = google.oauth2.credentials.Credentials(
         **session['credentials'])
 
@@ -274,9 +549,7 @@ def exit_page():
 def utility_processor():
     def index_exists():
         if 'credentials' in session:
-            client_id = session['credentials']['client_id']
-            index_path = os.path.join("drive_files", client_id, "index.json")
-            return os.path.exists(index_path)
+            return GDriveIndex(session['credentials']['client_id']).exists
         return False
 
     return dict(index_exists=index_exists(), debug=app.debug, user_loged_in='credentials' in session)
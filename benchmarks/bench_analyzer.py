@@ -0,0 +1,70 @@
+"""Tokens/sec of the old preprocess (word_tokenize + per-token stopword sets) and of Analyzer.
+
+    python benchmarks/bench_analyzer.py [--words N] [--stemming]
+
+The text is synthetic mixed Russian/English prose with punctuation and digits.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import nltk
+from nltk.corpus import stopwords
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyzer import Analyzer  # noqa: E402
+
+WORDS = ("документ отчёт презентация проект система данные поиск индекс файл диск "
+         "document report presentation project system data search index file drive "
+         "и в не на с что the a of and to in is").split()
+
+
+def old_is_apt(word):
+    russian_stopwords = set(stopwords.words("russian"))
+    english_stopwords = set(stopwords.words("english"))
+    ru_en_stopwords = russian_stopwords.union(english_stopwords)
+    return word.isalpha() and word not in ru_en_stopwords
+
+
+def old_preprocess(sent):
+    prep = nltk.word_tokenize(sent.lower())
+    return [w for w in prep if old_is_apt(w)]
+
+
+def generate(n_words, seed=0):
+    rnd = random.Random(seed)
+    parts = []
+    for i in range(n_words):
+        parts.append(rnd.choice(WORDS))
+        if i % 12 == 11:
+            parts.append(rnd.choice([".", ",", "!", "2020", "(v2)"]))
+    return " ".join(parts)
+
+
+def run(name, func, text, n_words):
+    start = time.perf_counter()
+    tokens = func(text)
+    n_terms = sum(tokens.values()) if isinstance(tokens, dict) else len(tokens)
+    passed = time.perf_counter() - start
+    print("{:<12} {:>10.0f} words/sec {:>8} terms {:.3f}s".format(name, n_words / passed, n_terms, passed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=20000)
+    parser.add_argument("--stemming", action="store_true")
+    args = parser.parse_args()
+
+    text = generate(args.words)
+    analyzer = Analyzer(stemming=args.stemming)
+    run("preprocess", old_preprocess, text, args.words)
+    run("Analyzer", analyzer.analyze, text, args.words)
+    chunks = [text[i:i + 4096] for i in range(0, len(text), 4096)]
+    run("streaming", lambda _: analyzer.term_counts(chunks), text, args.words)
+
+
+if __name__ == '__main__':
+    main()
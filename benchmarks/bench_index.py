@@ -0,0 +1,94 @@
+"""Compares index.json and index.bin: load time, peak RSS and query latency.
+
+    python benchmarks/bench_index.py [drive_files/<client_id>] [--docs N --terms N --queries N]
+
+Without a folder a synthetic index is generated in a temporary folder. Every
+format is measured in its own subprocess so the RSS numbers do not mix.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import binindex  # noqa: E402
+
+
+def generate(folder, n_docs, n_terms, seed=0):
+    rnd = random.Random(seed)
+    docs = ["doc_{}.docx".format(i) for i in range(n_docs)]
+    res = {}
+    for t in range(n_terms):
+        # zipf-like document frequencies
+        df = max(1, int(n_docs / (t + 1) ** 0.8))
+        res["term{}".format(t)] = {doc: rnd.randint(1, 20) for doc in rnd.sample(docs, df)}
+    with open(os.path.join(folder, "index.json"), "w") as json_file:
+        json.dump(res, json_file)
+    with open(os.path.join(folder, "docs.json"), "w") as json_file:
+        json.dump({i: doc for i, doc in enumerate(docs)}, json_file)
+
+
+def measure(folder, fmt, queries):
+    """Runs in a subprocess, prints a JSON line with the measurements."""
+    start = time.perf_counter()
+    if fmt == "json":
+        index = json.load(open(os.path.join(folder, "index.json")))
+        lookup = lambda term: list(index.get(term, ()))  # noqa: E731
+    else:
+        index = binindex.BinaryIndex(os.path.join(folder, "index.bin"))
+        lookup = index.postings
+    load_time = time.perf_counter() - start
+
+    latencies = []
+    for term in queries:
+        start = time.perf_counter()
+        lookup(term)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(json.dumps({"format": fmt,
+                      "load_ms": load_time * 1000,
+                      "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      "query_p50_us": latencies[len(latencies) // 2] * 1e6,
+                      "query_p99_us": latencies[int(len(latencies) * 0.99)] * 1e6,
+                      "size_bytes": os.path.getsize(os.path.join(folder, "index." + fmt))}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", nargs="?")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--terms", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--measure", choices=["json", "bin"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        queries = json.loads(sys.stdin.read())
+        measure(args.folder, args.measure, queries)
+        return
+
+    folder = args.folder
+    if folder is None:
+        folder = tempfile.mkdtemp(prefix="bench_index_")
+        generate(folder, args.docs, args.terms)
+    if not os.path.exists(os.path.join(folder, "index.bin")):
+        binindex.convert(os.path.join(folder, "index.json"), os.path.join(folder, "docs.json"),
+                         os.path.join(folder, "index.bin"))
+
+    with binindex.BinaryIndex(os.path.join(folder, "index.bin")) as index:
+        terms = list(index.terms())
+    rnd = random.Random(1)
+    queries = [rnd.choice(terms) for _ in range(args.queries)]
+    for fmt in ("json", "bin"):
+        subprocess.run([sys.executable, __file__, folder, "--measure", fmt],
+                       input=json.dumps(queries), universal_newlines=True, check=True)
+
+
+if __name__ == '__main__':
+    main()
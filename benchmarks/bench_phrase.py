@@ -0,0 +1,84 @@
+"""Cost of term positions: index size and phrase/NEAR latency against plain AND.
+
+    python benchmarks/bench_phrase.py [--docs N --words N --vocabulary N --queries N]
+
+A synthetic corpus with zipf-like word frequencies is indexed twice, with
+and without positions. Query word pairs are taken from adjacent words of
+random documents, so phrase queries have matches.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import binindex  # noqa: E402
+from query_engine import And, Near, Phrase, Term  # noqa: E402
+
+
+def generate(n_docs, n_words, vocabulary, seed=0):
+    rnd = random.Random(seed)
+    words = ["word{}".format(i) for i in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+    return {"doc_{}.docx".format(i): rnd.choices(words, weights, k=rnd.randint(n_words // 2, n_words))
+            for i in range(n_docs)}
+
+
+def build(folder, docs):
+    res, positions = {}, {}
+    for doc, words in docs.items():
+        for i, word in enumerate(words):
+            res.setdefault(word, {}).setdefault(doc, 0)
+            res[word][doc] += 1
+            positions.setdefault(word, {}).setdefault(doc, []).append(i)
+    doc_ids = {doc: i for i, doc in enumerate(docs)}
+    plain, positional = os.path.join(folder, "plain.bin"), os.path.join(folder, "positions.bin")
+    binindex.write_index(plain, res, doc_ids)
+    binindex.write_index(positional, res, doc_ids, positions)
+    return plain, positional
+
+
+def latency(index, nodes):
+    latencies = []
+    for node in nodes:
+        start = time.perf_counter()
+        node.evaluate(index)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=1000)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    docs = generate(args.docs, args.words, args.vocabulary)
+    rnd = random.Random(1)
+    pairs = []
+    for _ in range(args.queries):
+        words = rnd.choice(list(docs.values()))
+        i = rnd.randrange(len(words) - 1)
+        pairs.append((words[i], words[i + 1]))
+
+    folder = tempfile.mkdtemp(prefix="bench_phrase_")
+    plain, positional = build(folder, docs)
+    print("index size: {} bytes without positions, {} bytes with positions".format(
+        os.path.getsize(plain), os.path.getsize(positional)))
+
+    with binindex.BinaryIndex(positional) as index:
+        for name, nodes in (("AND", [And([Term(a), Term(b)]) for a, b in pairs]),
+                            ("phrase", [Phrase([a, b], [0, 1]) for a, b in pairs]),
+                            ("NEAR/5", [Near(a, b, 5) for a, b in pairs])):
+            p50, p99 = latency(index, nodes)
+            print("{:8} p50 {:.3f} ms  p99 {:.3f} ms".format(name, p50, p99))
+
+
+if __name__ == '__main__':
+    main()
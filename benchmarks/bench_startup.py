@@ -0,0 +1,93 @@
+"""Cold start of a worker: import time of ``app`` and latency of the first requests.
+
+    python benchmarks/bench_startup.py [--runs N --preload --out startup.json]
+
+Every run is a fresh interpreter, like a new gunicorn worker without
+``preload_app``. Measured: interpreter start to ``import app`` done, the
+first page render, the first Drive service build and the first text
+analysis (NLTK stopwords). With ``--preload`` the requests are measured in
+a process forked after ``app.preload()``, like a worker of a gunicorn
+master using ``gunicorn.conf.py``. Medians over the runs are printed and
+written as JSON to ``--out``.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app
+res = {{"import_app": time.perf_counter() - start}}
+if {preload!r}:
+    start = time.perf_counter()
+    app.preload()
+    res["preload"] = time.perf_counter() - start
+    read, write = os.pipe()
+    if os.fork():
+        os.close(write)
+        res.update(json.loads(os.fdopen(read).read()))
+        print(json.dumps(res))
+        sys.exit(0)
+    os.close(read)
+    res = {{}}
+client = app.app.test_client()
+start = time.perf_counter()
+client.get("/")
+res["first_page"] = time.perf_counter() - start
+start = time.perf_counter()
+from drive_service import get_drive
+get_drive({{"token": "t", "refresh_token": "r", "token_uri": "https://oauth2.googleapis.com/token",
+            "client_id": "c", "client_secret": "s", "scopes": []}})
+res["first_drive_service"] = time.perf_counter() - start
+start = time.perf_counter()
+from analyzer import get_analyzer
+get_analyzer().analyze("первый запрос")
+res["first_analysis"] = time.perf_counter() - start
+res["modules"] = len(sys.modules)
+if {preload!r}:
+    os.fdopen(write, "w").write(json.dumps(res))
+    os._exit(0)
+print(json.dumps(res))
+"""
+
+
+def run(workdir, preload):
+    env = dict(os.environ)
+    env.setdefault("GAPP_SECRET", "bench")
+    probe = PROBE.format(root=ROOT, preload=preload)
+    # a fresh interpreter per run, bytecode is already compiled
+    out = subprocess.run([sys.executable, "-c", probe], cwd=workdir, env=env, check=True,
+                         stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--preload", action="store_true")
+    parser.add_argument("--out", default="startup.json")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    runs = [run(workdir, args.preload) for _ in range(args.runs)]
+    results = {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+    results["runs"] = args.runs
+    for key, value in results.items():
+        if isinstance(value, float):
+            print("{:22} {:8.1f} ms".format(key, value * 1000))
+        else:
+            print("{:22} {}".format(key, value))
+    with open(args.out, "w") as json_file:
+        json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""End to end benchmark of a load and of searches, without network or Google account.
+
+    python benchmarks/bench_suite.py [--files N --words N --vocabulary N --duplicates R --copies R --pptx R
+                                      --latency S --workers N --index-workers N --no-positions --no-store
+                                      --queries N --out results.json]
+
+A synthetic corpus (``corpus.py``) is served by a fake Drive service
+(``fakedrive.py``) and loaded by ``GDriveFiles`` into a temporary
+``drive_files``. Reported: list, download, extract and build throughput,
+index and document store size on disk, and p50/p99 latency of
+``GDriveIndex.find``, ``GDriveIndex.snippets`` and
+``NorwigSpellcheck.correction``. Results are printed and written as JSON to
+``--out``, so runs before and after a change can be compared.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+from fakedrive import FakeDrive  # noqa: E402
+from gdriveloader import FileText, GDriveFiles, GDriveIndex  # noqa: E402
+from norwig_spellcheck import NorwigSpellcheck  # noqa: E402
+
+CLIENT_ID = "bench"
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {"p50_ms": latencies[len(latencies) // 2] * 1000,
+            "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000}
+
+
+def timed(function, args):
+    latencies = []
+    for arg in args:
+        start = time.perf_counter()
+        function(arg)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else None
+
+
+def bench_load(files, args):
+    gfiles = GDriveFiles(FakeDrive(files, latency=args.latency), CLIENT_ID, logging.getLogger("bench"),
+                         workers=args.workers, index_workers=args.index_workers, positions=args.positions,
+                         store=args.store)
+    gfiles.load()
+    timers = gfiles.get_timers_load()
+    megabytes = sum(int(file["size"]) for file in files) / 2 ** 20
+    folder = os.path.realpath(os.path.join("drive_files", CLIENT_ID))
+    index_size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+    return {"list": {"seconds": timers["list"]["passed"], "pages": timers["list"]["pages"],
+                     "files_per_s": rate(len(files), timers["list"]["passed"])},
+            "download": {"seconds": timers["download"]["passed"], "files": timers["download"]["files"],
+                         "files_per_s": rate(len(files), timers["download"]["passed"]),
+                         "duplicates": timers["download"]["duplicates"],
+                         "mb_per_s": rate(megabytes, timers["download"]["passed"])},
+            "build": {"seconds": timers["build_index"]["passed"],
+                      "files_per_s": rate(len(files), timers["build_index"]["passed"])},
+            "merge": {"seconds": timers["merge"]["passed"]},
+            "store": timers["store"],
+            "index_bytes": index_size}
+
+
+def bench_extract(files):
+    """Text extraction alone, the part of the build spent in textract."""
+    folder = tempfile.mkdtemp(prefix="bench_extract_")
+    paths = []
+    for i, file in enumerate(files):
+        path = os.path.join(folder, "{}_{}".format(i, file["name"]))
+        with open(path, "wb") as f:
+            f.write(file["content"])
+        paths.append(path)
+    start = time.perf_counter()
+    characters = sum(len(chunk) for path in paths for chunk in FileText(path))
+    seconds = time.perf_counter() - start
+    shutil.rmtree(folder)
+    return {"seconds": seconds, "files_per_s": rate(len(paths), seconds),
+            "mb_per_s": rate(sum(len(file["content"]) for file in files) / 2 ** 20, seconds),
+            "characters": characters}
+
+
+def misspell(word, rnd):
+    i = rnd.randrange(len(word))
+    return word[:i] + rnd.choice(word) + word[i + 1:]
+
+
+def bench_search(vocabulary, n_queries):
+    rnd = random.Random(1)
+    # frequent words, so queries have results as with real searches
+    words = vocabulary[:max(2, len(vocabulary) // 10)]
+    rnd.shuffle(words)
+    queries = [" ".join(rnd.sample(words, rnd.randint(1, 3))) for _ in range(n_queries)]
+    typos = [" ".join(misspell(word, rnd) for word in query.split()) for query in queries]
+    index = GDriveIndex(CLIENT_ID)
+    start = time.perf_counter()
+    index.open()
+    open_seconds = time.perf_counter() - start
+    results = {"open_seconds": open_seconds,
+               "find": timed(index.find, queries),
+               "find_ranked": timed(lambda query: index.find(query, limit=10, ranked=True), queries)}
+    if index.index.has_positions:
+        phrases = ['"{} {}"'.format(*rnd.sample(words, 2)) for _ in range(n_queries)]
+        results["find_phrase"] = timed(index.find, phrases)
+    # snippets of a first page of ten results
+    pages = [(query, [doc[0] for doc in index.find(query, limit=10, ranked=True)]) for query in queries]
+    results["snippets"] = timed(lambda page: index.snippets(*page), pages)
+    index.index.close()
+    start = time.perf_counter()
+    spellcheck = NorwigSpellcheck(CLIENT_ID)
+    results["spellcheck_open_seconds"] = time.perf_counter() - start
+    results["correction"] = timed(spellcheck.correction, typos)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--words", type=int, default=500)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--copies", type=float, default=0., help="share of files with the content of another one")
+    parser.add_argument("--pptx", type=float, default=0.3)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per fake HTTP request")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--index-workers", type=int, default=1)
+    parser.add_argument("--no-positions", dest="positions", action="store_false")
+    parser.add_argument("--no-store", dest="store", action="store_false")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args()
+    out = os.path.abspath(args.out)
+
+    start = time.perf_counter()
+    files = corpus.generate(args.files, args.words, args.vocabulary, args.duplicates, args.pptx, copies=args.copies)
+    results = {"params": vars(args), "corpus": {
+        "files": len(files), "bytes": sum(int(file["size"]) for file in files),
+        "seconds": time.perf_counter() - start}}
+
+    # paths of the loader are relative to the working directory
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    os.chdir(workdir)
+    try:
+        results["load"] = bench_load(files, args)
+        results["extract"] = bench_extract(files)
+        results["search"] = bench_search(corpus.vocabulary(args.vocabulary), args.queries)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    with open(out, "w") as json_file:
+        json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Synthetic Drive corpus: small but valid .docx and .pptx files.
+
+    files = generate(n_files=200, words=500, vocabulary_size=5000, duplicates=0.05, pptx=0.3, copies=0.)
+
+Every file is a Drive file resource (id, name, mimeType, webViewLink,
+md5Checksum, modifiedTime, version, size) with its bytes under ``content``,
+ready for ``FakeDrive``. Words are drawn with zipf-like frequencies from a
+mixed Russian and English vocabulary; ``duplicates`` is the share of files
+reusing the name of an earlier file, ``copies`` the share of files with the
+content of an earlier file under a name of their own, like copies in a real
+drive.
+"""
+import hashlib
+import io
+import random
+import zipfile
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PPTX_MIME = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+RU_LETTERS = "абвгдежзиклмнопрстуфхцчшыэюя"
+EN_LETTERS = "abcdefghijklmnopqrstuvwxyz"
+# paragraphs of a docx, slides of a pptx
+WORDS_PER_PART = 60
+
+DOCX_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml"
+ ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Target="word/document.xml"
+ Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>
+</Relationships>"""
+DOCX_DOCUMENT = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>{}</w:body></w:document>"""
+DOCX_PARAGRAPH = "<w:p><w:r><w:t>{}</w:t></w:r></w:p>"
+
+PPTX_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/ppt/presentation.xml"
+ ContentType="application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml"/>
+{}
+</Types>"""
+PPTX_SLIDE_TYPE = """<Override PartName="/ppt/slides/slide{}.xml"
+ ContentType="application/vnd.openxmlformats-officedocument.presentationml.slide+xml"/>"""
+PPTX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Target="ppt/presentation.xml"
+ Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>
+</Relationships>"""
+PPTX_PRESENTATION = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<p:presentation xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+ xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main">
+<p:sldIdLst>{}</p:sldIdLst><p:sldSz cx="9144000" cy="6858000"/><p:notesSz cx="6858000" cy="9144000"/>
+</p:presentation>"""
+PPTX_SLIDE_ID = '<p:sldId id="{}" r:id="rId{}"/>'
+PPTX_PRESENTATION_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{}</Relationships>"""
+PPTX_SLIDE_REL = '<Relationship Id="rId{0}" Target="slides/slide{0}.xml" ' \
+                 'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/slide"/>'
+PPTX_SLIDE = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<p:sld xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+ xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main">
+<p:cSld><p:spTree><p:nvGrpSpPr><p:cNvPr id="1" name=""/><p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr><p:grpSpPr/>
+<p:sp><p:nvSpPr><p:cNvPr id="2" name="Text"/><p:cNvSpPr/><p:nvPr/></p:nvSpPr><p:spPr/>
+<p:txBody><a:bodyPr/><a:p><a:r><a:t>{}</a:t></a:r></a:p></p:txBody></p:sp>
+</p:spTree></p:cSld></p:sld>"""
+
+
+def vocabulary(size, seed=0):
+    """``size`` distinct pseudo words, two thirds Russian and one third English."""
+    rnd = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        letters = EN_LETTERS if len(words) % 3 == 2 else RU_LETTERS
+        words.add("".join(rnd.choice(letters) for _ in range(rnd.randint(4, 10))))
+    return sorted(words)
+
+
+def _zip(parts):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in parts:
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def _parts(words):
+    return [" ".join(words[start:start + WORDS_PER_PART]) for start in range(0, len(words), WORDS_PER_PART)] \
+        or [""]
+
+
+def make_docx(words):
+    body = "".join(DOCX_PARAGRAPH.format(escape(text)) for text in _parts(words))
+    return _zip([("[Content_Types].xml", DOCX_TYPES), ("_rels/.rels", DOCX_RELS),
+                 ("word/document.xml", DOCX_DOCUMENT.format(body))])
+
+
+def make_pptx(words):
+    slides = _parts(words)
+    numbers = range(1, len(slides) + 1)
+    parts = [("[Content_Types].xml", PPTX_TYPES.format("".join(PPTX_SLIDE_TYPE.format(i) for i in numbers))),
+             ("_rels/.rels", PPTX_RELS),
+             ("ppt/presentation.xml", PPTX_PRESENTATION.format(
+                 "".join(PPTX_SLIDE_ID.format(255 + i, i) for i in numbers))),
+             ("ppt/_rels/presentation.xml.rels", PPTX_PRESENTATION_RELS.format(
+                 "".join(PPTX_SLIDE_REL.format(i) for i in numbers)))]
+    parts.extend(("ppt/slides/slide{}.xml".format(i), PPTX_SLIDE.format(escape(text)))
+                 for i, text in zip(numbers, slides))
+    return _zip(parts)
+
+
+def generate(n_files, words=500, vocabulary_size=5000, duplicates=0.05, pptx=0.3, seed=0, copies=0.):
+    """List of Drive file resources with their ``content``, see the module docstring."""
+    rnd = random.Random(seed)
+    vocab = vocabulary(vocabulary_size, seed)
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    modified = datetime(2020, 1, 1)
+    files = []
+    for i in range(n_files):
+        file_id = "file{:06d}".format(i)
+        # checked only when asked for, the default corpus stays the same
+        if copies and files and rnd.random() < copies:
+            original = rnd.choice(files)
+            base, ext = original["name"].rsplit(".", 1)
+            files.append(dict(original, id=file_id, name="{} copy {}.{}".format(base, i, ext),
+                              webViewLink="https://drive.google.com/file/d/{}/view".format(file_id)))
+            continue
+        if files and rnd.random() < duplicates:
+            name = rnd.choice(files)["name"]
+        else:
+            name = "{}_{}.{}".format(rnd.choice(vocab), i, "pptx" if rnd.random() < pptx else "docx")
+        text = rnd.choices(vocab, weights, k=rnd.randint(words // 2, words * 3 // 2))
+        content = make_pptx(text) if name.endswith(".pptx") else make_docx(text)
+        files.append({"id": file_id, "name": name, "mimeType": PPTX_MIME if name.endswith(".pptx") else DOCX_MIME,
+                      "webViewLink": "https://drive.google.com/file/d/{}/view".format(file_id),
+                      "md5Checksum": hashlib.md5(content).hexdigest(),
+                      "modifiedTime": (modified + timedelta(minutes=i)).isoformat() + "Z",
+                      "version": "1", "size": str(len(content)), "content": content})
+    return files
+
@@ -0,0 +1,154 @@
+"""Local stand-in for the Drive v3 service used by ``GDriveFiles`` and ``app.py``.
+
+Serves the files of a corpus (see ``corpus.py``) from memory::
+
+    drive = FakeDrive(files, latency=0.02)
+
+``files`` are Drive file resources with a ``content`` key holding their
+bytes. Supported calls: ``files().list``, ``files().get_media`` (with range
+requests, so ``MediaIoBaseDownload`` downloads in chunks), ``files().delete``,
+``changes().getStartPageToken``/``changes().list`` and
+``new_batch_http_request``. Every HTTP round trip sleeps ``latency``
+seconds to stand for the network.
+"""
+import threading
+import time
+
+
+class Response(dict):
+    """httplib2 style response: a dict of headers with a ``status``."""
+
+    def __init__(self, status, **headers):
+        super().__init__(**headers)
+        self.status = status
+        self.reason = "OK" if status < 400 else "Error"
+
+
+class FakeHttp:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        self.drive.wait()
+        file = self.drive.files_by_id.get(uri.rsplit("/", 1)[-1])
+        if file is None:
+            return Response(404), b""
+        content = file["content"]
+        header = (headers or {}).get("range")
+        if header is None:
+            return Response(200, **{"content-length": str(len(content))}), content
+        start, end = (int(value) for value in header.split("=")[1].split("-"))
+        if start >= len(content):
+            return Response(416, **{"content-range": "bytes */{}".format(len(content))}), b""
+        chunk = content[start:end + 1]
+        return Response(206, **{"content-range": "bytes {}-{}/{}".format(
+            start, start + len(chunk) - 1, len(content))}), chunk
+
+
+class Request:
+    """An API call, ``execute`` returns ``result()``."""
+
+    def __init__(self, drive, result, uri=""):
+        self.drive = drive
+        self.result = result
+        self.uri = uri
+        self.headers = {}
+        self.http = drive._http
+
+    def execute(self, num_retries=0, http=None):
+        self.drive.wait()
+        return self.result()
+
+
+class Batch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        # one round trip for the whole batch
+        self.drive.wait()
+        for request_id, request in self.requests:
+            self.callback(request_id, request.result(), None)
+
+
+class Files:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, pageToken=None, pageSize=100, **kwargs):
+        def result():
+            files = self.drive.listed()
+            start = int(pageToken or 0)
+            page = {"files": [self.drive.resource(file) for file in files[start:start + pageSize]]}
+            if start + pageSize < len(files):
+                page["nextPageToken"] = str(start + pageSize)
+            return page
+        return Request(self.drive, result)
+
+    def get_media(self, fileId):
+        return Request(self.drive, None, uri="https://fake/download/" + fileId)
+
+    def export_media(self, fileId, mimeType):
+        # ``content`` of a Google Docs file is its export
+        return Request(self.drive, None, uri="https://fake/export/" + fileId)
+
+    def delete(self, fileId):
+        return Request(self.drive, lambda: self.drive.delete(fileId))
+
+
+class Changes:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self):
+        return Request(self.drive, lambda: {"startPageToken": str(len(self.drive.changes_log))})
+
+    def list(self, pageToken, **kwargs):
+        def result():
+            log = self.drive.changes_log
+            return {"changes": log[int(pageToken):], "newStartPageToken": str(len(log))}
+        return Request(self.drive, result)
+
+
+class FakeDrive:
+    def __init__(self, files, latency=0.):
+        self.files_by_id = {file["id"]: file for file in files}
+        self.order = [file["id"] for file in files]
+        self.latency = latency
+        self.changes_log = []
+        self.deleted = 0
+        self._lock = threading.Lock()
+        self._http = FakeHttp(self)
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def listed(self):
+        return [self.files_by_id[file_id] for file_id in self.order if file_id in self.files_by_id]
+
+    @staticmethod
+    def resource(file):
+        return {key: value for key, value in file.items() if key != "content"}
+
+    def delete(self, file_id):
+        with self._lock:
+            file = self.files_by_id.pop(file_id, None)
+            if file is not None:
+                self.deleted += 1
+                self.changes_log.append({"fileId": file_id, "removed": True})
+        return {}
+
+    def files(self):
+        return Files(self)
+
+    def changes(self):
+        return Changes(self)
+
+    def new_batch_http_request(self, callback=None):
+        return Batch(self, callback)
@@ -0,0 +1,472 @@
+"""Compact binary inverted index opened with mmap.
+
+Layout of ``index.bin`` (little endian)::
+
+    header      magic "GDIX", version, number of terms, number of docs,
+                offsets of the term table, terms blob, postings and doc
+                lengths, total and minimal document length, offset of the
+                positions (0 when the index has none)
+    term table  one fixed size entry per term sorted by the term's UTF-8
+                bytes: term offset/length in the blob, postings
+                offset/length, document frequency, maximal frequency,
+                positions offset, collection frequency (occurrences in
+                all docs)
+    terms blob  UTF-8 terms one after another
+    postings    for every term a varint stream of (doc id gap, frequency)
+                pairs, doc ids ascending; lists longer than BLOCK postings
+                start with a skip table: (last doc id, byte offset) of
+                every block of BLOCK postings
+    doc lengths number of terms of every doc, uint32 per doc id
+    positions   optional, for every term: uint32 byte offset of every block
+                of BLOCK postings when it has a skip table, then for every
+                posting the byte length of its entry and the varint gaps
+                between the positions of the term in the doc
+
+Doc ids are local to the file, a segment of the index adds its base to
+them (``segments.py``). Document lengths and maximal term frequencies are
+kept for BM25 ranking (``ranking.py``). A lookup is a binary search over
+the term table and decodes only the postings of the requested term, so
+opening the index costs the same no matter how large it is. ``cursor`` uses the skip table to jump to a doc id decoding only
+the block it is in, which keeps intersections with long lists cheap.
+
+Convert an existing JSON index with ``python binindex.py drive_files/<client_id>``.
+"""
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_left
+
+MAGIC = b"GDIX"
+VERSION = 5
+HEADER = struct.Struct("<4sIIIQQQQQIQ")
+ENTRY = struct.Struct("<IIQIIIQQ")
+SKIP = struct.Struct("<II")
+BLOCK = 128
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def gallop(values, target, lo=0):
+    """Index of the first of sorted ``values[lo:]`` not smaller than ``target``.
+
+    Probes lo + 1, lo + 3, lo + 7, ... before a binary search, so it costs
+    O(log distance) when the target is close to ``lo``.
+    """
+    step, hi = 1, lo
+    while hi < len(values) and values[hi] < target:
+        lo = hi + 1
+        hi = lo + step
+        step *= 2
+    return bisect_left(values, target, lo, min(hi, len(values)))
+
+
+def decode_varints(buf, start, end):
+    """Yields the varints stored in ``buf[start:end]``."""
+    value = shift = 0
+    for byte in buf[start:end]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+def decode_varint(buf, offset):
+    """Returns the varint at ``buf[offset]`` and the offset right after it."""
+    value = shift = 0
+    while True:
+        byte = buf[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_positions(positions, out):
+    """Appends one posting's positions: byte length, then gaps."""
+    entry, prev = bytearray(), 0
+    for position in positions:
+        encode_varint(position - prev, entry)
+        prev = position
+    encode_varint(len(entry), out)
+    out += entry
+
+
+def decode_postings(buf, start, end, doc_id):
+    """Decodes (doc id gap, freq) pairs of ``buf[start:end]``, gaps counted from ``doc_id``."""
+    values = decode_varints(buf, start, end)
+    res = []
+    for gap in values:
+        doc_id += gap
+        res.append((doc_id, next(values)))
+    return res
+
+
+def write_index(path, res, doc_ids, positions=None):
+    """Writes ``res`` (term -> {doc name: freq}) to ``path``.
+
+    ``doc_ids`` maps doc names to integer ids. ``positions`` optionally maps
+    terms to {doc name: sorted positions} for phrase and NEAR queries.
+    """
+    def items():
+        for term in sorted(res, key=lambda term: term.encode("utf-8")):
+            docs = sorted((doc_ids[doc], freq, doc) for doc, freq in res[term].items())
+            yield term, [(doc_id, freq) for doc_id, freq, _ in docs], \
+                [positions[term][doc] for _, _, doc in docs] if positions is not None else None
+
+    n_docs = max(doc_ids.values()) + 1 if doc_ids else 0
+    write_postings(path, n_docs, items(), positions is not None)
+
+
+def write_postings(path, n_docs, items, with_positions=False):
+    """Writes an index from ``(term, [(doc id, freq), ...], [positions, ...] or None)`` items.
+
+    Items come in the order of the terms' UTF-8 bytes with postings sorted
+    by doc id, so an index can be written from a stream (e.g. a merge of
+    other indexes) without holding all of it as Python objects. The file is
+    written next to ``path`` and then renamed, so readers never see a
+    partial index.
+    """
+    doc_lengths = array.array("I", [0] * n_docs)
+    blob = bytearray()
+    postings = bytearray()
+    positions_section = bytearray()
+    entries = []
+    for term, docs, term_positions in items:
+        encoded = term.encode("utf-8")
+        start, prev = len(postings), 0
+        stream, skips = bytearray(), []
+        positions_start, positions_stream, positions_blocks = len(positions_section), bytearray(), []
+        for i, (doc_id, freq) in enumerate(docs):
+            if i % BLOCK == 0 and i:
+                skips.append((prev, block_offset))
+            if i % BLOCK == 0:
+                block_offset = len(stream)
+                positions_blocks.append(len(positions_stream))
+            if with_positions:
+                encode_positions(term_positions[i], positions_stream)
+            encode_varint(doc_id - prev, stream)
+            encode_varint(freq, stream)
+            doc_lengths[doc_id] += freq
+            prev = doc_id
+        if len(docs) > BLOCK:
+            skips.append((prev, block_offset))
+            for skip in skips:
+                postings += SKIP.pack(*skip)
+        postings += stream
+        if with_positions:
+            if len(docs) > BLOCK:
+                positions_section += struct.pack("<{}I".format(len(positions_blocks)), *positions_blocks)
+            positions_section += positions_stream
+        max_freq = max(freq for _, freq in docs) if docs else 0
+        entries.append((len(blob), len(encoded), start, len(postings) - start, len(docs), max_freq,
+                        positions_start, sum(freq for _, freq in docs)))
+        blob += encoded
+
+    table_offset = HEADER.size
+    blob_offset = table_offset + ENTRY.size * len(entries)
+    postings_offset = blob_offset + len(blob)
+    doc_lengths_offset = postings_offset + len(postings)
+    positions_offset = doc_lengths_offset + 4 * n_docs if with_positions else 0
+    if sys.byteorder != "little":
+        doc_lengths.byteswap()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries), n_docs,
+                            table_offset, blob_offset, postings_offset, doc_lengths_offset,
+                            sum(doc_lengths), min(doc_lengths) if n_docs else 0, positions_offset))
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+        f.write(blob)
+        f.write(postings)
+        f.write(doc_lengths.tobytes())
+        f.write(positions_section)
+    os.replace(tmp_path, path)
+
+
+def convert(index_path, docs_path, out_path):
+    """Converts ``index.json`` + ``docs.json`` to the binary format."""
+    with open(index_path) as json_file:
+        res = json.load(json_file)
+    with open(docs_path) as json_file:
+        doc_ids = {doc: int(i) for i, doc in json.load(json_file).items()}
+    write_index(out_path, res, doc_ids)
+
+
+class ListCursor:
+    """Walks a posting list in doc id order.
+
+    ``doc``/``freq`` are the current posting, ``doc`` is ``None`` once the
+    list is exhausted. ``seek`` gallops forward to the first doc id not
+    smaller than the target.
+    """
+
+    def __init__(self, postings, max_freq=None):
+        self.docs = [doc_id for doc_id, _ in postings]
+        self.freqs = [freq for _, freq in postings]
+        self.df = len(postings)
+        self.max_freq = max_freq if max_freq is not None else max(self.freqs, default=0)
+        self.pos = 0
+
+    @property
+    def doc(self):
+        return self.docs[self.pos] if self.pos < len(self.docs) else None
+
+    @property
+    def freq(self):
+        return self.freqs[self.pos]
+
+    def advance(self):
+        self.pos += 1
+        return self.doc
+
+    def seek(self, doc_id):
+        self.pos = gallop(self.docs, doc_id, self.pos)
+        return self.doc
+
+    def positions(self):
+        """Positions of the term in the current doc, ``None`` when the index has none."""
+        return None
+
+    def all(self):
+        """Every remaining doc id of the list, the cursor is exhausted afterwards."""
+        res = self.docs[self.pos:]
+        self.pos = len(self.docs)
+        return res
+
+
+class PostingCursor(ListCursor):
+    """``ListCursor`` decoding a binary posting list one block at a time."""
+
+    def __init__(self, buf, start, length, df, max_freq, positions_start=None):
+        self.buf = buf
+        self.df = df
+        self.max_freq = max_freq
+        self.end = start + length
+        n_blocks = -(-df // BLOCK) if df > BLOCK else 0
+        self.stream = start + SKIP.size * n_blocks
+        # last doc id and byte offset of every block
+        self.skips = [SKIP.unpack_from(buf, start + SKIP.size * i) for i in range(n_blocks)]
+        self.last_docs = [last_doc for last_doc, _ in self.skips]
+        self.positions_blocks = None
+        if positions_start is not None:
+            self.positions_blocks = list(struct.unpack_from("<{}I".format(n_blocks), buf, positions_start)) \
+                if n_blocks else [0]
+            self.positions_stream = positions_start + 4 * n_blocks
+        self._load(0)
+
+    def _load(self, block):
+        self.block = block
+        self.pos = 0
+        # (posting index in the block, offset of its positions entry)
+        self._positions_at = None
+        if not self.skips:
+            postings = decode_postings(self.buf, self.stream, self.end, 0) if block == 0 else []
+        elif block < len(self.skips):
+            base = self.skips[block - 1][0] if block else 0
+            end = self.stream + self.skips[block + 1][1] if block + 1 < len(self.skips) else self.end
+            postings = decode_postings(self.buf, self.stream + self.skips[block][1], end, base)
+        else:
+            postings = []
+        self.docs = [doc_id for doc_id, _ in postings]
+        self.freqs = [freq for _, freq in postings]
+
+    def advance(self):
+        self.pos += 1
+        if self.pos >= len(self.docs) and self.docs:
+            self._load(self.block + 1)
+        return self.doc
+
+    def seek(self, doc_id):
+        if self.skips and self.docs and doc_id > self.docs[-1]:
+            self._load(bisect_left(self.last_docs, doc_id, self.block + 1))
+        return super().seek(doc_id)
+
+    def positions(self):
+        if self.positions_blocks is None or self.doc is None:
+            return None
+        pos, offset = self._positions_at or (0, self.positions_stream + self.positions_blocks[self.block])
+        if pos > self.pos:
+            pos, offset = 0, self.positions_stream + self.positions_blocks[self.block]
+        while pos < self.pos:
+            length, offset = decode_varint(self.buf, offset)
+            pos, offset = pos + 1, offset + length
+        self._positions_at = (pos, offset)
+        length, start = decode_varint(self.buf, offset)
+        res, position = [], 0
+        for gap in decode_varints(self.buf, start, start + length):
+            position += gap
+            res.append(position)
+        return res
+
+    def all(self):
+        res = []
+        while self.docs:
+            res.extend(self.docs[self.pos:])
+            self._load(self.block + 1)
+        return res
+
+
+class BinaryIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_terms, self.n_docs, self.table_offset, self.blob_offset, self.postings_offset, \
+            self.doc_lengths_offset, self.total_length, self.min_doc_length, self.positions_offset = \
+            HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.buf.close()
+            raise ValueError("{} is not a binary index of version {}".format(path, VERSION))
+        self.avg_doc_length = self.total_length / self.n_docs if self.n_docs else 0.
+
+    @property
+    def has_positions(self):
+        return self.positions_offset != 0
+
+    def close(self):
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.n_terms
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self.buf, self.table_offset + i * ENTRY.size)
+
+    def _term_bytes(self, entry):
+        start = self.blob_offset + entry[0]
+        return self.buf[start:start + entry[1]]
+
+    def _find(self, term):
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            mid_key = self._term_bytes(entry)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def __contains__(self, term):
+        return self._find(term) is not None
+
+    def doc_freq(self, term):
+        entry = self._find(term)
+        return entry[4] if entry is not None else 0
+
+    def max_freq(self, term):
+        """Maximal frequency of ``term`` in a single document."""
+        entry = self._find(term)
+        return entry[5] if entry is not None else 0
+
+    def doc_length(self, doc_id):
+        return struct.unpack_from("<I", self.buf, self.doc_lengths_offset + 4 * doc_id)[0]
+
+    def postings(self, term):
+        """Returns ``[(doc id, freq), ...]`` sorted by doc id, empty for unknown terms."""
+        entry = self._find(term)
+        if entry is None:
+            return []
+        start = self.postings_offset + entry[2]
+        if entry[4] > BLOCK:
+            start += SKIP.size * -(-entry[4] // BLOCK)
+        return decode_postings(self.buf, start, self.postings_offset + entry[2] + entry[3], 0)
+
+    def cursor(self, term):
+        """``PostingCursor`` over the postings of ``term``, ``None`` for unknown terms."""
+        entry = self._find(term)
+        if entry is None:
+            return None
+        positions_start = self.positions_offset + entry[6] if self.has_positions else None
+        return PostingCursor(self.buf, self.postings_offset + entry[2], entry[3], entry[4], entry[5], positions_start)
+
+    def doc_ids(self):
+        return range(self.n_docs)
+
+    def terms(self):
+        for i in range(self.n_terms):
+            yield self._term_bytes(self._entry(i)).decode("utf-8")
+
+    def coll_freqs(self):
+        """Yields ``(term, collection frequency)`` in term order."""
+        for i in range(self.n_terms):
+            entry = self._entry(i)
+            yield self._term_bytes(entry).decode("utf-8"), entry[7]
+
+
+class DictIndex:
+    """``BinaryIndex`` interface over a parsed ``index.json``, for indexes built before index.bin."""
+
+    def __init__(self, res, doc_ids):
+        self.res = res
+        self.doc_ids = doc_ids
+        self.n_terms = len(res)
+        self.n_docs = max(doc_ids.values()) + 1 if doc_ids else 0
+        self.doc_lengths = [0] * self.n_docs
+        for postings in res.values():
+            for doc, freq in postings.items():
+                self.doc_lengths[doc_ids[doc]] += freq
+        self.total_length = sum(self.doc_lengths)
+        self.min_doc_length = min(self.doc_lengths, default=0)
+        self.avg_doc_length = self.total_length / self.n_docs if self.n_docs else 0.
+
+    def __len__(self):
+        return self.n_terms
+
+    def __contains__(self, term):
+        return term in self.res
+
+    def doc_freq(self, term):
+        return len(self.res.get(term, ()))
+
+    def max_freq(self, term):
+        return max(self.res.get(term, {}).values(), default=0)
+
+    def doc_length(self, doc_id):
+        return self.doc_lengths[doc_id]
+
+    def postings(self, term):
+        return sorted((self.doc_ids[doc], freq) for doc, freq in self.res.get(term, {}).items())
+
+    has_positions = False
+
+    def cursor(self, term):
+        return ListCursor(self.postings(term)) if term in self.res else None
+
+    def doc_ids(self):
+        return range(self.n_docs)
+
+    def terms(self):
+        return iter(sorted(self.res))
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("usage: python binindex.py drive_files/<client_id>")
+        sys.exit(1)
+    folder = sys.argv[1]
+    convert(os.path.join(folder, "index.json"), os.path.join(folder, "docs.json"),
+            os.path.join(folder, "index.bin"))
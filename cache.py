@@ -0,0 +1,282 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from gdriveloader import GDriveIndex
+from norwig_spellcheck import NorwigSpellcheck
+from suggest import Suggester
+
+
+class CacheEntry:
+    """Loaded search state of one client: index, url map and spellcheck vocabulary."""
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.index = GDriveIndex(client_id)
+        self.version = self.index.version
+        self.spellchecker = None
+        if self.index.exists:
+            self.index.open()
+            self.spellchecker = NorwigSpellcheck(client_id)
+
+    @property
+    def size(self):
+        return self.index.size + (self.spellchecker.size if self.spellchecker is not None else 0)
+
+
+class IndexCache:
+    """Process level LRU cache of ``CacheEntry`` objects keyed by client_id.
+
+    An entry is reloaded when the version (mtime and size) of the client's
+    index files changed, e.g. after a load or reload in another worker. The
+    least recently used entries are evicted once the estimated size of all
+    entries exceeds ``max_bytes``, the most recent one is always kept.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, client_id):
+        version = GDriveIndex(client_id).version
+        with self._lock:
+            entry = self._entries.get(client_id)
+            if entry is not None and entry.version == version:
+                self.hits += 1
+                metrics.CACHE_REQUESTS.inc(cache="index", result="hit")
+                self._entries.move_to_end(client_id)
+                return entry
+            if entry is not None:
+                self.invalidations += 1
+                del self._entries[client_id]
+            self.misses += 1
+            metrics.CACHE_REQUESTS.inc(cache="index", result="miss")
+
+        # loaded outside of the lock, so other clients are not blocked by it
+        entry = CacheEntry(client_id)
+        with self._lock:
+            self._entries[client_id] = entry
+            self._entries.move_to_end(client_id)
+            while len(self._entries) > 1 and self.total_size > self.max_bytes:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, client_id):
+        with self._lock:
+            if self._entries.pop(client_id, None) is not None:
+                self.invalidations += 1
+
+    @property
+    def total_size(self):
+        return sum(entry.size for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {"entries": len(self._entries), "size": self.total_size, "max_size": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / requests if requests else 0.,
+                    "invalidations": self.invalidations, "evictions": self.evictions}
+
+
+class SuggestCache:
+    """Opened ``suggest.bin`` of the current build of the last ``max_entries`` clients.
+
+    Completions only need this file, the index itself is not loaded. A new
+    build has a new path, so the file of a finished load is opened on the
+    next request. Dropped files are not closed, a request may still read
+    them; the mmap is released with the last reference.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # client_id -> (path, Suggester)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, client_id):
+        """``Suggester`` of the client, ``None`` for an index without completions."""
+        path = GDriveIndex(client_id).suggest_path
+        with self._lock:
+            entry = self._entries.get(client_id)
+            if entry is not None and entry[0] == path:
+                self._entries.move_to_end(client_id)
+                return entry[1]
+        try:
+            suggester = Suggester(path)
+        except (OSError, ValueError):
+            # built by an older version
+            return None
+        with self._lock:
+            self._entries[client_id] = (path, suggester)
+            self._entries.move_to_end(client_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return suggester
+
+
+# rough memory of an entry besides its key and value: tuple, dict slot and string headers
+QUERY_ENTRY_OVERHEAD = 200
+
+
+class QueryCache:
+    """Process level LRU cache of serialized ``/api/search`` responses.
+
+    Keys are ``(client_id, digest)`` where the digest covers the analyzed
+    query tree, the page and the index version, so a new build or a delete
+    (both publish a new build folder) makes older entries unreachable. Entries
+    expire after ``ttl`` seconds, the least recently used ones are evicted
+    once all entries exceed ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (expiry time, value, size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                metrics.CACHE_REQUESTS.inc(cache="query", result="hit")
+                self._entries.move_to_end(key)
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            metrics.CACHE_REQUESTS.inc(cache="query", result="miss")
+            return None
+
+    def put(self, key, value):
+        size = len(key[0]) + len(key[1]) + len(value) + QUERY_ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        self.size -= self._entries.pop(key)[2]
+
+    def invalidate(self, client_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == client_id]:
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {"backend": "memory", "entries": len(self._entries), "size": self.size,
+                    "max_size": self.max_bytes, "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / requests if requests else 0., "evictions": self.evictions}
+
+
+class SqliteQueryCache:
+    """``QueryCache`` stored in an SQLite file shared by all worker processes.
+
+    Every process sees the entries the others stored. Least recently used
+    entries are deleted once the stored values exceed ``max_bytes``.
+    """
+
+    def __init__(self, path, max_bytes, ttl):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (client TEXT, key TEXT PRIMARY KEY, value TEXT, "
+                       "size INTEGER, expires REAL, used REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+
+    def _connection(self):
+        # sqlite3 connections can not be shared between threads, nor with
+        # the workers forked from a gunicorn master that preloaded the app
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            self._local.pid = os.getpid()
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def get(self, key):
+        now = time.time()
+        try:
+            with self._connection() as db:
+                row = db.execute("SELECT value FROM entries WHERE key = ? AND expires > ?", (key[1], now)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key[1]))
+        except sqlite3.Error:
+            row = None
+        if row is not None:
+            self.hits += 1
+            metrics.CACHE_REQUESTS.inc(cache="query", result="hit")
+            return row[0]
+        self.misses += 1
+        metrics.CACHE_REQUESTS.inc(cache="query", result="miss")
+        return None
+
+    def put(self, key, value):
+        size = len(key[1]) + len(value)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._connection() as db:
+                db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+                db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                           (key[0], key[1], value, size, now + self.ttl, now))
+                total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                while total > self.max_bytes:
+                    # the least recently used tenth at a time
+                    rows = db.execute("SELECT key, size FROM entries ORDER BY used LIMIT MAX(1, "
+                                      "(SELECT COUNT(*) FROM entries) / 10)").fetchall()
+                    db.executemany("DELETE FROM entries WHERE key = ?", [(row[0],) for row in rows])
+                    total -= sum(row[1] for row in rows)
+        except sqlite3.Error:
+            # the cache is an optimization, a busy or broken file only costs hits
+            pass
+
+    def invalidate(self, client_id):
+        try:
+            with self._connection() as db:
+                db.execute("DELETE FROM entries WHERE client = ?", (client_id,))
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        requests = self.hits + self.misses
+        res = {"backend": "sqlite", "max_size": self.max_bytes, "ttl": self.ttl, "hits": self.hits,
+               "misses": self.misses, "hit_rate": self.hits / requests if requests else 0.}
+        try:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            res.update(entries=entries, size=size)
+        except sqlite3.Error:
+            pass
+        return res
@@ -0,0 +1,185 @@
+"""Compressed text of the indexed documents, for result snippets.
+
+Every segment has a store file next to it (``seg_NNNNNN.docs``) holding the
+extracted text of its documents, opened with mmap. Layout (little endian)::
+
+    header      magic "GDDS", version, number of docs, number of blocks,
+                UTF-8 bytes of the text, offsets of the tables below
+    blocks      zlib compressed UTF-8 text blocks one after another
+    block table offset and length of every block
+    doc table   first block, number of blocks and UTF-8 bytes of the text of
+                every doc, by local doc id
+
+A document's text is cut into blocks of about BLOCK_CHARS characters at
+word boundaries, so a word is never split between two blocks and a block
+can be searched on its own. A snippet decompresses the blocks of its
+document one at a time and stops at the first one containing a query term.
+"""
+import html
+import mmap
+import os
+import struct
+import zlib
+
+from analyzer import TOKEN_RE
+
+MAGIC = b"GDDS"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQQQ")
+BLOCK = struct.Struct("<QI")
+DOC = struct.Struct("<IIQ")
+# characters of text compressed together, a snippet decompresses at least one block
+BLOCK_CHARS = 1 << 14
+# characters of text shown around the first match
+SNIPPET_CHARS = 200
+
+
+def store_name(segment_file):
+    return os.path.splitext(segment_file)[0] + ".docs"
+
+
+class BlockCompressor:
+    """Compresses a stream of text chunks into blocks as it passes through.
+
+    ``feed`` wraps a chunk iterator and yields the chunks unchanged, so the
+    text is stored while it is analyzed and never held as a whole. ``blocks``
+    are the compressed blocks once the stream is consumed.
+    """
+
+    def __init__(self, block_chars=BLOCK_CHARS):
+        self.block_chars = block_chars
+        self.blocks = []
+        self.text_bytes = 0
+        self._buf = ""
+
+    def feed(self, chunks):
+        for chunk in chunks:
+            yield chunk
+            buf = self._buf + chunk
+            pos = 0
+            while len(buf) - pos >= self.block_chars:
+                cut = pos + self.block_chars
+                # back to the start of the word crossing the limit
+                while cut > pos and buf[cut - 1].isalpha():
+                    cut -= 1
+                if cut == pos:
+                    # a single word longer than a block
+                    cut = pos + self.block_chars
+                self._add(buf[pos:cut])
+                pos = cut
+            self._buf = buf[pos:]
+        if self._buf:
+            self._add(self._buf)
+            self._buf = ""
+
+    def _add(self, text):
+        data = text.encode("utf-8")
+        self.text_bytes += len(data)
+        self.blocks.append(zlib.compress(data))
+
+    @property
+    def size(self):
+        return sum(len(block) for block in self.blocks)
+
+
+def write(path, docs):
+    """Writes a store of ``docs``, an iterable of ``(compressed blocks, UTF-8 bytes of the text)`` of
+    every doc by local doc id. Blocks are written as they come, the header last."""
+    block_table = bytearray()
+    doc_table = bytearray()
+    n_docs = n_blocks = text_bytes = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        offset = HEADER.size
+        for blocks, size in docs:
+            doc_table += DOC.pack(n_blocks, len(blocks), size)
+            for block in blocks:
+                f.write(block)
+                block_table += BLOCK.pack(offset, len(block))
+                offset += len(block)
+            n_docs += 1
+            n_blocks += len(blocks)
+            text_bytes += size
+        f.write(block_table)
+        f.write(doc_table)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, n_docs, n_blocks, text_bytes, offset, offset + len(block_table)))
+    os.replace(tmp_path, path)
+
+
+class DocStore:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_docs, self.n_blocks, self.text_bytes, self.blocks_start, self.docs_start = \
+            HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.buf.close()
+            raise ValueError("{} is not a document store of version {}".format(path, VERSION))
+
+    def close(self):
+        self.buf.close()
+
+    def raw(self, doc_id):
+        """``(compressed blocks, UTF-8 bytes of the text)`` of a doc, copied as is by a merge."""
+        first, count, size = DOC.unpack_from(self.buf, self.docs_start + doc_id * DOC.size)
+        blocks = []
+        for i in range(first, first + count):
+            offset, length = BLOCK.unpack_from(self.buf, self.blocks_start + i * BLOCK.size)
+            blocks.append(self.buf[offset:offset + length])
+        return blocks, size
+
+    def blocks(self, doc_id):
+        """Yields the text blocks of a doc, each decompressed when it is reached."""
+        first, count, _ = DOC.unpack_from(self.buf, self.docs_start + doc_id * DOC.size)
+        for i in range(first, first + count):
+            offset, length = BLOCK.unpack_from(self.buf, self.blocks_start + i * BLOCK.size)
+            yield zlib.decompress(self.buf[offset:offset + length]).decode("utf-8")
+
+    def text(self, doc_id):
+        return "".join(self.blocks(doc_id))
+
+
+def snippet(blocks, terms, analyzer, width=SNIPPET_CHARS):
+    """HTML snippet of about ``width`` characters around the first word analyzed to one of ``terms``.
+
+    Text is escaped and the matching words are wrapped in ``<mark>``. Blocks
+    after the first one with a match are not read. Without any match the
+    snippet is the start of the text; ``None`` if there is no text.
+    """
+    first = None
+    for block in blocks:
+        if first is None:
+            first = block
+        for match in TOKEN_RE.finditer(block):
+            if _is_term(match.group(), terms, analyzer):
+                return _render(block, max(0, match.start() - width // 4), width, terms, analyzer)
+    if first is None:
+        return None
+    return _render(first, 0, width, terms, analyzer)
+
+
+def _is_term(word, terms, analyzer):
+    word = word.lower()
+    return word not in analyzer.stopwords and analyzer.stem(word) in terms
+
+
+def _render(text, start, width, terms, analyzer):
+    end = min(len(text), start + width)
+    # whole words only at both ends
+    while start > 0 and text[start - 1].isalpha():
+        start -= 1
+    while end < len(text) and text[end].isalpha():
+        end += 1
+    parts = ["…"] if start > 0 else []
+    pos = start
+    for match in TOKEN_RE.finditer(text, start, end):
+        if _is_term(match.group(), terms, analyzer):
+            parts.append(html.escape(text[pos:match.start()]))
+            parts.append("<mark>{}</mark>".format(html.escape(match.group())))
+            pos = match.end()
+    parts.append(html.escape(text[pos:end]))
+    if end < len(text):
+        parts.append("…")
+    return " ".join("".join(parts).split())
@@ -0,0 +1,110 @@
+"""Drive API clients shared by requests made with the same credentials.
+
+Building a service parses the discovery document and opens new
+connections, so services are cached per credentials instead of being built
+for every request. httplib2 connections are not thread safe, every thread
+keeps its own small cache. The discovery document is bundled in
+``discovery/drive.v3.json`` and read once per process, it is never fetched.
+The Google client libraries are imported on the first service built.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+API_SERVICE_NAME = 'drive'
+API_VERSION = 'v3'
+DISCOVERY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery",
+                              "{}.{}.json".format(API_SERVICE_NAME, API_VERSION))
+
+# services kept per thread, the least recently used one is dropped first
+MAX_SERVICES = 32
+# maximal number of calls in one batch request allowed by Drive
+BATCH_SIZE = 100
+# statuses of batch items worth retrying, a 403 only with one of RATE_LIMIT_REASONS
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+_local = threading.local()
+_document = None
+
+
+def discovery_document():
+    """Text of the bundled discovery document, read once per process.
+
+    The text and not the parsed dict is kept: the client library modifies
+    the dict it is built from while the service is used, every service
+    parses its own copy.
+    """
+    global _document
+    if _document is None:
+        with open(DISCOVERY_PATH, encoding="utf-8") as f:
+            _document = f.read()
+    return _document
+
+
+def get_drive(credentials):
+    """Drive service for ``credentials`` (the dict kept in the session)."""
+    services = getattr(_local, "services", None)
+    if services is None:
+        services = _local.services = OrderedDict()
+    # the access token changes on refresh, the refresh token does not
+    key = (credentials["client_id"], credentials.get("refresh_token") or credentials["token"])
+    drive = services.get(key)
+    if drive is None:
+        import google.oauth2.credentials
+        import google_auth_httplib2
+        import googleapiclient.discovery
+        import httplib2
+        http = google_auth_httplib2.AuthorizedHttp(google.oauth2.credentials.Credentials(**credentials),
+                                                   http=httplib2.Http())
+        drive = services[key] = googleapiclient.discovery.build_from_document(discovery_document(), http=http)
+    services.move_to_end(key)
+    while len(services) > MAX_SERVICES:
+        services.popitem(last=False)
+    return drive
+
+
+def delete_files(drive, file_ids, retries=5):
+    """Deletes files with batch requests of up to ``BATCH_SIZE`` calls.
+
+    Returns file id -> error message or ``None`` if the file is deleted (or
+    was already gone). Items failing with a rate limit or server error are
+    retried in a later batch with randomized exponential backoff, other
+    errors (a 403 for missing permissions) fail at once.
+    """
+    res = {}
+    pending = list(dict.fromkeys(file_ids))
+
+    def callback(file_id, response, exception):
+        status = getattr(getattr(exception, "resp", None), "status", None)
+        if exception is None or status == 404:
+            res[file_id] = None
+        else:
+            res[file_id] = str(exception)
+            if status in RETRY_STATUSES and (status != 403 or rate_limited(exception)):
+                retry.append(file_id)
+
+    for attempt in range(retries + 1):
+        retry = []
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = drive.new_batch_http_request(callback=callback)
+            for file_id in pending[start:start + BATCH_SIZE]:
+                batch.add(drive.files().delete(fileId=file_id), request_id=file_id)
+            batch.execute()
+        if not retry or attempt == retries:
+            break
+        time.sleep(random.random() * 2 ** attempt)
+        pending = retry
+    return res
+
+
+def rate_limited(exception):
+    """Whether an ``HttpError`` is a rate limit, Drive answers both them and missing permissions with 403."""
+    try:
+        errors = json.loads(exception.content.decode("utf-8"))["error"].get("errors", [])
+    except (AttributeError, ValueError, KeyError, TypeError):
+        return False
+    return any(isinstance(error, dict) and error.get("reason") in RATE_LIMIT_REASONS for error in errors)
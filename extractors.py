@@ -0,0 +1,172 @@
+"""Text extractors by mimeType.
+
+An extractor is ``function(path, chunk_size)`` yielding the text of a file
+in chunks of about ``chunk_size`` characters. docx and pptx are zip
+archives of XML parts, their text is streamed out of the parts with
+``iterparse`` in the process, without textract. Types without an extractor
+(``.doc``, ``.ppt``) and files an extractor fails on go to textract
+(``gdriveloader.FileText``).
+
+Native Google Docs and Slides have no content to download, they are
+exported as plain text (``EXPORTS``) and saved with their own extension,
+which maps back to the plain text extractor.
+"""
+import io
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+DOC = "application/msword"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PPT = "application/vnd.ms-powerpoint"
+PPTX = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+PDF = "application/pdf"
+TEXT = "text/plain"
+
+# Google Workspace type -> (export mimeType, extension of the local copy)
+EXPORTS = {
+    "application/vnd.google-apps.document": (TEXT, "gdoc"),
+    "application/vnd.google-apps.presentation": (TEXT, "gslides"),
+}
+
+# extension -> mimeType, for files known by their local name only
+EXTENSIONS = {"doc": DOC, "docx": DOCX, "ppt": PPT, "pptx": PPTX, "pdf": PDF, "txt": TEXT,
+              "gdoc": TEXT, "gslides": TEXT}
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DRAWING_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+WORD_PARTS_RE = re.compile(r"word/(header|footer)\d*\.xml$|word/(footnotes|endnotes)\.xml$")
+SLIDE_RE = re.compile(r"ppt/slides/slide(\d+)\.xml$")
+
+
+def extension(name):
+    return name.rsplit(".", 1)[-1].lower() if "." in name else None
+
+
+def mime_type_of(name):
+    """mimeType of a local file by its extension, ``None`` if unknown."""
+    return EXTENSIONS.get(extension(os.path.basename(name)))
+
+
+def is_supported(name, mime_type=None):
+    """Whether a Drive file can be indexed."""
+    return mime_type in EXPORTS or extension(name) in EXTENSIONS
+
+
+def local_name(file):
+    """Name of the local copy of a Drive file, exported files get the extension of their export."""
+    export = EXPORTS.get(file.get("mimeType"))
+    return "{}.{}".format(file["name"], export[1]) if export is not None else file["name"]
+
+
+def content_type(file):
+    """mimeType of the local copy of a Drive file, the export type for Google Docs and Slides."""
+    export = EXPORTS.get(file.get("mimeType"))
+    return export[0] if export is not None else file.get("mimeType")
+
+
+def chunked(pieces, chunk_size):
+    """Joins small text pieces into chunks of ``chunk_size`` characters, the last one may be shorter."""
+    buf, size = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            text = "".join(buf)
+            end = len(text) - len(text) % chunk_size
+            for start in range(0, end, chunk_size):
+                yield text[start:start + chunk_size]
+            buf, size = [text[end:]], len(text) - end
+    text = "".join(buf)
+    if text:
+        yield text
+
+
+def xml_text(part, text_tag, paragraph_tag, break_tags):
+    """Yields the text of the ``text_tag`` elements of an XML part as it is parsed.
+
+    Paragraphs and ``break_tags`` (tabs, line breaks) are separated by a
+    space, runs of a paragraph are joined as is.
+    """
+    for _, element in ElementTree.iterparse(part, events=("end",)):
+        if element.tag == text_tag:
+            if element.text:
+                yield element.text
+        elif element.tag in break_tags:
+            yield " "
+        elif element.tag == paragraph_tag:
+            yield " "
+            # the paragraph has been read, drop its subtree
+            element.clear()
+
+
+def docx_text(path, chunk_size):
+    with zipfile.ZipFile(path) as archive:
+        names = ["word/document.xml"] + sorted(name for name in archive.namelist() if WORD_PARTS_RE.match(name))
+
+        def pieces():
+            for name in names:
+                with archive.open(name) as part:
+                    yield from xml_text(part, WORD_NS + "t", WORD_NS + "p", (WORD_NS + "tab", WORD_NS + "br"))
+
+        yield from chunked(pieces(), chunk_size)
+
+
+def pptx_text(path, chunk_size):
+    with zipfile.ZipFile(path) as archive:
+        slides = sorted((int(match.group(1)), name) for name in archive.namelist()
+                        for match in [SLIDE_RE.match(name)] if match)
+
+        def pieces():
+            for _, name in slides:
+                with archive.open(name) as part:
+                    yield from xml_text(part, DRAWING_NS + "t", DRAWING_NS + "p", (DRAWING_NS + "br",))
+
+        yield from chunked(pieces(), chunk_size)
+
+
+def pdf_text(path, chunk_size):
+    # pdfminer is slow to import, only loads that have a pdf pay for it
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+
+    def pieces():
+        for page in extract_pages(path):
+            for element in page:
+                if isinstance(element, LTTextContainer):
+                    yield element.get_text()
+
+    yield from chunked(pieces(), chunk_size)
+
+
+def read_chunks(f, chunk_size):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def plain_text(path, chunk_size):
+    """UTF-8 text, cp1251 when it does not decode as UTF-8. The file is decoded once without
+    keeping anything, so the encoding is known before any text is handed out."""
+    encoding, errors = 'utf-8', 'strict'
+    try:
+        with io.open(path, 'r', encoding=encoding) as f:
+            for _ in read_chunks(f, chunk_size):
+                pass
+    except UnicodeDecodeError:
+        # a few bytes are undefined in cp1251
+        encoding, errors = 'cp1251', 'replace'
+    with io.open(path, 'r', encoding=encoding, errors=errors) as f:
+        yield from read_chunks(f, chunk_size)
+
+
+# mimeType -> extractor
+EXTRACTORS = {DOCX: docx_text, PPTX: pptx_text, PDF: pdf_text, TEXT: plain_text}
+
+
+def get(mime_type):
+    """Extractor of the mimeType, ``None`` when only textract can read it."""
+    return EXTRACTORS.get(mime_type)
@@ -1,219 +1,1039 @@
+import heapq
 import io
 import json
+import multiprocessing
 import os
+import queue
+import shutil
+import threading
+import time
 from collections import Counter
+from contextlib import contextmanager
+from itertools import repeat
 from datetime import datetime
 
-import nltk
-import textract
-from googleapiclient.http import MediaIoBaseDownload
-from nltk.corpus import stopwords
+import binindex
+import docstore
+import extractors
+import metrics
+import query_engine
+import ranking
+import segments
+import suggest
+from analyzer import Analyzer, get_analyzer
+from symspell import SymSpell
 
+# characters of extracted text handed to the analyzer at once
+TEXT_CHUNK = 1 << 20
+# start method of the indexing processes: loads run in threads of a threaded server process, a
+# forked child would inherit locks held by other threads (logging, metrics, caches) and could
+# deadlock on them; a fork server is a clean single threaded process, spawn where there is none
+INDEX_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+# imported once by the fork server, its children start with them
+INDEX_PRELOAD = ["gdriveloader", "nltk.corpus", "nltk.stem.snowball", "pdfminer.high_level"]
 
-def is_apt(word):
-    russian_stopwords = set(stopwords.words("russian"))
-    english_stopwords = set(stopwords.words("english"))
-    ru_en_stopwords = russian_stopwords.union(english_stopwords)
-    return word.isalpha() and word not in ru_en_stopwords
 
+class FileText:
+    """Text of a downloaded file as a stream of chunks of at most ``chunk_size`` characters.
 
-def preprocess(sent):
-    prep = nltk.word_tokenize(sent.lower())
-    prep = [w for w in prep if is_apt(w)]
-    return prep
+    The extractor is picked by ``mime_type``, or by the extension of the file
+    when it is not given (``extractors``). Files without an extractor, and
+    files their extractor fails on before handing out any text, go through
+    textract, which returns the whole text at once; it is handed out in
+    chunks as well. ``error`` is set when no text could be extracted,
+    ``empty`` tells whether the stream had no text after it was consumed.
+    ``seconds`` is the time spent extracting, without the time the consumer
+    spent on the chunks.
+    """
+
+    def __init__(self, path, chunk_size=TEXT_CHUNK, mime_type=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.mime_type = mime_type
+        self.error = None
+        self.empty = True
+        self.textract_failed = False
+        self.seconds = 0.
+
+    def _timed_chunks(self):
+        chunks = self._chunks()
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            self.seconds += time.perf_counter() - start
+            if chunk is None:
+                return
+            yield chunk
+
+    def __iter__(self):
+        carry = ''
+        for chunk in self._timed_chunks():
+            # a literal "\\n" may be cut between two chunks
+            text = carry + chunk
+            carry = '\\' if text.endswith('\\') else ''
+            text = text[:len(text) - len(carry)]
+            text = text.replace('\\n', ' ').replace('\\r', '').replace("\n", " ").replace("\r", "")
+            if text:
+                self.empty = False
+                yield text
+        if carry:
+            self.empty = False
+            yield carry
+
+    def _chunks(self):
+        extract = extractors.get(self.mime_type) or extractors.get(extractors.mime_type_of(self.path))
+        if extract is not None:
+            extracted = False
+            try:
+                for chunk in extract(self.path, self.chunk_size):
+                    extracted = True
+                    yield chunk
+                return
+            except Exception as e:
+                if extracted:
+                    # part of the text is indexed already, textract would repeat it
+                    self.error = str(e)
+                    return
+        yield from self._textract_chunks()
+
+    def _textract_chunks(self):
+        ext = os.path.split(self.path)[-1].split(".")[-1]
+        # imported on first use, a missing textract still fails loudly
+        import textract
+        try:
+            texts = textract.process(self.path, extension=ext)
+        except Exception:
+            self.textract_failed = True
+            try:
+                with open(self.path, 'rb') as f:
+                    yield from extractors.read_chunks(io.TextIOWrapper(f, encoding='cp1251'), self.chunk_size)
+            except Exception as e2:
+                self.error = str(e2)
+            return
+        try:
+            texts = texts.decode("utf-8", errors="replace")
+        except:
+            texts = str(texts)
+        for start in range(0, len(texts), self.chunk_size):
+            yield texts[start:start + self.chunk_size]
+
+
+def index_file(path, stemming=False, positions=False, mime_type=None, store=False):
+    """Extracts and analyzes one downloaded file, then removes it.
+
+    Module level so that it can be run in a worker process. The text is
+    analyzed chunk by chunk as it is extracted, by the extractor of
+    ``mime_type`` (of the extension if ``None``), and compressed on the way
+    with ``store``. Returns ``(file name, Counter of terms or None if there is
+    no text, error or None, term -> positions if ``positions`` else None,
+    {"seconds": extraction time, "textract_failed": ...}, docstore.BlockCompressor
+    with the text if ``store`` else None, Counter of the words before stemming
+    if ``stemming`` else None)``.
+    """
+    name = os.path.basename(path)
+    text = FileText(path, mime_type=mime_type)
+    stored = docstore.BlockCompressor() if store else None
+    chunks = stored.feed(text) if store else text
+    words = Counter() if stemming else None
+    try:
+        analyzer = get_analyzer(stemming)
+        try:
+            if positions:
+                term_positions = analyzer.term_positions(chunks, words)
+            else:
+                counts = analyzer.term_counts(chunks, words=words)
+        finally:
+            os.remove(path)
+        stats = {"seconds": text.seconds, "textract_failed": text.textract_failed}
+        if text.empty:
+            return name, None, text.error, None, stats, None, None
+        if positions:
+            return name, Counter({term: len(p) for term, p in term_positions.items()}), text.error, \
+                term_positions, stats, stored, words
+        return name, counts, text.error, None, stats, stored, words
+    except Exception as e:
+        return name, None, str(e), None, {"seconds": text.seconds, "textract_failed": text.textract_failed}, \
+            None, None
+
+
+def _index_file(args):
+    return index_file(*args)
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def dump_json(obj, path):
+    """Writes a JSON file by replacing it, files of a build may be hard links shared with the previous one."""
+    with open(path + ".tmp", "w") as json_file:
+        json.dump(obj, json_file)
+    os.replace(path + ".tmp", path)
+
+
+# rough ratio of memory taken by a parsed JSON file to its size on disk
+JSON_OVERHEAD = 4
+
+# Drive file fields kept for every listed file; md5Checksum, modifiedTime and
+# version go to the manifest used by incremental reloads
+FILE_FIELDS = "id, name, mimeType, webViewLink, md5Checksum, modifiedTime, version, size"
 
 
 class GDriveFiles:
-    def __init__(self, drive, client_id, logger):
+    """Downloads the drive of a client and builds its index.
+
+    Every load works in a new build folder under ``drive_files/.builds/<client_id>``
+    (an incremental one starts from a copy of the current index), and
+    ``drive_files/<client_id>`` is a symlink switched to the finished build,
+    so searches never see a partially written index. ``progress(counter, n)``
+    is called as files are listed, downloaded, extracted and indexed.
+    """
+
+    def __init__(self, drive, client_id, logger, workers=8, retries=5, index_workers=1, stemming=False,
+                 positions=False, progress=None, chunk_size=8 * 1024 * 1024, max_file_size=None,
+                 segment_budget=64 * 1024 * 1024, store=False):
         self.drive = drive
-        self.path_to_save = os.path.join("drive_files", client_id)
-        self.index_path = os.path.join("drive_files", client_id, "index.json")
-        self.files_urls_path = os.path.join("drive_files", client_id, "docs_urls.json")
-        self.terms_path = os.path.join("drive_files", client_id, "terms.json")
-        self.docs_id = os.path.join("drive_files", client_id, "docs.json")
+        # downloads are written to disk every ``chunk_size`` bytes, files
+        # larger than ``max_file_size`` (if set) are skipped
+        self.chunk_size = chunk_size
+        self.max_file_size = max_file_size
+        # number of parallel download threads and how many times a request
+        # is retried (with randomized exponential backoff) on 429/5xx
+        self.workers = max(1, workers)
+        self.retries = retries
+        # number of processes extracting text in build_index, 1 is serial
+        self.index_workers = max(1, index_workers)
+        # analyzer configuration of a full load, an incremental one keeps the
+        # configuration the index was built with
+        self.stemming = stemming
+        # whether term positions are indexed for phrase and NEAR queries
+        self.positions = positions
+        # estimated memory of postings collected before they are flushed as a segment
+        self.segment_budget = segment_budget
+        # whether the text of the documents is kept in a compressed store for snippets
+        self.store = store
+        self.store_bytes = self.store_text_bytes = 0
+        self.progress = progress or (lambda counter, n=1: None)
+        # files listed by the current load, local names of those whose download or extraction failed
+        self.files = []
+        self.failed = []
+        # download threads of the running load, sampled along with the load by a profile
+        self.threads = []
+        self._local = threading.local()
+        self.live_path = os.path.join("drive_files", client_id)
+        self.builds_path = os.path.join("drive_files", ".builds", client_id)
+        self._set_folder(self.live_path)
         self.logger = logger
 
+    def _set_folder(self, folder):
+        self.path_to_save = folder
+        self.files_urls_path = os.path.join(folder, "docs_urls.json")
+        self.suggest_path = os.path.join(folder, "suggest.bin")
+        self.docs_id = os.path.join(folder, "docs.json")
+        self.manifest_path = os.path.join(folder, "manifest.json")
+        self.spell_path = os.path.join(folder, "spell.json")
+        self.forms_path = os.path.join(folder, "forms.json")
+        self.analyzer_path = os.path.join(folder, "analyzer.json")
+
     @property
     def index_exists(self):
-        return os.path.exists(self.index_path)
+        return os.path.exists(os.path.join(self.live_path, segments.SEGMENTS_FILE)) or \
+            os.path.exists(os.path.join(self.live_path, "index.json"))
 
-    def load(self, fl=False):
-        if not self.index_exists or not fl:
+    def load(self, fl=False, incremental=False):
+        # an index.json of an older version without segments is replaced by a full load
+        if incremental and os.path.exists(os.path.join(self.live_path, segments.SEGMENTS_FILE)) \
+                and os.path.exists(os.path.join(self.live_path, "manifest.json")):
+            self._stage(copy=True)
+            self.total_start = datetime.now()
+            self.logger.debug("Updating started")
+            changed, removed = self.gdrive_get_changes()
+            self.logger.debug("Dowloading finished")
+            self.retrieve_time = self.download_end
+            self.retrieve_time_diff = (self.retrieve_time - self.total_start).total_seconds()
+            self.logger.debug("Updating index started")
+            self.update_index(changed, removed)
+            self._publish()
+            self.logger.debug("Updating index finished. Updating Finished")
+            self.total_time = datetime.now()
+            self.build_index_diff = (self.total_time - self.retrieve_time).total_seconds()
+            self.total_time_diff = (self.total_time - self.total_start).total_seconds()
+            self._merge()
+        elif not self.index_exists or not fl:
+            self._stage(copy=False)
             self.total_start = datetime.now()
             self.logger.debug("Loading started")
             self.gdrive_get_all_files()
             self.logger.debug("Dowloading finished")
-            self.retrieve_time = datetime.now()
+            self.retrieve_time = self.download_end
             self.retrieve_time_diff = (self.retrieve_time - self.total_start).total_seconds()
             self.logger.debug("Building index started")
             self.build_index()
+            self._publish()
             self.logger.debug("Building index finished. Loading Finished")
             self.total_time = datetime.now()
             self.build_index_diff = (self.total_time - self.retrieve_time).total_seconds()
             self.total_time_diff = (self.total_time - self.total_start).total_seconds()
+            self._merge()
+
+    def _merge(self):
+        """Merges segments of the published index, timed apart from the load."""
+        merge_start = datetime.now()
+        try:
+            self.merge_segments()
+        except Exception as e:
+            # the loaded index is published already, it is merged by a later load
+            self.logger.error("merging segments: {}".format(e))
+        self.merge_time_diff = (datetime.now() - merge_start).total_seconds()
+
+    def _stage(self, copy):
+        """Switches to a new build folder, a copy of the current index with ``copy``."""
+        folder = os.path.join(self.builds_path, datetime.now().strftime("%Y%m%d%H%M%S%f"))
+        os.makedirs(self.builds_path, exist_ok=True)
+        if copy:
+            # segments are never modified in place, hard links are enough
+            shutil.copytree(os.path.realpath(self.live_path), folder, copy_function=link_or_copy)
+        else:
+            os.makedirs(folder)
+        self._set_folder(folder)
+
+    def _publish(self):
+        """Atomically points ``drive_files/<client_id>`` to the finished build.
+
+        The previous build is kept, a search that resolved the link just
+        before the switch may still be reading it; older ones are removed.
+        """
+        previous = os.path.realpath(self.live_path) if os.path.islink(self.live_path) else None
+        if os.path.isdir(self.live_path) and previous is None:
+            # folder of an older version, moved aside once to make room for the link
+            previous = os.path.realpath(os.path.join(self.builds_path, "0"))
+            os.replace(self.live_path, previous)
+        link = self.live_path + ".tmp"
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.relpath(self.path_to_save, os.path.dirname(self.live_path)), link)
+        os.replace(link, self.live_path)
+        keep = {os.path.realpath(self.path_to_save), previous}
+        for build in os.scandir(self.builds_path):
+            if os.path.realpath(build.path) not in keep:
+                shutil.rmtree(build.path, ignore_errors=True)
+
+    def discard(self):
+        """Removes the build folder of a failed load, the current index stays."""
+        if os.path.realpath(self.path_to_save) != os.path.realpath(self.live_path) \
+                and os.path.isdir(self.path_to_save):
+            shutil.rmtree(self.path_to_save, ignore_errors=True)
 
     def get_timers_load(self):
         return {"total": {"start_time": self.total_start, "end_time": self.total_time, "passed": self.total_time_diff},
                 "retrieve": {"start_time": self.total_start, "end_time": self.retrieve_time,
                              "passed": self.retrieve_time_diff},
+                "list": {"start_time": self.list_start, "end_time": self.list_end,
+                         "passed": self.list_time_diff, "pages": self.list_pages},
+                "download": {"start_time": self.list_start, "end_time": self.download_end,
+                             "passed": self.download_time_diff, "files": len(self.files),
+                             "skipped": len(self.skipped), "duplicates": len(self.duplicates),
+                             "failed": len(self.failed),
+                             "workers": self.workers},
                 "build_index": {"start_time": self.retrieve_time, "end_time": self.total_time,
-                                "passed": self.build_index_diff}, }
+                                "passed": self.build_index_diff},
+                "merge": {"passed": self.merge_time_diff},
+                "store": {"bytes": self.store_bytes, "text_bytes": self.store_text_bytes},
+                "removed": {"files": self.removed_files}, }
 
     @staticmethod
     def filter_files(item):
-        ext = item["name"].split(".")[-1] if "." in item["name"] else None
-        allowed = ["doc", "docx", "ppt", "pptx"]
-        # "pdf", "txt"
         base_condition = not item["name"].startswith("~")
-        return base_condition and ext is not None and ext in allowed
+        return base_condition and extractors.is_supported(item["name"], item.get("mimeType"))
 
-    def gdrive_get_all_files(self):
+    @staticmethod
+    def manifest_entry(file, original_name):
+        return {"name": file["name"], "original_name": original_name, "md5Checksum": file.get("md5Checksum"),
+                "modifiedTime": file.get("modifiedTime"), "version": file.get("version"),
+                "mimeType": file.get("mimeType"), "size": file.get("size")}
+
+    @staticmethod
+    def blob_key(file):
+        """Key of the content of a listed file or manifest entry, ``None`` without a checksum (Google Docs)."""
+        if file.get("md5Checksum") is None:
+            return None
+        return "{}:{}".format(file["md5Checksum"], file.get("size"))
+
+    @staticmethod
+    def copies_of(files_urls):
+        """Indexed name -> sorted local names of the files with the same content (``same_as``)."""
+        copies = {}
+        for name, url in files_urls.items():
+            if "same_as" in url:
+                copies.setdefault(url["same_as"], []).append(name)
+        for names in copies.values():
+            names.sort()
+        return copies
+
+    @staticmethod
+    def drop_name(name, files_urls, copies):
+        """Removes a local name from ``files_urls``.
+
+        Returns ``(name, None)`` when its document has to be removed from the
+        index, ``(name, heir)`` when the first of its copies takes the document
+        over, ``None`` for a copy, which is not indexed. ``copies`` is updated.
+        """
+        url = files_urls.pop(name, None)
+        if url is not None and "same_as" in url:
+            copies[url["same_as"]].remove(name)
+            return None
+        names = copies.pop(name, [])
+        if not names:
+            return name, None
+        heir = names[0]
+        del files_urls[heir]["same_as"]
+        for copy in names[1:]:
+            files_urls[copy]["same_as"] = heir
+        if names[1:]:
+            copies[heir] = names[1:]
+        return name, heir
+
+    def _duplicate(self, file):
+        """Counts a listed file whose content is already downloaded under another name."""
+        self.duplicates.append(file["name"])
+        metrics.DUPLICATE_FILES.inc()
+        metrics.DUPLICATE_BYTES.inc(int(file.get("size") or 0))
+        self.progress("duplicates")
+
+    @staticmethod
+    def unchanged(file, entry):
+        """Whether a listed file has the content of its manifest entry. Google Docs have no
+        checksum, their version is compared instead."""
+        if file.get("md5Checksum") is None:
+            return file.get("version") == entry.get("version")
+        return file.get("md5Checksum") == entry["md5Checksum"]
+
+    @contextmanager
+    def _download_pool(self):
+        """Starts ``self.workers`` download threads fed by the yielded queue.
+
+        Listing runs in the ``with`` body, so the next page is requested while
+        files of the previous one are still being downloaded. The queue is
+        bounded to keep listing from running too far ahead of the downloads.
+        """
         self.files = []
+        self.skipped = []
+        self.duplicates = []
+        self.failed = []
+        self.list_pages = 0
+        self.list_time_diff = 0.
+        self.list_start = datetime.now()
+        if not os.path.exists(self.path_to_save):
+            os.makedirs(self.path_to_save, exist_ok=True)
+
+        tasks = queue.Queue(maxsize=self.workers * 4)
+        workers = [threading.Thread(target=self._download_worker, args=(tasks,), name="download", daemon=True)
+                   for _ in range(self.workers)]
+        for worker in workers:
+            worker.start()
+        self.threads = workers
+        try:
+            yield tasks
+        finally:
+            self.list_end = datetime.now()
+            for _ in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join()
+            self.threads = []
+            self.download_end = datetime.now()
+            self.download_time_diff = (self.download_end - self.list_start).total_seconds()
+
+    def _list_page(self, resource, **kwargs):
+        list_start = datetime.now()
+        response = resource.list(**kwargs).execute(num_retries=self.retries)
+        self.list_time_diff += (datetime.now() - list_start).total_seconds()
+        self.list_pages += 1
+        return response
+
+    def gdrive_get_all_files(self):
+        """Lists the drive and downloads allowed files."""
         files = dict()
         files_urls = dict()
-        page_token = None
-        query = "'me' in owners and mimeType != 'application/vnd.google-apps.folder'"
-        while True:
-            response = self.drive.files().list(q=query,
-                                               spaces='drive',
-                                               fields='nextPageToken, files(id, name, mimeType, webViewLink)',
-                                               pageToken=page_token).execute()
-
-            page_token = response.get('nextPageToken', None)
-
-            for file in response.get('files', []):
-                if self.filter_files(file):
-                    # file["name"] = translate(file["name"])
-                    if file["name"] not in files:
-                        self.gdrive_download_file(file)
-                        files[file["name"]] = 1
-                        files_urls[file["name"]] = {"id": file["id"], "link": file["webViewLink"]}
-                        self.files.append(file)
-                    else:
-                        file_duplicate = file.copy()
-                        name, ext = os.path.splitext(file_duplicate["name"])
-                        name, ext = name.lower(), ext.lower()
-                        file_duplicate["name"] = "_".join([name, str(files[file["name"]])]) + ext
-                        self.gdrive_download_file(file_duplicate)
-                        files[file["name"]] += 1
-                        files_urls[file_duplicate["name"]] = {"id": file["id"], "link": file["webViewLink"]}
-                        self.files.append(file_duplicate)
-
-            if page_token is None:
-                break
+        # content key -> local name of the file downloaded for it
+        blobs = dict()
+        manifest = {"files": dict()}
+        self.removed_files = 0
+        # taken before listing, so changes made during the load are not lost
+        manifest["start_page_token"] = self.drive.changes().getStartPageToken() \
+            .execute(num_retries=self.retries).get("startPageToken")
+
+        with self._download_pool() as tasks:
+            page_token = None
+            query = "'me' in owners and mimeType != 'application/vnd.google-apps.folder'"
+            while True:
+                response = self._list_page(self.drive.files(), q=query, spaces='drive',
+                                           fields='nextPageToken, files({})'.format(FILE_FIELDS),
+                                           pageToken=page_token)
+
+                page_token = response.get('nextPageToken', None)
+
+                for file in response.get('files', []):
+                    # exported files are saved with the extension of their export
+                    file = dict(file, name=extractors.local_name(file))
+                    if self.filter_files(file):
+                        # file["name"] = translate(file["name"])
+                        if file["name"] not in files:
+                            files[file["name"]] = 1
+                            local = file
+                        else:
+                            local = file.copy()
+                            name, ext = os.path.splitext(local["name"])
+                            name, ext = name.lower(), ext.lower()
+                            local["name"] = "_".join([name, str(files[file["name"]])]) + ext
+                            files[file["name"]] += 1
+                        files_urls[local["name"]] = {"id": file["id"], "link": file["webViewLink"]}
+                        manifest["files"][file["id"]] = self.manifest_entry(local, file["name"])
+                        self.progress("listed")
+                        key = self.blob_key(file)
+                        if key in blobs:
+                            # the content is downloaded and indexed once, under the first name
+                            files_urls[local["name"]]["same_as"] = blobs[key]
+                            self._duplicate(local)
+                            continue
+                        if key is not None:
+                            blobs[key] = local["name"]
+                        self.files.append(local)
+                        tasks.put(local)
+
+                if page_token is None:
+                    break
 
         folder_name = "root"
         if len(self.files) == 0:
             self.logger.error("no files in folder {}".format(folder_name))
             return -1
-        with open(self.files_urls_path, "w") as json_file:
-            json.dump(files_urls, json_file)
+        dump_json(files_urls, self.files_urls_path)
+        dump_json(manifest, self.manifest_path)
         return 0
 
+    def gdrive_get_changes(self):
+        """Downloads files changed since the last load.
+
+        Walks the Drive changes feed from the start page token saved in the
+        manifest. New files and files whose name or checksum changed are
+        downloaded unless their content is indexed already, removed, trashed
+        and no longer indexable ones are only dropped. Files that failed to
+        download or extract in an earlier load (``retry`` of the manifest, see
+        ``_record_failures``) are downloaded again. Returns ``(changed
+        files, removed files)``, see ``drop_name`` and ``update_index``; the
+        manifest and ``docs_urls.json`` are updated in place.
+        """
+        with open(self.manifest_path) as json_file:
+            manifest = json.load(json_file)
+        with open(self.files_urls_path) as json_file:
+            files_urls = json.load(json_file)
+        known = manifest["files"]
+        # ids of files that failed to download or extract in earlier loads
+        retry = set(manifest.pop("retry", []))
+        queued = set()
+        copies = self.copies_of(files_urls)
+        # content key -> indexed local name
+        blobs = {self.blob_key(entry): entry["name"] for entry in known.values()
+                 if self.blob_key(entry) is not None and "same_as" not in files_urls.get(entry["name"], {})}
+        removed = []
+        self.removed_files = 0
+
+        with self._download_pool() as tasks:
+            page_token = manifest["start_page_token"]
+            while page_token is not None:
+                response = self._list_page(self.drive.changes(), pageToken=page_token, spaces='drive',
+                                           fields='nextPageToken, newStartPageToken, '
+                                                  'changes(fileId, removed, file({}, trashed, ownedByMe))'
+                                           .format(FILE_FIELDS))
+                for change in response.get('changes', []):
+                    file_id, file = change["fileId"], change.get("file")
+                    entry = known.get(file_id)
+                    alive = not change.get("removed") and file is not None and not file.get("trashed") \
+                        and file.get("ownedByMe", True) and self.filter_files(file)
+                    if entry is not None:
+                        if alive and extractors.local_name(file) == entry["original_name"] \
+                                and self.unchanged(file, entry):
+                            continue
+                        self.removed_files += not alive
+                        dropped = self.drop_name(entry["name"], files_urls, copies)
+                        if dropped is not None:
+                            removed.append(dropped)
+                            if file_id in retry and dropped[1] is not None:
+                                # the heir was a copy of a file that is not indexed, it has to be downloaded
+                                retry.add(files_urls[dropped[1]]["id"])
+                            key = self.blob_key(entry)
+                            if blobs.get(key) == entry["name"]:
+                                if dropped[1] is None:
+                                    del blobs[key]
+                                else:
+                                    blobs[key] = dropped[1]
+                        del known[file_id]
+                    if alive:
+                        local = file.copy()
+                        local["name"] = self._free_name(extractors.local_name(file), files_urls)
+                        files_urls[local["name"]] = {"id": file["id"], "link": file["webViewLink"]}
+                        known[file_id] = self.manifest_entry(local, extractors.local_name(file))
+                        self.progress("listed")
+                        key = self.blob_key(file)
+                        if key in blobs:
+                            files_urls[local["name"]]["same_as"] = blobs[key]
+                            copies.setdefault(blobs[key], []).append(local["name"])
+                            copies[blobs[key]].sort()
+                            self._duplicate(local)
+                            continue
+                        if key is not None:
+                            blobs[key] = local["name"]
+                        self.files.append(local)
+                        tasks.put(local)
+                        queued.add(file_id)
+                if "newStartPageToken" in response:
+                    manifest["start_page_token"] = response["newStartPageToken"]
+                page_token = response.get("nextPageToken")
+
+            for file_id in sorted(retry - queued):
+                entry = known.get(file_id)
+                if entry is None or "same_as" in files_urls.get(entry["name"], {}):
+                    continue
+                local = dict(entry, id=file_id)
+                self.files.append(local)
+                tasks.put(local)
+
+        dump_json(files_urls, self.files_urls_path)
+        dump_json(manifest, self.manifest_path)
+        return self.files, removed
+
+    @staticmethod
+    def _free_name(name, taken):
+        """Local file name for ``name`` following the ``name_N.ext`` scheme of the full load."""
+        if name not in taken:
+            return name
+        base, ext = os.path.splitext(name)
+        base, ext = base.lower(), ext.lower()
+        i = 1
+        while "_".join([base, str(i)]) + ext in taken:
+            i += 1
+        return "_".join([base, str(i)]) + ext
+
+    def _download_worker(self, tasks):
+        while True:
+            file = tasks.get()
+            if file is None:
+                break
+            self.gdrive_download_file(file)
+            self.progress("downloaded")
+
+    def _thread_http(self):
+        """Returns an authorized ``httplib2.Http`` owned by the current thread.
+
+        httplib2 connections are not thread safe, so every download thread gets
+        its own one built from the credentials of the shared drive service.
+        """
+        if not hasattr(self._local, "http"):
+            credentials = getattr(getattr(self.drive, "_http", None), "credentials", None)
+            self._local.http = None
+            if credentials is not None:
+                import google_auth_httplib2
+                import httplib2
+                self._local.http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        return self._local.http
+
     def gdrive_download_file(self, file):
+        """Streams the file to disk ``chunk_size`` bytes at a time.
+
+        Chunks go to ``<name>.part`` which is renamed once complete, so an
+        interrupted or skipped download never reaches the index build.
+        """
         path_to_save = self.path_to_save
         if not os.path.exists(path_to_save):
-            os.makedirs(path_to_save)
+            os.makedirs(path_to_save, exist_ok=True)
         file_id, file_name = file['id'], file['name']
         file_path = os.path.join(path_to_save, file_name)
+        if self._too_large(file.get('size')):
+            self.logger.warning("{} skipped, {} bytes".format(file_name, file['size']))
+            self.skipped.append(file_name)
+            metrics.DOWNLOAD_SKIPPED.inc()
+            return
+        part_path = file_path + ".part"
         try:
-            request = self.drive.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-                self.logger.debug("Download {} {}%.".format(file_name, int(status.progress() * 100)))
-
-            with io.open(file_path, 'wb') as f:
-                f.write(fh.getvalue())
+            from googleapiclient.http import MediaIoBaseDownload
+            export = extractors.EXPORTS.get(file.get("mimeType"))
+            if export is not None:
+                request = self.drive.files().export_media(fileId=file_id, mimeType=export[0])
+            else:
+                request = self.drive.files().get_media(fileId=file_id)
+            http = self._thread_http()
+            if http is not None:
+                request.http = http
+            with io.open(part_path, 'wb') as f:
+                downloader = MediaIoBaseDownload(f, request, chunksize=self.chunk_size)
+                done = False
+                while done is False:
+                    status, done = downloader.next_chunk(num_retries=self.retries)
+                    if self._too_large(status.total_size) or self._too_large(status.resumable_progress):
+                        raise FileTooLarge("larger than {} bytes, skipped".format(self.max_file_size))
+            metrics.DOWNLOAD_BYTES.inc(os.path.getsize(part_path))
+            os.replace(part_path, file_path)
         except Exception as e:
+            if isinstance(e, FileTooLarge):
+                self.skipped.append(file_name)
+                metrics.DOWNLOAD_SKIPPED.inc()
+            else:
+                self.failed.append(file_name)
+            if os.path.exists(part_path):
+                os.remove(part_path)
             self.logger.error(" ".join([file_name, str(e)]))
 
-    def get_file_strings(self, path):
-        texts = ''
-        try:
-            texts = io.open(path, 'r', ).read()
-        except Exception as e:
-            ext = os.path.split(path)[-1].split(".")[-1]
-            try:
-                texts = textract.process(path, extension=ext)
-                try:
-                    texts = texts.decode("utf-8", errors="replace")
-                except:
-                    texts = str(texts)
-            except Exception as e1:
-                try:
-                    with open(path, 'rb') as f:
-                        texts = io.TextIOWrapper(f, encoding='cp1251').read()
-                except Exception as e2:
-                    self.logger.error(" ".join([path, str(e2)]))
-        texts = texts.replace('\\n', ' ').replace('\\r', '').replace("\n", " ").replace("\r", "")
-        return texts
+    def _too_large(self, size):
+        return self.max_file_size is not None and size is not None and int(size) > self.max_file_size
+
+    def _index_files(self, paths):
+        """Yields the ``index_file`` result for every path.
+
+        Files downloaded by this load are extracted by their Drive mimeType,
+        others by their extension. With ``index_workers > 1`` files are extracted and preprocessed in a
+        process pool started with ``INDEX_START_METHOD``. ``Pool.imap`` keeps the input order, so the index
+        is identical to the serial one, and only term counters are sent back
+        to the parent process.
+        """
+        types = {file["name"]: extractors.content_type(file) for file in self.files}
+        mime_types = [types.get(os.path.basename(path)) for path in paths]
+        if self.index_workers > 1 and len(paths) > 1:
+            chunksize = max(1, len(paths) // (self.index_workers * 4))
+            context = multiprocessing.get_context(INDEX_START_METHOD)
+            if INDEX_START_METHOD == "forkserver":
+                context.set_forkserver_preload(INDEX_PRELOAD)
+            args = zip(paths, repeat(self.stemming), repeat(self.positions), mime_types, repeat(self.store))
+            with context.Pool(self.index_workers) as pool:
+                for result in pool.imap(_index_file, args, chunksize):
+                    yield result
+        else:
+            for path, mime_type in zip(paths, mime_types):
+                yield index_file(path, self.stemming, self.positions, mime_type, self.store)
 
     def build_index(self):
-        files_data = dict()
-        for file in os.scandir(self.path_to_save):
-            try:
-                ext = os.path.splitext(file.path)[-1].lower()
-                if ext != '.json':
-                    strings = self.get_file_strings(file.path)
-                    if strings != '':
-                        files_data[file.name] = strings
-                    os.remove(file.path)
-            except Exception as e:
-                self.logger.error(" ".join([file.name, str(e)]))
+        paths = [file.path for file in os.scandir(self.path_to_save)
+                 if os.path.splitext(file.path)[-1].lower() not in ('.json', '.part')]
 
-        res = {}
-        for file in files_data:
-            file_data = files_data[file]
-            file_index = Counter(preprocess(file_data))
-            for word in file_index:
-                word_freq = file_index[word]
-                if word not in res:
-                    res[word] = {file: word_freq}
-                else:
-                    # res[word][0] += word_freq
-                    res[word].update({file: word_freq})
+        manifest = segments.new_manifest(self.positions, self.store)
+        docs, forms = {}, {}
+        self._add_postings(manifest, docs, forms, paths)
+        self._write_index(manifest, docs, forms)
+        self._record_failures()
+
+    def update_index(self, changed, removed):
+        """Patches the existing index instead of rebuilding it.
+
+        ``removed`` is a list of ``(local name, heir)`` in the order the names
+        were dropped: the document of a name gets a tombstone, or is renamed to
+        ``heir``, a copy of the same content that takes it over. The
+        downloaded ``changed`` files are extracted and added as new segments.
+        Existing segments are not rewritten.
+        """
+        manifest = segments.load_manifest(self.path_to_save)
+        with open(self.docs_id) as json_file:
+            docs = {int(doc_id): doc for doc_id, doc in json.load(json_file).items()}
+        # keep the configuration the index was built with
+        self.stemming = Analyzer.load(self.analyzer_path).stemming
+        self.positions = manifest["positions"]
+        self.store = manifest.get("store", False)
+
+        doc_ids = {doc: doc_id for doc_id, doc in docs.items()}
+        for name, heir in removed:
+            doc_id = doc_ids.pop(name, None)
+            if doc_id is None:
+                continue
+            if heir is None:
+                manifest["deleted"].append(doc_id)
+                del docs[doc_id]
+            else:
+                docs[doc_id] = heir
+                doc_ids[heir] = doc_id
+
+        paths = [os.path.join(self.path_to_save, file["name"]) for file in changed]
+        forms = {}
+        self._add_postings(manifest, docs, forms, [path for path in paths if os.path.exists(path)])
+        self._write_index(manifest, docs, forms)
+        self._record_failures()
+
+    def _record_failures(self):
+        """Adds the files whose download or extraction failed to the ``retry`` list of the manifest.
+
+        Their manifest entries are written when they are listed, so the
+        changes feed does not bring them back; the next incremental load
+        downloads them again.
+        """
+        if not self.failed or not os.path.exists(self.manifest_path):
+            return
+        ids = {file["name"]: file["id"] for file in self.files}
+        with open(self.manifest_path) as json_file:
+            manifest = json.load(json_file)
+        retry = set(manifest.get("retry", [])).union(ids[name] for name in self.failed if name in ids)
+        manifest["retry"] = sorted(file_id for file_id in retry if file_id in manifest["files"])
+        dump_json(manifest, self.manifest_path)
+
+    def merge_segments(self):
+        """Merges segments of the current index following ``segments.plan_merge``.
+
+        Runs after a load has published its index, in a build of its own,
+        so searches use the new index meanwhile. Unchanged segments are hard
+        links to the files of the current build.
+        """
+        if segments.plan_merge(segments.load_manifest(self.live_path)) is None:
+            return
+        self._stage(copy=True)
+        try:
+            manifest = segments.load_manifest(self.path_to_save)
+            with open(self.docs_id) as json_file:
+                docs = {int(doc_id): doc for doc_id, doc in json.load(json_file).items()}
+            plan = segments.plan_merge(manifest)
+            while plan is not None:
+                remap = segments.merge(self.path_to_save, manifest, *plan)
+                docs = {remap.get(doc_id, doc_id): doc for doc_id, doc in docs.items()}
+                self.progress("merged", plan[1] - plan[0])
+                plan = segments.plan_merge(manifest)
+            self.stemming = Analyzer.load(self.analyzer_path).stemming
+            self._write_index(manifest, docs)
+        except Exception:
+            self.discard()
+            raise
+        self._publish()
+
+    def remove_documents(self, file_ids):
+        """Drops files deleted from the drive from the index, no reload needed.
+
+        Returns the local names of the removed documents.
+        """
+        file_ids = set(file_ids)
+        self._stage(copy=True)
+        try:
+            with open(self.files_urls_path) as json_file:
+                files_urls = json.load(json_file)
+            removed = [name for name, url in files_urls.items() if url["id"] in file_ids]
+            copies = self.copies_of(files_urls)
+            dropped = [self.drop_name(name, files_urls, copies) for name in removed]
+            dump_json(files_urls, self.files_urls_path)
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path) as json_file:
+                    manifest = json.load(json_file)
+                for file_id in file_ids:
+                    manifest["files"].pop(file_id, None)
+                dump_json(manifest, self.manifest_path)
+            self.update_index([], [names for names in dropped if names is not None])
+        except Exception:
+            self.discard()
+            raise
+        self._publish()
+        return removed
 
-        terms = list(res.keys())
-        doc_ids = {i: doc for i, doc in enumerate(files_data)}
+    def _add_postings(self, manifest, docs, forms, paths):
+        """Indexes ``paths`` into new segments, ``docs`` gets global doc id -> name of every added doc
+        and ``forms`` stem -> Counter of the words stemmed to it when stemming."""
+        analyzer = get_analyzer(self.stemming)
+        writer = segments.SegmentWriter(self.path_to_save, manifest, self.segment_budget)
+        for file, file_index, error, file_positions, stats, stored, words in self._index_files(paths):
+            self.progress("extracted")
+            extension = os.path.splitext(file)[1].lstrip(".").lower() or "none"
+            metrics.EXTRACT_SECONDS.observe(stats["seconds"], extension=extension)
+            if stats["textract_failed"]:
+                metrics.TEXTRACT_FAILURES.inc(extension=extension)
+            if error is not None:
+                self.logger.error(" ".join([file, error]))
+            if file_index is None:
+                if error is not None:
+                    self.failed.append(file)
+                continue
+            docs[writer.add(file_index, file_positions, stored)] = file
+            for word, count in (words or {}).items():
+                forms.setdefault(analyzer.stem(word), Counter())[word] += count
+            self.progress("indexed")
+        writer.flush()
 
-        with open(self.index_path, "w") as json_file:
-            json.dump(res, json_file)
+    def _write_index(self, manifest, docs, forms=None):
+        segments.save_manifest(self.path_to_save, manifest)
+        dump_json(docs, self.docs_id)
+        with segments.SegmentedIndex(self.path_to_save) as index:
+            # collection frequencies rank spelling suggestions and completions,
+            # words of deleted docs stay suggested until their segment is merged
+            vocabulary = dict(index.coll_freqs())
+            self.store_bytes = index.store_size
+            self.store_text_bytes = sum(store.text_bytes for store in index.stores if store is not None)
+        suggest.write(self.suggest_path, vocabulary)
+        spell_forms = self._write_forms(forms, vocabulary) if self.stemming else None
+        SymSpell.build(vocabulary, forms=spell_forms).save(self.spell_path)
+        get_analyzer(self.stemming).save(self.analyzer_path)
 
-        with open(self.terms_path, "w") as json_file:
-            json.dump(dict(terms=terms), json_file)
+    def _write_forms(self, forms, vocabulary):
+        """Adds ``forms`` of the new docs to ``forms.json``, stem -> {word: count} of the index.
 
-        with open(self.docs_id, "w") as json_file:
-            json.dump(doc_ids, json_file)
+        Spelling corrections are stems, the most frequent word of a stem is
+        shown and searched in its place: stemming a stem again may not give
+        the same stem back. Counts of deleted docs are kept, stems no longer
+        in the index are dropped. Returns stem -> most frequent word, for
+        the stems where they differ.
+        """
+        all_forms = {}
+        if os.path.exists(self.forms_path):
+            with open(self.forms_path) as json_file:
+                all_forms = json.load(json_file)
+        for stem, words in (forms or {}).items():
+            counts = all_forms.setdefault(stem, {})
+            for word, count in words.items():
+                counts[word] = counts.get(word, 0) + count
+        all_forms = {stem: words for stem, words in all_forms.items() if stem in vocabulary}
+        dump_json(all_forms, self.forms_path)
+        res = {}
+        for stem, words in all_forms.items():
+            word = max(words, key=lambda word: (words[word], word == stem))
+            if word != stem:
+                res[stem] = word
+        return res
 
 
 class GDriveIndex:
     def __init__(self, client_id):
-        self.index_path = os.path.join("drive_files", client_id, "index.json")
-        self.files_urls_path = os.path.join("drive_files", client_id, "docs_urls.json")
-        self.terms_path = os.path.join("drive_files", client_id, "terms.json")
-        self.docs_id = os.path.join("drive_files", client_id, "docs.json")
+        # the link to the current build is resolved once, all files are read
+        # from the same build even if a load finishes meanwhile
+        self.folder = folder = os.path.realpath(os.path.join("drive_files", client_id))
+        self.segments_path = os.path.join(folder, segments.SEGMENTS_FILE)
+        self.index_path = os.path.join(folder, "index.json")
+        self.bin_index_path = os.path.join(folder, "index.bin")
+        self.files_urls_path = os.path.join(folder, "docs_urls.json")
+        self.suggest_path = os.path.join(folder, "suggest.bin")
+        self.docs_id = os.path.join(folder, "docs.json")
+        self.spell_path = os.path.join(folder, "spell.json")
+        self.analyzer_path = os.path.join(folder, "analyzer.json")
+        self.analyzer = None
+        self.index = None
+        self.urls = None
+        self.doc_names = None
+        self.doc_ids = None
+        # indexed name -> names of the files with the same content, and copy -> indexed name
+        self.copies = None
+        self.same_as = None
+        self.size = 0
 
     @property
     def exists(self):
-        return os.path.exists(self.index_path)
+        return os.path.exists(self.segments_path) or os.path.exists(self.index_path)
+
+    @property
+    def disk_size(self):
+        """Bytes of the files of the current build."""
+        if not os.path.isdir(self.folder):
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(self.folder) if entry.is_file())
+
+    @property
+    def version(self):
+        """(mtime, size) of every index file, changes whenever a load rewrites them."""
+        version = [self.folder]
+        for path in (self.segments_path, self.index_path, self.bin_index_path, self.files_urls_path, self.docs_id,
+                     self.spell_path):
+            try:
+                stat = os.stat(path)
+                version.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                version.append(None)
+        return tuple(version)
+
+    def open(self):
+        """Loads the index and the url map once, ``find`` reuses them afterwards.
 
-    def find(self, query):
+        ``size`` is an estimate of the memory held: parsed JSON takes several
+        times its file size, the mmapped binary index about its file size.
+        """
+        self.size = os.path.getsize(self.files_urls_path) * JSON_OVERHEAD
+        self.analyzer = Analyzer.load(self.analyzer_path)
+        self.urls = json.load(open(self.files_urls_path))
+        self.copies = GDriveFiles.copies_of(self.urls)
+        # same_as is for the loader, results only show the id and link of a file
+        self.same_as = {name: url.pop("same_as") for name, url in self.urls.items() if "same_as" in url}
+        if os.path.exists(self.segments_path):
+            self.index = segments.SegmentedIndex(self.folder)
+            self.size += self.index.size + os.path.getsize(self.docs_id) * JSON_OVERHEAD
+            with open(self.docs_id) as json_file:
+                self.doc_names = {int(i): doc for i, doc in json.load(json_file).items()}
+            self.doc_ids = {doc: i for i, doc in self.doc_names.items()}
+            return
+        # indexes of older versions: a single index.bin or only index.json
+        if os.path.exists(self.bin_index_path):
+            self.size += os.path.getsize(self.bin_index_path) + os.path.getsize(self.docs_id) * JSON_OVERHEAD
+            with open(self.docs_id) as json_file:
+                self.doc_names = {int(i): doc for i, doc in json.load(json_file).items()}
+            try:
+                self.index = binindex.BinaryIndex(self.bin_index_path)
+            except ValueError:
+                # written by an older version, index.json is still there
+                self.index = None
+        if self.index is None:
+            self.size += os.path.getsize(self.index_path) * JSON_OVERHEAD
+            with open(self.docs_id) as json_file:
+                self.doc_names = {int(i): doc for i, doc in json.load(json_file).items()}
+            self.index = binindex.DictIndex(json.load(open(self.index_path)),
+                                            {doc: i for i, doc in self.doc_names.items()})
+
+    def find(self, query, limit=None, offset=0, ranked=False):
+        """Documents matching the query as ``[[doc name, {"id": ..., "link": ...}], ...]``.
+
+        The query may use AND/OR/NOT and parentheses (see ``query_engine``).
+        Documents match the query the same way with or without ``ranked``
+        (all words of a plain list of words). With ``ranked`` they are
+        ordered by BM25 score, which is added to every result, otherwise by
+        name.
+        Files sharing the content of an indexed one are results of their own
+        next to it. ``offset``/``limit`` select a page of the results.
+        """
         if self.exists:
-            index = json.load(open(self.index_path))
-            postings = []
-            query_index = Counter(preprocess(query))
-            for term in query_index.keys():
-                if term not in index:  # ignoring absent terms
-                    continue
-                # extract document info only
-                posting = [doc for doc in index[term]]
-                postings.append(posting)
-            docs = set.intersection(*map(set, postings))
-            urls = json.load(open(self.files_urls_path))
-            res = [[doc, urls[doc]] for doc in docs]
+            if self.index is None:
+                self.open()
+            tree = query_engine.parse(query, self.analyzer)
+            end = offset + limit if limit is not None else None
+            if ranked:
+                k = end if end is not None else self.index.n_docs
+                terms = query_engine.terms(tree)
+                if query_engine.is_disjunction(tree):
+                    # matching any term is what MaxScore enumerates
+                    hits = ranking.top_k(self.index, terms, k)
+                elif query_engine.is_conjunction(tree):
+                    hits = ranking.top_k_all(self.index, terms, k)
+                else:
+                    scores = ranking.score_docs(self.index, terms, query_engine.evaluate(tree, self.index))
+                    hits = heapq.nsmallest(k, ((-score, doc_id) for doc_id, score in scores.items()))
+                    hits = [(-score, doc_id) for score, doc_id in hits]
+                # every hit gives at least one result, the first ``end`` hits fill the page
+                return [[name, self.urls[name], score]
+                        for score, doc_id in hits for name in self._names(doc_id)][offset:end]
+            docs = sorted(name for doc_id in query_engine.evaluate(tree, self.index)
+                          for name in self._names(doc_id))[offset:end]
+            res = [[doc, self.urls[doc]] for doc in docs]
             return res
         else:
             return None
+
+    def _names(self, doc_id):
+        """Local names of the files of a document: its own and those of its copies."""
+        name = self.doc_names[doc_id]
+        return [name] + self.copies.get(name, [])
+
+    def snippets(self, query, names):
+        """Highlighted text around the query terms (``docstore.snippet``) of every document in ``names``,
+        ``None`` for documents without stored text and for indexes without a document store."""
+        if self.index is None:
+            self.open()
+        if self.doc_ids is None:
+            return [None] * len(names)
+        terms = set(query_engine.terms(query_engine.parse(query, self.analyzer)))
+        res = []
+        for name in names:
+            # a copy shows the text of the document it shares
+            blocks = self.index.text_blocks(self.doc_ids[self.same_as.get(name, name)])
+            res.append(docstore.snippet(blocks, terms, self.analyzer) if blocks is not None else None)
+        return res
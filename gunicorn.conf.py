@@ -0,0 +1,18 @@
+"""gunicorn settings, read from the working directory by ``gunicorn app:app``.
+
+The app is imported once in the master, which also imports its heavy
+dependencies (``app.preload``) before forking the workers, so workers
+start without importing anything and share the loaded modules
+copy-on-write.
+"""
+preload_app = True
+# /api/jobs/<id>/events streams a load for as long as it runs, a sync worker
+# would be killed by its timeout meanwhile; threads keep serving other requests
+worker_class = "gthread"
+threads = 4
+
+
+def when_ready(server):
+    # the app module was imported by preload_app
+    import app
+    app.preload()
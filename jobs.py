@@ -0,0 +1,213 @@
+"""Background load jobs.
+
+``/api/load`` and ``/api/reload`` only submit a job and return its id, the
+download and the index build run in a thread pool of the worker process.
+The status of the last job of every client is also written to
+``drive_files/.jobs/<client_id>.json``, so any worker process can report it,
+and a job holds ``drive_files/.jobs/<client_id>.lock`` while it runs, so a
+second load of the same client, in this process or another one, is
+coalesced with the running job instead of starting a new one.
+"""
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+JOBS_PATH = os.path.join("drive_files", ".jobs")
+# minimal interval between two status file writes caused by progress updates
+SAVE_INTERVAL = 0.5
+
+
+def to_json(value):
+    """``value`` with datetimes as ISO strings, the same in memory and in the status file."""
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def profile_path(client_id, job_id):
+    """Collapsed stacks of a job started with profiling."""
+    return os.path.join(JOBS_PATH, "{}.{}.folded".format(client_id, job_id))
+
+
+def try_lock(client_id):
+    """Open lock file of the client if no job of it is running, ``None`` otherwise."""
+    os.makedirs(JOBS_PATH, exist_ok=True)
+    lock_file = open(os.path.join(JOBS_PATH, client_id + ".lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+@contextmanager
+def client_lock(client_id):
+    """Yields whether the lock of the client was taken, that is no load of it is running.
+
+    Used by changes of the index made outside of a job, like removing
+    deleted files.
+    """
+    lock_file = try_lock(client_id)
+    try:
+        yield lock_file is not None
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+
+
+class Job:
+    def __init__(self, client_id, kind):
+        self.id = uuid.uuid4().hex
+        self.client_id = client_id
+        self.kind = kind
+        # queued, running, done or failed
+        self.state = "queued"
+        self.stage = None
+        self.progress = {"listed": 0, "downloaded": 0, "duplicates": 0, "extracted": 0, "indexed": 0, "merged": 0}
+        self.stages = {}
+        self.result = None
+        self.error = None
+        self.created = datetime.now()
+        self.finished = None
+        self._lock = threading.Lock()
+        self._saved = 0.
+
+    @property
+    def status_path(self):
+        return os.path.join(JOBS_PATH, self.client_id + ".json")
+
+    @property
+    def done(self):
+        return self.state in ("done", "failed")
+
+    def advance(self, counter, n=1):
+        """Progress callback passed to ``GDriveFiles``, called from several threads."""
+        with self._lock:
+            self.progress[counter] += n
+            stage = {"listed": "download", "downloaded": "download", "duplicates": "download",
+                     "merged": "merge"}.get(counter, "build_index")
+            if stage != self.stage:
+                self._start_stage(stage)
+        self.save(force=False)
+
+    def set_state(self, state, result=None, error=None):
+        with self._lock:
+            self.state = state
+            self.result = result
+            self.error = error
+            if state == "running":
+                self._start_stage("download")
+            if self.done:
+                self.finished = datetime.now()
+                self._start_stage(None)
+        self.save()
+
+    def _start_stage(self, stage):
+        now = time.monotonic()
+        if self.stage is not None:
+            self.stages[self.stage]["passed"] = now - self.stages[self.stage].pop("_start")
+        if stage is not None:
+            self.stages[stage] = {"_start": now}
+        self.stage = stage
+
+    def to_dict(self):
+        with self._lock:
+            stages = {name: {"passed": stage.get("passed", time.monotonic() - stage.get("_start", 0.))}
+                      for name, stage in self.stages.items()}
+            return to_json({"id": self.id, "kind": self.kind, "state": self.state, "stage": self.stage,
+                            "progress": dict(self.progress), "stages": stages, "result": self.result,
+                            "error": self.error, "created": self.created, "finished": self.finished})
+
+    def save_profile(self, collapsed):
+        """Writes the profile of the job, the profile of an earlier job of the client is dropped."""
+        os.makedirs(JOBS_PATH, exist_ok=True)
+        for path in glob.glob(profile_path(glob.escape(self.client_id), "*")):
+            os.remove(path)
+        with open(profile_path(self.client_id, self.id), "w") as profile_file:
+            profile_file.write(collapsed)
+
+    def save(self, force=True):
+        now = time.monotonic()
+        if not force and now - self._saved < SAVE_INTERVAL:
+            return
+        self._saved = now
+        status = self.to_dict()
+        os.makedirs(JOBS_PATH, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(self.status_path, threading.get_ident())
+        with open(tmp_path, "w") as json_file:
+            json.dump(status, json_file)
+        os.replace(tmp_path, self.status_path)
+
+
+class JobRunner:
+    """Runs load jobs in ``workers`` threads, at most one per client."""
+
+    def __init__(self, workers):
+        # named for the stacks of load profiles
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        # job id -> Job, the last job of every client started by this process
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, client_id, kind, target):
+        """Starts ``target(job)`` in the background.
+
+        Returns the status of the new job, or of the job already running for
+        the client when there is one.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.client_id == client_id and not job.done:
+                    return job.to_dict()
+            lock_file = try_lock(client_id)
+            if lock_file is None:
+                # another worker process is loading this client
+                return self.status_of(client_id)
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.client_id == client_id]:
+                del self._jobs[job_id]
+            job = Job(client_id, kind)
+            self._jobs[job.id] = job
+            job.save()
+        self._executor.submit(self._run, job, target, lock_file)
+        return job.to_dict()
+
+    @staticmethod
+    def _run(job, target, lock_file):
+        try:
+            job.set_state("running")
+            job.set_state("done", result=target(job))
+        except Exception as e:
+            job.set_state("failed", error=str(e))
+        finally:
+            lock_file.close()
+
+    def get(self, client_id, job_id):
+        """Status of a job of the client, ``None`` if it is unknown."""
+        job = self._jobs.get(job_id)
+        if job is not None and job.client_id == client_id:
+            return job.to_dict()
+        status = self.status_of(client_id)
+        if status is not None and status["id"] == job_id:
+            return status
+        return None
+
+    @staticmethod
+    def status_of(client_id):
+        """Status of the last job of the client saved by any process."""
+        try:
+            with open(os.path.join(JOBS_PATH, client_id + ".json")) as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return None
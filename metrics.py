@@ -0,0 +1,170 @@
+"""Prometheus metrics of the worker process, rendered as text for ``/metrics``.
+
+A minimal registry (counters, gauges and histograms with labels) so that no
+client library is needed. Values live in the process: with several gunicorn
+workers every scrape reports the worker that served it, Prometheus adds an
+``instance`` label per scrape target.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+REGISTRY = []
+
+# seconds, from a fast search to a slow extraction
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+# seconds, stages of a load
+LOAD_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("{} takes labels {}, got {}".format(self.name, self.labels, sorted(labels)))
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """Yields ``(name suffix, label values, extra labels, value)``."""
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield "", key, (), value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.kind)]
+        for suffix, key, extra, value in self.samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, _labels(self.labels, key, extra), _number(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        if not self.labels:
+            # exported as 0 before the first increment
+            self._values[()] = 0
+
+    def inc(self, n=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+
+class Gauge(Metric):
+    """A value that goes up and down. With ``function`` the values are read
+    at scrape time from ``function()``, a dict of label values tuple -> value."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is None:
+            yield from super().samples()
+            return
+        for key, value in sorted(self.function().items()):
+            yield "", key, (), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # count per bucket (not cumulative), sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0., 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds spent in the ``with`` body."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: ([*state[0]], state[1], state[2]) for key, state in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield "_bucket", key, (("le", _number(bound)),), cumulative
+            yield "_sum", key, (), total
+            yield "_count", key, (), count
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+LOADS = Counter("gdrive_loads_total", "Finished load jobs by kind (load, reload) and result (done, failed).",
+                ["kind", "result"])
+LOAD_STAGE_SECONDS = Histogram("gdrive_load_stage_seconds", "Duration of the stages of successful loads.",
+                               ["kind", "stage"], buckets=LOAD_BUCKETS)
+DOWNLOAD_BYTES = Counter("gdrive_download_bytes_total", "Bytes of files downloaded from Drive.")
+DOWNLOAD_SKIPPED = Counter("gdrive_download_skipped_total", "Files not downloaded for exceeding the size limit.")
+DUPLICATE_FILES = Counter("gdrive_duplicate_files_total",
+                          "Files not downloaded because a file with the same md5Checksum and size was.")
+DUPLICATE_BYTES = Counter("gdrive_duplicate_bytes_total", "Bytes of the files not downloaded as duplicates.")
+EXTRACT_SECONDS = Histogram("gdrive_extract_seconds", "Text extraction time per file by extension.",
+                            ["extension"])
+TEXTRACT_FAILURES = Counter("gdrive_textract_failures_total",
+                            "Files textract failed on, by extension (they fall back to a cp1251 decode).",
+                            ["extension"])
+INDEX_BYTES = Gauge("gdrive_index_bytes", "Disk size of the current index build per client.", ["client"])
+SEARCH_SECONDS = Histogram("gdrive_search_seconds", "Latency of /api/search by phase "
+                           "(spellcheck, lookup, snippets, serialization).", ["phase"])
+SUGGEST_SECONDS = Histogram("gdrive_suggest_seconds", "Latency of /api/suggest lookups.")
+CACHE_REQUESTS = Counter("gdrive_cache_requests_total", "Cache lookups by cache and result (hit, miss).",
+                         ["cache", "result"])
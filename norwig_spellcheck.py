@@ -2,27 +2,63 @@ import json
 import os
 from collections import Counter
 
-from gdriveloader import preprocess
+from analyzer import TOKEN_RE as WORD_RE, Analyzer
+from query_engine import NEAR_RE, OPERATORS, TOKEN_RE
+from symspell import SymSpell
 
 
 class NorwigSpellcheck:
     def __init__(self, client_id):
-        self.index_path = os.path.join("drive_files", client_id, "index.json")
+        folder = os.path.realpath(os.path.join("drive_files", client_id))
+        self.index_path = os.path.join(folder, "index.json")
+        self.spell_path = os.path.join(folder, "spell.json")
+        self.analyzer = Analyzer.load(os.path.join(folder, "analyzer.json"))
         self.vocabulary = Counter()
-        index = json.load(open(self.index_path))
-        for token in index:
-            self.vocabulary[token] = sum(index[token].values())
+        self.symspell = None
+        if os.path.exists(self.spell_path):
+            # precomputed at index build time, no need to parse the index
+            self.symspell = SymSpell.load(self.spell_path)
+            self.vocabulary.update(self.symspell.freqs)
+            self.size = self.symspell.size
+        else:
+            index = json.load(open(self.index_path))
+            for token in index:
+                self.vocabulary[token] = sum(index[token].values())
+            # rough memory taken by the vocabulary: dict slot, str and int per term
+            self.size = sum(100 + len(token) * 2 for token in self.vocabulary)
+        self.N = sum(self.vocabulary.values())
 
     def P(self, word):
         "Probability of `word`."
-        N = sum(self.vocabulary.values())
-        return self.vocabulary[word] / N
+        return self.vocabulary[word] / self.N
 
     def correction(self, query):
-        query_prep = preprocess(query)
-        "Most probable spelling correction for word."
-        query_res = " ".join([max(self.candidates(word), key=self.P) for word in query_prep])
-        return query_res
+        "Most probable spelling correction for every word of the query, operators and parentheses are kept."
+        query_res = []
+        for token in TOKEN_RE.findall(query):
+            if token in OPERATORS or token in "()" or NEAR_RE.match(token):
+                query_res.append(token)
+            elif token.startswith('"'):
+                # stopwords stay, they keep the distance between phrase words
+                words = [word if word in self.analyzer.stopwords else self.word_correction(word)
+                         for word in WORD_RE.findall(token.lower())]
+                query_res.append('"{}"'.format(" ".join(words)))
+            else:
+                query_res.extend(self.word_correction(word) for word in self.analyzer.words(token))
+        return " ".join(query_res)
+
+    def word_correction(self, word):
+        "Most probable spelling correction for word, known words are kept as typed."
+        term = self.analyzer.stem(word)
+        if term in self.vocabulary:
+            return word
+        if self.symspell is not None:
+            correction = self.symspell.lookup(term)
+            if correction == term:
+                return word
+            # the most frequent word of the stem, find() stems it back to the stem
+            return self.symspell.forms.get(correction, correction)
+        return max(self.candidates(term), key=self.P)
 
     def candidates(self, word):
         "Generate possible spelling corrections for word."
@@ -0,0 +1,76 @@
+"""Sampling profiler for a thread or a group of threads, output as collapsed stacks.
+
+    with Sampler() as sampler:
+        slow_code()
+    open("slow.folded", "w").write(sampler.collapsed())
+
+A background thread reads the stacks of the profiled threads every
+``interval`` seconds from ``sys._current_frames()``, so the profiled code
+runs unmodified, at a cost that does not depend on the number of calls it
+makes. By default the thread creating the sampler is profiled, ``threads``
+is a function returning the threads to sample instead, called at every
+sample so that threads started later are included (the download workers of
+a load); their stacks start with a ``thread:<name>`` frame. Each line of
+``collapsed()`` is a stack, outermost frame first, and the number of
+samples it was seen in: the input format of flamegraph.pl, speedscope and
+inferno. Code running in other processes (the extraction pool of
+``GDRIVE_INDEX_WORKERS``) is not sampled, the profiled threads show up
+waiting for it.
+"""
+import os
+import sys
+import threading
+from collections import Counter
+
+
+def frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return "{}:{}".format(module, code.co_name).replace(";", ":").replace(" ", "_")
+
+
+class Sampler:
+    def __init__(self, threads=None, interval=0.005):
+        self.threads = threads
+        self.thread_id = threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if self.threads is None:
+                self._add(frames.get(self.thread_id), [])
+            else:
+                for thread in self.threads():
+                    self._add(frames.get(thread.ident), ["thread:" + thread.name.replace(" ", "_")])
+
+    def _add(self, frame, root):
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        if stack:
+            self.stacks[";".join(root + stack[::-1])] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def collapsed(self):
+        return "".join("{} {}\n".format(stack, count) for stack, count in self.stacks.most_common())
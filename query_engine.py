@@ -0,0 +1,319 @@
+"""Boolean queries over sorted integer doc id posting lists.
+
+Syntax: words separated by spaces are ANDed, ``OR`` and ``NOT`` (upper
+case) and parentheses work as usual, NOT binds tightest, then AND, then OR.
+``"..."`` matches an exact phrase and ``a NEAR/k b`` two words at most k
+words apart, both need an index built with positions and are plain ANDs
+otherwise::
+
+    report (draft OR final) NOT archive
+    "terms of delivery" contract NEAR/5 signed
+
+Every word goes through the index's analyzer, so stopwords are dropped
+(``the OR report`` is just ``report``) and a word analyzed into several
+terms is an AND of them. A conjunction is evaluated smallest posting list
+first, the candidates are then checked against every longer list with a
+skip/gallop seek, so its cost follows the shortest list instead of the sum
+of all of them. Phrase and NEAR conditions read positions only for the
+documents left after the intersection of their terms. Terms unknown to the
+index simply match nothing.
+"""
+import heapq
+import re
+
+from binindex import gallop
+
+TOKEN_RE = re.compile(r'"[^"]*"?|\(|\)|[^\s()"]+')
+NEAR_RE = re.compile(r'NEAR/(\d+)$')
+OPERATORS = {"AND", "OR", "NOT"}
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+class Node:
+    def __repr__(self):
+        # the same analyzed query has the same repr, used in cache keys
+        return "{}({})".format(type(self).__name__, ", ".join(repr(value) for value in vars(self).values()))
+
+    def filter(self, docs, index):
+        """Sorted ``docs`` that match this node."""
+        other, pos, res = self.evaluate(index), 0, []
+        for doc_id in docs:
+            pos = gallop(other, doc_id, pos)
+            if pos < len(other) and other[pos] == doc_id:
+                res.append(doc_id)
+        return res
+
+
+class Term(Node):
+    def __init__(self, term):
+        self.term = term
+
+    def size(self, index):
+        return index.doc_freq(self.term)
+
+    def evaluate(self, index):
+        cursor = index.cursor(self.term)
+        return cursor.all() if cursor is not None else []
+
+    def filter(self, docs, index):
+        cursor = index.cursor(self.term)
+        if cursor is None:
+            return []
+        return [doc_id for doc_id in docs if cursor.seek(doc_id) == doc_id]
+
+
+class Positional(Node):
+    """Base of conditions on term positions inside a document."""
+
+    def __init__(self, terms):
+        self.terms = terms
+
+    def size(self, index):
+        return min(index.doc_freq(term) for term in self.terms)
+
+    def evaluate(self, index):
+        first = min(self.terms, key=index.doc_freq)
+        return self.filter(Term(first).evaluate(index), index)
+
+    def filter(self, docs, index):
+        for term in sorted(set(self.terms), key=index.doc_freq):
+            docs = Term(term).filter(docs, index)
+        if not index.has_positions or not docs:
+            return docs
+        cursors = {term: index.cursor(term) for term in set(self.terms)}
+        res = []
+        for doc_id in docs:
+            positions = {}
+            for term, cursor in cursors.items():
+                cursor.seek(doc_id)
+                positions[term] = cursor.positions()
+            if self.match(positions):
+                res.append(doc_id)
+        return res
+
+
+class Phrase(Positional):
+    def __init__(self, terms, offsets):
+        super().__init__(terms)
+        # position of every term relative to the first one, stopwords
+        # inside the phrase leave gaps
+        self.offsets = offsets
+
+    def match(self, positions):
+        first, offset = self.terms[0], self.offsets[0]
+        others = [(set(positions[term]), other_offset - offset)
+                  for term, other_offset in zip(self.terms[1:], self.offsets[1:])]
+        return any(all(position + shift in term_positions for term_positions, shift in others)
+                   for position in positions[first])
+
+
+class Near(Positional):
+    def __init__(self, left, right, distance):
+        super().__init__([left, right])
+        self.distance = distance
+
+    def match(self, positions):
+        left, right = positions[self.terms[0]], positions[self.terms[1]]
+        i = j = 0
+        while i < len(left) and j < len(right):
+            if abs(left[i] - right[j]) <= self.distance:
+                return True
+            if left[i] < right[j]:
+                i += 1
+            else:
+                j += 1
+        return False
+
+
+class And(Node):
+    def __init__(self, children):
+        self.children = children
+
+    def size(self, index):
+        return min((child.size(index) for child in self.children if not isinstance(child, Not)),
+                   default=index.n_docs)
+
+    def evaluate(self, index):
+        positive = sorted((child for child in self.children if not isinstance(child, Not)),
+                          key=lambda child: child.size(index))
+        negative = [child.child for child in self.children if isinstance(child, Not)]
+        if not positive:
+            docs = list(index.doc_ids())
+        elif positive[0].size(index) == 0:
+            return []
+        else:
+            docs = positive[0].evaluate(index)
+        for child in positive[1:]:
+            docs = filter_docs(docs, child, index, keep=True)
+            if not docs:
+                return []
+        for child in negative:
+            docs = filter_docs(docs, child, index, keep=False)
+        return docs
+
+
+class Or(Node):
+    def __init__(self, children):
+        self.children = children
+
+    def size(self, index):
+        return min(sum(child.size(index) for child in self.children), index.n_docs)
+
+    def evaluate(self, index):
+        res, last = [], None
+        for doc_id in heapq.merge(*(child.evaluate(index) for child in self.children)):
+            if doc_id != last:
+                res.append(doc_id)
+                last = doc_id
+        return res
+
+
+class Not(Node):
+    def __init__(self, child):
+        self.child = child
+
+    def size(self, index):
+        return index.n_docs
+
+    def evaluate(self, index):
+        return And([self]).evaluate(index)
+
+
+def filter_docs(docs, child, index, keep):
+    """Sorted ``docs`` that are (``keep``) or are not in the result of ``child``."""
+    matching = child.filter(docs, index)
+    if keep:
+        return matching
+    matching = set(matching)
+    return [doc_id for doc_id in docs if doc_id not in matching]
+
+
+class Parser:
+    def __init__(self, query, analyzer):
+        self.tokens = TOKEN_RE.findall(query)
+        self.pos = 0
+        self.analyzer = analyzer
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError("unexpected {!r}".format(self.peek()))
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == "OR":
+            self.take()
+            children.append(self.parse_and())
+        return combine(Or, children)
+
+    def parse_and(self):
+        children = []
+        while self.peek() not in (None, ")", "OR"):
+            if self.peek() == "AND":
+                self.take()
+                continue
+            children.append(self.parse_near())
+        return combine(And, children)
+
+    def parse_near(self):
+        node = self.parse_not()
+        while self.peek() is not None and NEAR_RE.match(self.peek()):
+            distance = int(NEAR_RE.match(self.take()).group(1))
+            right = self.parse_not()
+            if node is None or right is None:
+                node = node or right
+            elif isinstance(node, Term) and isinstance(right, Term):
+                node = Near(node.term, right.term, distance)
+            else:
+                raise QuerySyntaxError("NEAR needs a word on both sides")
+        return node
+
+    def parse_not(self):
+        if self.peek() == "NOT":
+            self.take()
+            child = self.parse_not()
+            return Not(child) if child is not None else None
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.take()
+        if token is None:
+            raise QuerySyntaxError("unexpected end of query")
+        if token == "(":
+            node = self.parse_or()
+            if self.take() != ")":
+                raise QuerySyntaxError("missing )")
+            return node
+        if token == ")":
+            raise QuerySyntaxError("unexpected )")
+        if token.startswith('"'):
+            return phrase(token.strip('"'), self.analyzer)
+        return combine(And, [Term(term) for term in self.analyzer.analyze(token)])
+
+
+def phrase(text, analyzer):
+    positions = analyzer.positions(text)
+    if len(positions) < 2:
+        return combine(And, [Term(term) for term, _ in positions])
+    return Phrase([term for term, _ in positions], [position for _, position in positions])
+
+
+def combine(cls, children):
+    """``cls`` node of the children, skipping empty ones (stopwords only)."""
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return cls(children)
+
+
+def parse(query, analyzer):
+    """Query tree, ``None`` when nothing is left after analysis.
+
+    A query that is not valid syntax is read as a plain list of words.
+    """
+    try:
+        return Parser(query, analyzer).parse()
+    except QuerySyntaxError:
+        return combine(And, [Term(term) for term in analyzer.analyze(query)])
+
+
+def terms(node):
+    """Terms of the query that are not negated, used for ranking."""
+    if node is None or isinstance(node, Not):
+        return []
+    if isinstance(node, Term):
+        return [node.term]
+    if isinstance(node, Positional):
+        return list(node.terms)
+    return [term for child in node.children for term in terms(child)]
+
+
+def is_conjunction(node):
+    """Whether the query is just a list of words without operators, matched by documents containing all."""
+    return isinstance(node, Term) or (isinstance(node, And) and all(isinstance(c, Term) for c in node.children))
+
+
+def is_disjunction(node):
+    """Whether the query is a word or words joined by OR, matched by documents containing any of them."""
+    return isinstance(node, Term) or (isinstance(node, Or) and all(isinstance(c, Term) for c in node.children))
+
+
+def evaluate(node, index):
+    """Sorted doc ids matching the query tree, an empty list for an empty query."""
+    if node is None:
+        return []
+    return node.evaluate(index)
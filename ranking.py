@@ -0,0 +1,165 @@
+"""BM25 ranking with MaxScore dynamic pruning over a ``BinaryIndex``.
+
+Every query term gets a score upper bound computed from its maximal
+frequency and the shortest document of the index. Terms are ordered by
+that bound; the ones whose bounds together can not lift a document over
+the current k-th best score are "non-essential": documents are only
+enumerated from the essential posting lists, and non-essential lists are
+probed with a skip/gallop seek only while the document can still make it
+into the top-k.
+
+Queries requiring all their terms (``top_k_all``) take candidates from the
+rarest term and check the other terms one by one only while the document's
+partial score plus the bounds of the terms left, at its length, can still
+beat the k-th best score.
+"""
+import heapq
+import math
+
+K1 = 1.2
+B = 0.75
+
+
+def idf(doc_freq, n_docs):
+    # never negative: a negative term would break the score upper bounds of top_k
+    return math.log(1 + max(0., n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def term_score(freq, doc_length, avg_doc_length, term_idf):
+    norm = K1 * (1 - B + B * doc_length / avg_doc_length) if avg_doc_length else K1
+    return term_idf * freq * (K1 + 1) / (freq + norm)
+
+
+class TermCursor:
+    """Posting cursor of a query term with its idf and score upper bound."""
+
+    def __init__(self, index, term):
+        self.cursor = index.cursor(term)
+        self.idf = idf(self.cursor.df, index.n_docs)
+        self.upper_bound = term_score(self.cursor.max_freq, index.min_doc_length, index.avg_doc_length, self.idf)
+
+    @property
+    def doc(self):
+        return self.cursor.doc
+
+    @property
+    def freq(self):
+        return self.cursor.freq
+
+    def advance(self):
+        return self.cursor.advance()
+
+    def seek(self, doc_id):
+        """Moves to the first posting with a doc id >= ``doc_id``."""
+        return self.cursor.seek(doc_id)
+
+
+def score_docs(index, terms, doc_ids):
+    """BM25 scores of the given docs, used to rank results of boolean queries."""
+    cursors = [TermCursor(index, term) for term in set(terms) if term in index]
+    res = {}
+    for doc_id in sorted(doc_ids):
+        score = 0.
+        doc_length = index.doc_length(doc_id)
+        for cursor in cursors:
+            if cursor.seek(doc_id) == doc_id:
+                score += term_score(cursor.freq, doc_length, index.avg_doc_length, cursor.idf)
+        res[doc_id] = score
+    return res
+
+
+def top_k(index, terms, k):
+    """Returns up to ``k`` ``(score, doc id)`` pairs, best first, matching any of ``terms``."""
+    cursors = sorted((TermCursor(index, term) for term in set(terms) if term in index),
+                     key=lambda cursor: cursor.upper_bound)
+    if k <= 0 or not cursors:
+        return []
+    # bounds[i] is the sum of upper bounds of cursors[:i + 1]
+    bounds = []
+    for cursor in cursors:
+        bounds.append(cursor.upper_bound + (bounds[-1] if bounds else 0.))
+
+    heap = []
+    threshold = 0.
+    # cursors[:first_essential] are non-essential
+    first_essential = 0
+    while True:
+        essential = cursors[first_essential:]
+        doc_id = min((cursor.doc for cursor in essential if cursor.doc is not None), default=None)
+        if doc_id is None:
+            break
+        doc_length = index.doc_length(doc_id)
+        score = 0.
+        for cursor in essential:
+            if cursor.doc == doc_id:
+                score += term_score(cursor.freq, doc_length, index.avg_doc_length, cursor.idf)
+                cursor.advance()
+        for i in range(first_essential - 1, -1, -1):
+            if score + bounds[i] <= threshold:
+                break
+            cursor = cursors[i]
+            if cursor.seek(doc_id) == doc_id:
+                score += term_score(cursor.freq, doc_length, index.avg_doc_length, cursor.idf)
+
+        if len(heap) < k:
+            heapq.heappush(heap, (score, -doc_id))
+        elif score > threshold:
+            heapq.heapreplace(heap, (score, -doc_id))
+        else:
+            continue
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while first_essential < len(cursors) and bounds[first_essential] <= threshold:
+                first_essential += 1
+    return [(score, -doc_id) for score, doc_id in sorted(heap, reverse=True)]
+
+
+def top_k_all(index, terms, k):
+    """Returns up to ``k`` ``(score, doc id)`` pairs, best first, of the docs containing all ``terms``."""
+    terms = set(terms)
+    if k <= 0 or not terms or any(term not in index for term in terms):
+        return []
+    cursors = sorted((TermCursor(index, term) for term in terms), key=lambda cursor: cursor.cursor.df)
+    lead, others = cursors[0], cursors[1:]
+    max_score = sum(cursor.upper_bound for cursor in cursors)
+
+    heap = []
+    threshold = 0.
+    doc_id = lead.doc
+    while doc_id is not None:
+        full = len(heap) == k
+        if full and max_score <= threshold:
+            # no document left can make it into the top-k
+            break
+        doc_length = index.doc_length(doc_id)
+        score = term_score(lead.freq, doc_length, index.avg_doc_length, lead.idf)
+        # upper bounds of the other terms in a doc of this length
+        bounds = [term_score(cursor.cursor.max_freq, doc_length, index.avg_doc_length, cursor.idf)
+                  for cursor in others]
+        remaining = sum(bounds)
+        match, target = True, None
+        for cursor, bound in zip(others, bounds):
+            if full and score + remaining <= threshold:
+                match = False
+                break
+            found = cursor.seek(doc_id)
+            if found != doc_id:
+                match = False
+                if found is None:
+                    # a term has no docs left, neither has the conjunction
+                    doc_id = None
+                target = found
+                break
+            score += term_score(cursor.freq, doc_length, index.avg_doc_length, cursor.idf)
+            remaining -= bound
+        if doc_id is None:
+            break
+        if match:
+            if not full:
+                heapq.heappush(heap, (score, -doc_id))
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -doc_id))
+            if len(heap) == k:
+                threshold = heap[0][0]
+        doc_id = lead.seek(target) if target is not None else lead.advance()
+    return [(score, -doc_id) for score, doc_id in sorted(heap, reverse=True)]
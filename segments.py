@@ -0,0 +1,389 @@
+"""Segmented index: immutable binary segments, tombstones and merging.
+
+An index is a list of segments, every one a ``BinaryIndex`` file with its
+own doc ids, described by ``segments.json``::
+
+    {"segments": [{"file": "seg_000000.bin", "base": 0, "count": 1000, "store": "seg_000000.docs"}, ...],
+     "deleted": [12, 57], "next_id": 1200, "next_segment": 3, "positions": true, "store": true}
+
+Doc ``i`` of a segment has the global id ``base + i``; segments cover
+ascending, non overlapping id ranges, so walking them in order gives
+global ids in ascending order. A build flushes a segment whenever the
+postings collected in memory reach a budget, an incremental update appends
+new segments and records removed docs as tombstones in ``deleted``.
+``merge`` combines adjacent segments of similar size (log-structured,
+``MERGE_FACTOR`` at a time) and drops the postings of deleted docs while
+doing so, renumbering the docs of the merged range.
+
+With ``store`` every segment has a ``docstore`` file with the text of its
+docs, written and merged along with the segment.
+"""
+import heapq
+import json
+import math
+import os
+from bisect import bisect_right
+
+import docstore
+from binindex import BinaryIndex, write_postings
+
+SEGMENTS_FILE = "segments.json"
+# number of adjacent segments of the same size level merged together
+MERGE_FACTOR = 4
+# a segment with more deleted than live docs is rewritten on its own
+MAX_DELETED_RATIO = 0.5
+# rough memory taken by an in-memory segment: per posting, per position and per new term
+POSTING_BYTES = 120
+POSITION_BYTES = 40
+TERM_BYTES = 200
+
+
+def new_manifest(positions, store=False):
+    return {"segments": [], "deleted": [], "next_id": 0, "next_segment": 0, "positions": positions,
+            "store": store}
+
+
+def load_manifest(folder):
+    with open(os.path.join(folder, SEGMENTS_FILE)) as json_file:
+        return json.load(json_file)
+
+
+def save_manifest(folder, manifest):
+    path = os.path.join(folder, SEGMENTS_FILE)
+    with open(path + ".tmp", "w") as json_file:
+        json.dump(manifest, json_file)
+    os.replace(path + ".tmp", path)
+
+
+class SegmentWriter:
+    """Collects analyzed documents and flushes them as a segment when ``memory_budget`` is reached."""
+
+    def __init__(self, folder, manifest, memory_budget):
+        self.folder = folder
+        self.manifest = manifest
+        self.memory_budget = memory_budget
+        self._reset()
+
+    def _reset(self):
+        # term -> {local doc id: freq}, term -> {local doc id: positions}
+        self.res = {}
+        self.positions = {} if self.manifest["positions"] else None
+        # (compressed text blocks, text bytes) by local doc id
+        self.stored = [] if self.manifest.get("store") else None
+        self.count = 0
+        self.size = 0
+
+    def add(self, counts, term_positions=None, stored=None):
+        """Adds a document, returns its global doc id. ``stored`` is a ``docstore.BlockCompressor``
+        with the text of the document."""
+        doc_id = self.count
+        self.count += 1
+        if self.stored is not None:
+            self.stored.append((stored.blocks, stored.text_bytes) if stored is not None else ([], 0))
+            self.size += stored.size if stored is not None else 0
+        for term, freq in counts.items():
+            postings = self.res.get(term)
+            if postings is None:
+                postings = self.res[term] = {}
+                self.size += TERM_BYTES
+            postings[doc_id] = freq
+            self.size += POSTING_BYTES
+        if self.positions is not None:
+            for term, positions in term_positions.items():
+                self.positions.setdefault(term, {})[doc_id] = positions
+                self.size += POSITION_BYTES * len(positions)
+        global_id = self.manifest["next_id"] + doc_id
+        if self.size >= self.memory_budget:
+            self.flush()
+        return global_id
+
+    def flush(self):
+        if not self.count:
+            return
+        name = "seg_{:06d}.bin".format(self.manifest["next_segment"])
+
+        def items():
+            for term in sorted(self.res, key=lambda term: term.encode("utf-8")):
+                postings = sorted(self.res[term].items())
+                yield term, postings, \
+                    [self.positions[term][doc_id] for doc_id, _ in postings] if self.positions is not None else None
+
+        write_postings(os.path.join(self.folder, name), self.count, items(), self.positions is not None)
+        segment = {"file": name, "base": self.manifest["next_id"], "count": self.count}
+        if self.stored is not None:
+            segment["store"] = docstore.store_name(name)
+            docstore.write(os.path.join(self.folder, segment["store"]), self.stored)
+        self.manifest["segments"].append(segment)
+        self.manifest["next_id"] += self.count
+        self.manifest["next_segment"] += 1
+        self._reset()
+
+
+def plan_merge(manifest):
+    """``(start, end)`` of the adjacent segments to merge next, ``None`` when none need to."""
+    segments = manifest["segments"]
+    deleted = sorted(manifest["deleted"])
+    live = []
+    for segment in segments:
+        lo, hi = segment["base"], segment["base"] + segment["count"]
+        n_deleted = bisect_right(deleted, hi - 1) - bisect_right(deleted, lo - 1)
+        if n_deleted and n_deleted > MAX_DELETED_RATIO * segment["count"]:
+            return len(live), len(live) + 1
+        live.append(segment["count"] - n_deleted)
+    levels = [int(math.log(max(count, 1), MERGE_FACTOR)) for count in live]
+    for start in range(len(levels) - MERGE_FACTOR + 1):
+        if len(set(levels[start:start + MERGE_FACTOR])) == 1:
+            return start, start + MERGE_FACTOR
+    return None
+
+
+def merge(folder, manifest, start, end):
+    """Replaces ``segments[start:end]`` with one segment without their deleted docs.
+
+    Returns old global id -> new global id of the live docs of the range.
+    The old segment files are removed from ``folder``.
+    """
+    parts = manifest["segments"][start:end]
+    indexes = [BinaryIndex(os.path.join(folder, part["file"])) for part in parts]
+    deleted = set(manifest["deleted"])
+    base = parts[0]["base"]
+    remap = {}
+    for part in parts:
+        for doc_id in range(part["base"], part["base"] + part["count"]):
+            if doc_id not in deleted:
+                remap[doc_id] = base + len(remap)
+    with_positions = all(index.has_positions for index in indexes)
+
+    def items():
+        last = None
+        for term in heapq.merge(*(index.terms() for index in indexes)):
+            if term == last:
+                continue
+            last = term
+            postings, positions = [], [] if with_positions else None
+            for part, index in zip(parts, indexes):
+                cursor = index.cursor(term)
+                while cursor is not None and cursor.doc is not None:
+                    doc_id = part["base"] + cursor.doc
+                    if doc_id in remap:
+                        postings.append((remap[doc_id] - base, cursor.freq))
+                        if with_positions:
+                            positions.append(cursor.positions())
+                    cursor.advance()
+            if postings:
+                yield term, postings, positions
+
+    name = "seg_{:06d}.bin".format(manifest["next_segment"])
+    segment = {"file": name, "base": base, "count": len(remap)}
+    try:
+        if remap:
+            write_postings(os.path.join(folder, name), len(remap), items(), with_positions)
+            if manifest.get("store"):
+                segment["store"] = docstore.store_name(name)
+                merge_stores(folder, parts, remap, os.path.join(folder, segment["store"]))
+    finally:
+        for index in indexes:
+            index.close()
+    for part in parts:
+        os.remove(os.path.join(folder, part["file"]))
+        if "store" in part:
+            os.remove(os.path.join(folder, part["store"]))
+    end_id = parts[-1]["base"] + parts[-1]["count"]
+    # a range without live docs just disappears
+    manifest["segments"][start:end] = [segment] if remap else []
+    manifest["deleted"] = [doc_id for doc_id in manifest["deleted"] if not base <= doc_id < end_id]
+    manifest["next_segment"] += 1
+    return remap
+
+
+def merge_stores(folder, parts, remap, path):
+    """Writes the store of merged ``parts``: the compressed blocks of their live docs, copied as is."""
+    stores = [docstore.DocStore(os.path.join(folder, part["store"])) if "store" in part else None
+              for part in parts]
+
+    def docs():
+        for part, store in zip(parts, stores):
+            for doc_id in range(part["base"], part["base"] + part["count"]):
+                if doc_id in remap:
+                    yield store.raw(doc_id - part["base"]) if store is not None else ([], 0)
+
+    try:
+        docstore.write(path, docs())
+    finally:
+        for store in stores:
+            if store is not None:
+                store.close()
+
+
+class SegmentedCursor:
+    """Posting cursor of a term over all segments, global doc ids, deleted docs skipped."""
+
+    def __init__(self, parts, deleted):
+        # (base, count, segment cursor) of the segments having the term
+        self.parts = parts
+        self.deleted = deleted
+        self.df = sum(cursor.df for _, _, cursor in parts)
+        self.max_freq = max(cursor.max_freq for _, _, cursor in parts)
+        self.i = 0
+        self._settle()
+
+    def _settle(self):
+        """Moves past exhausted segments and deleted docs."""
+        while self.i < len(self.parts):
+            base, _, cursor = self.parts[self.i]
+            if cursor.doc is None:
+                self.i += 1
+            elif base + cursor.doc in self.deleted:
+                cursor.advance()
+            else:
+                break
+
+    @property
+    def doc(self):
+        if self.i >= len(self.parts):
+            return None
+        base, _, cursor = self.parts[self.i]
+        return base + cursor.doc
+
+    @property
+    def freq(self):
+        return self.parts[self.i][2].freq
+
+    def advance(self):
+        self.parts[self.i][2].advance()
+        self._settle()
+        return self.doc
+
+    def seek(self, doc_id):
+        while self.i < len(self.parts):
+            base, count, cursor = self.parts[self.i]
+            if doc_id < base + count:
+                cursor.seek(max(doc_id - base, 0))
+                break
+            self.i += 1
+        self._settle()
+        return self.doc
+
+    def positions(self):
+        return self.parts[self.i][2].positions() if self.i < len(self.parts) else None
+
+    def all(self):
+        res = []
+        while self.i < len(self.parts):
+            base, _, cursor = self.parts[self.i]
+            res.extend(base + doc_id for doc_id in cursor.all() if base + doc_id not in self.deleted)
+            self.i += 1
+        return res
+
+
+class SegmentedIndex:
+    """``BinaryIndex`` interface over the segments of ``folder``."""
+
+    def __init__(self, folder):
+        self.manifest = load_manifest(folder)
+        self.segments = [(part["base"], part["count"], BinaryIndex(os.path.join(folder, part["file"])))
+                         for part in self.manifest["segments"]]
+        # document stores of the segments, None for segments written without one
+        self.stores = [docstore.DocStore(os.path.join(folder, part["store"])) if "store" in part else None
+                       for part in self.manifest["segments"]]
+        self.bases = [base for base, _, _ in self.segments]
+        self.deleted = set(self.manifest["deleted"])
+        # ranking statistics count deleted docs until their segment is merged, like doc_freq,
+        # so that N and the document frequencies of idf are over the same docs
+        self.n_docs = sum(count for _, count, _ in self.segments)
+        self.total_length = sum(index.total_length for _, _, index in self.segments)
+        self.min_doc_length = min((index.min_doc_length for _, _, index in self.segments), default=0)
+        self.avg_doc_length = self.total_length / self.n_docs if self.n_docs else 0.
+        self.has_positions = bool(self.segments) and all(index.has_positions for _, _, index in self.segments)
+
+    @property
+    def size(self):
+        """Bytes of the mmapped segment files. Document stores are not counted, only the
+        blocks of shown results are read."""
+        return sum(len(index.buf) for _, _, index in self.segments)
+
+    @property
+    def store_size(self):
+        """Bytes of the document stores."""
+        return sum(len(store.buf) for store in self.stores if store is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self.terms())
+
+    def __contains__(self, term):
+        return any(term in index for _, _, index in self.segments)
+
+    def doc_freq(self, term):
+        """Number of docs of the term, deleted ones included until their segment is merged."""
+        return sum(index.doc_freq(term) for _, _, index in self.segments)
+
+    def max_freq(self, term):
+        return max((index.max_freq(term) for _, _, index in self.segments), default=0)
+
+    def _segment(self, doc_id):
+        return self.segments[bisect_right(self.bases, doc_id) - 1]
+
+    def doc_length(self, doc_id):
+        base, _, index = self._segment(doc_id)
+        return index.doc_length(doc_id - base)
+
+    def text_blocks(self, doc_id):
+        """Decompressed text blocks of a doc (lazily), ``None`` if its segment has no store."""
+        i = bisect_right(self.bases, doc_id) - 1
+        if self.stores[i] is None:
+            return None
+        return self.stores[i].blocks(doc_id - self.bases[i])
+
+    def doc_ids(self):
+        for base, count, _ in self.segments:
+            for doc_id in range(base, base + count):
+                if doc_id not in self.deleted:
+                    yield doc_id
+
+    def cursor(self, term):
+        parts = []
+        for base, count, index in self.segments:
+            cursor = index.cursor(term)
+            if cursor is not None:
+                parts.append((base, count, cursor))
+        return SegmentedCursor(parts, self.deleted) if parts else None
+
+    def postings(self, term):
+        cursor = self.cursor(term)
+        res = []
+        while cursor is not None and cursor.doc is not None:
+            res.append((cursor.doc, cursor.freq))
+            cursor.advance()
+        return res
+
+    def terms(self):
+        last = None
+        for term in heapq.merge(*(index.terms() for _, _, index in self.segments)):
+            if term != last:
+                yield term
+                last = term
+
+    def coll_freqs(self):
+        """Yields ``(term, collection frequency)`` in term order, summed over segments."""
+        last, total = None, 0
+        for term, cf in heapq.merge(*(index.coll_freqs() for _, _, index in self.segments)):
+            if term != last and last is not None:
+                yield last, total
+                total = 0
+            last = term
+            total += cf
+        if last is not None:
+            yield last, total
+
+    def close(self):
+        for _, _, index in self.segments:
+            index.close()
+        for store in self.stores:
+            if store is not None:
+                store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,29 @@
+// Shows the progress of a load job, polled from its status until it ends. Polling holds no worker
+// while the job runs, unlike the server-sent events of /api/jobs/<id>/events.
+const JOB_POLL_MS = 500;
+
+function follow_job(job) {
+    show_job(job);
+    if (job.state === "done" || job.state === "failed") {
+        return;
+    }
+    setTimeout(function () {
+        axios.get(`/api/jobs/${job.id}`).then(function (response) {
+            follow_job(response.data);
+        });
+    }, JOB_POLL_MS);
+}
+
+function show_job(job) {
+    let progress = job.progress;
+    let html = `${job.kind}: ${job.state}` + (job.stage ? ` (${job.stage})` : "") + "<br>" +
+        `listed ${progress.listed}, downloaded ${progress.downloaded}, ` +
+        `extracted ${progress.extracted}, indexed ${progress.indexed}`;
+    for (let stage in job.stages) {
+        html += `<br>${stage}: ${job.stages[stage].passed.toFixed(1)} s`;
+    }
+    if (job.state === "failed") {
+        html += `<br>${job.error}`;
+    }
+    $("#result").html(html);
+}
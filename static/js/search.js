@@ -1,35 +1,91 @@
+const PAGE_SIZE = 50;
+const SUGGEST_DELAY = 50;
+
+let suggest_timer = null;
+let suggest_request = 0;
+
+function suggest() {
+    clearTimeout(suggest_timer);
+    suggest_timer = setTimeout(function () {
+        let query = $("#query").val();
+        // the last word of the query is completed
+        let prefix = query.match(/[^\s()"]*$/)[0];
+        let head = query.slice(0, query.length - prefix.length);
+        let list = $("#suggestions");
+        if (prefix.length === 0 || ["AND", "OR", "NOT"].includes(prefix) || prefix.startsWith("NEAR/")) {
+            list.empty();
+            return;
+        }
+        let request_id = ++suggest_request;
+        axios.get('/api/suggest', {
+            params: {
+                prefix: prefix
+            }
+        }).then(function (response) {
+            // answers to earlier keystrokes arriving late are dropped
+            if (request_id !== suggest_request) {
+                return;
+            }
+            list.empty();
+            for (let term of response.data.suggestions) {
+                list.append($("<option>").attr("value", head + term));
+            }
+        }).catch(function (error) {
+            console.log(error);
+        });
+    }, SUGGEST_DELAY);
+}
+
 function search() {
     if ($.fn.DataTable.isDataTable('#results')) {
         $('#results').DataTable().destroy();
     }
 
     $('#results tbody').empty();
+    $("#more").hide();
     let checkbox = $("#delete_all");
     checkbox.hide();
     $("label[for='delete_all']").hide();
     if (checkbox.prop("checked")) {
         search_delete();
     } else {
-        let query = $("#query").val();
-        axios.get('/api/search', {
-            params: {
-                query: query
+        search_page(0);
+    }
+}
+
+function search_more() {
+    search_page($("#more").data("offset"));
+}
+
+function search_page(offset) {
+    let query = $("#query").val();
+    axios.get('/api/search', {
+        params: {
+            query: query,
+            limit: PAGE_SIZE,
+            offset: offset
+        }
+    }).then(function (response) {
+        let data = response.data;
+        if (response.status === 200) {
+            let docs = data.docs;
+            let snippets = data.snippets || [];
+            let resp_query = data.query;
+            if (resp_query !== query) {
+                $("#query").val(resp_query);
             }
-        }).then(function (response) {
-            let data = response.data;
-            if (response.status === 200) {
-                let docs = data.docs;
-                let resp_query = data.query;
-                if (resp_query !== query) {
-                    $("#query").val(resp_query);
+            if (docs != null) {
+                for (let i = 0; i < docs.length; i++) {
+                    let doc = docs[i];
+                    // snippets come escaped, with the query words in <mark>
+                    let snippet = snippets[i] ? `<div class="snippet">${snippets[i]}</div>` : "";
+                    doc = [offset + i + 1, `<a href='${doc[1].link}' target="_blank">${doc[0]}</a>${snippet}`,
+                        `<img id="${doc[1].id}" class="icon-delete" src="static/icons/remove.png" alt="Delete">`];
+                    docs[i] = doc;
                 }
-                if (docs != null) {
-                    for (let i = 0; i < docs.length; i++) {
-                        let doc = docs[i];
-                        doc = [i + 1, `<a href='${doc[1].link}' target="_blank">${doc[0]}</a>`,
-                            `<img id="${doc[1].id}" class="icon-delete" src="static/icons/remove.png" alt="Delete">`];
-                        docs[i] = doc;
-                    }
+                if (offset > 0 && $.fn.DataTable.isDataTable('#results')) {
+                    $('#results').DataTable().rows.add(docs).draw(false);
+                } else {
                     let table = $('#results').DataTable({
                         data: docs,
                         searching: false,
@@ -56,14 +112,15 @@ function search() {
                             });
                         }
                     });
-                } else {
-                    $("#files").html("Files for this query not found");
                 }
+                $("#more").data("offset", offset + docs.length).toggle(data.has_more);
+            } else {
+                $("#files").html("Files for this query not found");
             }
-        }).catch(function (error) {
-            console.log(error);
-        });
-    }
+        }
+    }).catch(function (error) {
+        console.log(error);
+    });
 }
 
 function search_delete() {
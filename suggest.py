@@ -0,0 +1,161 @@
+"""Prefix completions of the index vocabulary, opened with mmap.
+
+Layout of ``suggest.bin`` (little endian)::
+
+    header      magic "GDSG", version, number of terms, number of top
+                lists, offsets of the sections below
+    term table  one entry per term sorted by the term's UTF-8 bytes: term
+                offset/length in the blob, weight (collection frequency)
+    terms blob  UTF-8 terms one after another
+    top table   one entry per prefix matching more than SCAN_LIMIT terms,
+                sorted by prefix: prefix offset/length in the prefix blob,
+                offset and length of its list in the top lists
+    prefixes    UTF-8 prefixes of the top table
+    top lists   uint32 term numbers of the TOP_K heaviest terms of every
+                prefix in the top table, heaviest first
+
+The terms starting with a prefix are a contiguous range of the term table
+found by binary search. A range of at most SCAN_LIMIT terms is scanned for
+its heaviest terms, a larger one (a short prefix) has them precomputed, so
+a lookup reads a bounded number of entries whatever the vocabulary size.
+"""
+import heapq
+import mmap
+import os
+import struct
+
+MAGIC = b"GDSG"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQQQQQ")
+TERM = struct.Struct("<III")
+TOP = struct.Struct("<IIII")
+# prefixes matching more terms than this get a precomputed list
+SCAN_LIMIT = 1024
+# completions kept per precomputed list, the largest limit served
+TOP_K = 20
+
+
+def heaviest(weight, lo, hi, k):
+    """Numbers of the ``k`` heaviest terms in ``lo:hi``, ties in term order; ``weight(i)`` is the
+    weight of term ``i``."""
+    return heapq.nsmallest(k, range(lo, hi), key=lambda i: (-weight(i), i))
+
+
+def write(path, vocabulary):
+    """Writes ``suggest.bin`` for ``vocabulary``: term -> weight."""
+    items = sorted(((term.encode("utf-8"), weight) for term, weight in vocabulary.items()), key=lambda x: x[0])
+    terms = [term.decode("utf-8") for term, _ in items]
+    weights = [weight for _, weight in items]
+
+    # prefixes (in characters) matching more than SCAN_LIMIT terms, found
+    # by splitting large ranges by one more character at a time
+    tops = []
+    ranges = [("", 0, len(terms))]
+    while ranges:
+        prefix, lo, hi = ranges.pop()
+        length = len(prefix) + 1
+        start = lo
+        while start < hi:
+            if len(terms[start]) < length:
+                start += 1
+                continue
+            sub = terms[start][:length]
+            end = start + 1
+            while end < hi and terms[end].startswith(sub):
+                end += 1
+            if end - start > SCAN_LIMIT:
+                tops.append((sub.encode("utf-8"), heaviest(weights.__getitem__, start, end, TOP_K)))
+                ranges.append((sub, start, end))
+            start = end
+    tops.sort(key=lambda top: top[0])
+
+    blob = bytearray()
+    table = bytearray()
+    for term, weight in items:
+        table += TERM.pack(len(blob), len(term), weight)
+        blob += term
+    prefixes = bytearray()
+    top_table = bytearray()
+    lists = bytearray()
+    for prefix, numbers in tops:
+        top_table += TOP.pack(len(prefixes), len(prefix), len(lists) // 4, len(numbers))
+        prefixes += prefix
+        lists += struct.pack("<{}I".format(len(numbers)), *numbers)
+
+    offset = HEADER.size
+    sections = []
+    for section in (table, blob, top_table, prefixes, lists):
+        sections.append(offset)
+        offset += len(section)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(items), len(tops), *sections))
+        for section in (table, blob, top_table, prefixes, lists):
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class Suggester:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_terms, self.n_tops, self.table_start, self.blob_start, self.top_start, \
+            self.prefixes_start, self.lists_start = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.buf.close()
+            raise ValueError("{} is not a suggest file of version {}".format(path, VERSION))
+
+    def close(self):
+        self.buf.close()
+
+    def _term(self, i):
+        offset, length, weight = TERM.unpack_from(self.buf, self.table_start + i * TERM.size)
+        start = self.blob_start + offset
+        return self.buf[start:start + length], weight
+
+    def _weight(self, i):
+        return TERM.unpack_from(self.buf, self.table_start + i * TERM.size)[2]
+
+    def _bisect(self, target):
+        """Number of the first term whose UTF-8 bytes are not smaller than ``target``."""
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _top_list(self, prefix):
+        lo, hi = 0, self.n_tops
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, length, start, count = TOP.unpack_from(self.buf, self.top_start + mid * TOP.size)
+            key = self.buf[self.prefixes_start + offset:self.prefixes_start + offset + length]
+            if key == prefix:
+                return struct.unpack_from("<{}I".format(count), self.buf, self.lists_start + start * 4)
+            if key < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def complete(self, prefix, limit=10):
+        """``[(term, weight), ...]`` of the heaviest terms starting with ``prefix``."""
+        limit = min(limit, TOP_K)
+        if not prefix or limit < 1:
+            return []
+        prefix = prefix.encode("utf-8")
+        lo = self._bisect(prefix)
+        # no UTF-8 byte is 0xff, every term with the prefix sorts before prefix + 0xff
+        hi = self._bisect(prefix + b"\xff")
+        numbers = self._top_list(prefix) if hi - lo > SCAN_LIMIT else None
+        if numbers is None:
+            numbers = heaviest(self._weight, lo, hi, limit)
+        res = []
+        for i in numbers[:limit]:
+            term, weight = self._term(i)
+            res.append((term.decode("utf-8"), weight))
+        return res
+
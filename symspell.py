@@ -0,0 +1,117 @@
+"""Symmetric delete spelling correction (SymSpell).
+
+Every vocabulary word is indexed under all strings obtained by deleting up
+to ``max_distance`` characters from its first ``prefix_length`` characters.
+A lookup generates the same deletes for the query word and verifies only
+the words found under them, instead of generating every possible edit of
+the query as Norvig's corrector does. The index is built together with the
+inverted index and saved as ``spell.json`` next to it.
+"""
+import json
+import os
+
+
+def deletes(word, max_distance):
+    """All strings made of ``word`` by deleting up to ``max_distance`` characters."""
+    res = {word}
+    edge = {word}
+    for _ in range(max_distance):
+        edge = {w[:i] + w[i + 1:] for w in edge if len(w) > 1 for i in range(len(w))} - res
+        res |= edge
+    return res
+
+
+def distance(a, b, max_distance):
+    """Optimal string alignment distance (Damerau-Levenshtein with adjacent transpositions).
+
+    Returns ``max_distance + 1`` as soon as the distance is known to be larger.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+class SymSpell:
+    def __init__(self, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words = []
+        self.freqs = {}
+        self.deletes = {}
+        # word -> the word shown in its place, e.g. a stem -> its most frequent word
+        self.forms = {}
+
+    @classmethod
+    def build(cls, vocabulary, max_distance=2, prefix_length=7, forms=None):
+        """``vocabulary`` maps words to their frequency in the whole index."""
+        spell = cls(max_distance, prefix_length)
+        spell.words = list(vocabulary)
+        spell.freqs = dict(vocabulary)
+        spell.forms = dict(forms or {})
+        for i, word in enumerate(spell.words):
+            for key in deletes(word[:prefix_length], max_distance):
+                spell.deletes.setdefault(key, []).append(i)
+        return spell
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as json_file:
+            json.dump({"max_distance": self.max_distance, "prefix_length": self.prefix_length,
+                       "words": [[word, self.freqs[word]] for word in self.words],
+                       "deletes": self.deletes, "forms": self.forms}, json_file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as json_file:
+            data = json.load(json_file)
+        spell = cls(data["max_distance"], data["prefix_length"])
+        spell.words = [word for word, _ in data["words"]]
+        spell.freqs = {word: freq for word, freq in data["words"]}
+        spell.deletes = data["deletes"]
+        spell.forms = data.get("forms", {})
+        return spell
+
+    @property
+    def size(self):
+        """Rough memory taken by the loaded index, in bytes."""
+        return sum(100 + len(word) * 2 for word in self.words) + \
+            sum(80 + len(key) * 2 + 8 * len(ids) for key, ids in self.deletes.items()) + \
+            sum(200 + (len(word) + len(form)) * 2 for word, form in self.forms.items())
+
+    def lookup(self, word):
+        """Closest known word, the most frequent one among equally close; ``word`` itself if none."""
+        if word in self.freqs:
+            return word
+        best, best_key = word, (self.max_distance + 1, 0)
+        seen = set()
+        level, checked = {word[:self.prefix_length]}, set()
+        for deleted in range(self.max_distance + 1):
+            # a key made by more deletes than the best distance found so far
+            # can not give a closer word
+            if deleted > best_key[0]:
+                break
+            for key in level:
+                for i in self.deletes.get(key, ()):
+                    if i in seen:
+                        continue
+                    seen.add(i)
+                    candidate = self.words[i]
+                    dist = distance(word, candidate, min(best_key[0], self.max_distance))
+                    candidate_key = (dist, -self.freqs[candidate])
+                    if dist <= self.max_distance and candidate_key < best_key:
+                        best, best_key = candidate, candidate_key
+            checked |= level
+            level = {w[:i] + w[i + 1:] for w in level if len(w) > 1 for i in range(len(w))} - checked
+        return best
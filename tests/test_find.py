@@ -0,0 +1,84 @@
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analyzer  # noqa: E402
+import ranking  # noqa: E402
+import segments  # noqa: E402
+from gdriveloader import GDriveIndex  # noqa: E402
+
+WORDS = ["alpha", "beta", "gamma", "delta", "omega"]
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    """A small index of random docs in ``drive_files/cid``, returns the terms of every doc by name."""
+    # no NLTK corpus needed, the words are not stopwords anyway
+    monkeypatch.setattr(analyzer, "_stopwords", frozenset())
+    monkeypatch.setattr(analyzer, "_analyzers", {})
+    monkeypatch.chdir(tmp_path)
+    folder = os.path.join("drive_files", "cid")
+    os.makedirs(folder)
+    rnd = random.Random(0)
+    manifest = segments.new_manifest(positions=False)
+    writer = segments.SegmentWriter(folder, manifest, memory_budget=3000)
+    docs, names, urls = {}, {}, {}
+    for i in range(120):
+        counts = {word: rnd.randint(1, 4) for word in WORDS if rnd.random() < 0.6} or {"omega": 1}
+        name = "doc{:03d}.docx".format(i)
+        names[writer.add(counts)] = name
+        docs[name] = counts
+        urls[name] = {"id": "id{}".format(i), "link": "link{}".format(i)}
+    writer.flush()
+    segments.save_manifest(folder, manifest)
+    # a copy of doc005 is a result of its own next to it
+    urls["copy of doc005.docx"] = {"id": "copy", "link": "copy", "same_as": "doc005.docx"}
+    for path, obj in (("docs.json", names), ("docs_urls.json", urls), ("analyzer.json", {"stemming": False})):
+        with open(os.path.join(folder, path), "w") as json_file:
+            json.dump(obj, json_file)
+    return docs
+
+
+def oracle(docs, words):
+    """Names of all docs containing every word with their BM25 score, best first, copies after their doc."""
+    lengths = {name: sum(counts.values()) for name, counts in docs.items()}
+    avg_doc_length = sum(lengths.values()) / len(docs)
+    scores = {}
+    for name, counts in docs.items():
+        if all(word in counts for word in words):
+            scores[name] = sum(
+                ranking.term_score(counts[word], lengths[name], avg_doc_length,
+                                   ranking.idf(sum(1 for c in docs.values() if word in c), len(docs)))
+                for word in set(words))
+    res = []
+    for name, score in sorted(scores.items(), key=lambda item: (-item[1], item[0])):
+        res.append((name, score))
+        if name == "doc005.docx":
+            res.append(("copy of doc005.docx", score))
+    return res
+
+
+@pytest.mark.parametrize("query", ["alpha", "alpha beta", "beta gamma delta", "alpha omega gamma"])
+def test_ranked_find_pages_follow_the_full_ranking(drive, query):
+    expected = oracle(drive, query.split())
+    index = GDriveIndex("cid")
+    everything = index.find(query, ranked=True)
+    assert [doc[0] for doc in everything] == [name for name, _ in expected]
+    assert [doc[2] for doc in everything] == pytest.approx([score for _, score in expected], rel=1e-9)
+    assert all("same_as" not in doc[1] for doc in everything)
+    for limit in (1, 7, 25):
+        pages = []
+        for offset in range(0, len(expected) + limit, limit):
+            pages += index.find(query, limit=limit, offset=offset, ranked=True)
+        assert [doc[0] for doc in pages] == [name for name, _ in expected]
+
+
+def test_unranked_find_matches_the_same_docs(drive):
+    index = GDriveIndex("cid")
+    ranked = {doc[0] for doc in index.find("beta gamma", ranked=True)}
+    assert {doc[0] for doc in index.find("beta gamma")} == ranked
@@ -0,0 +1,131 @@
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analyzer  # noqa: E402
+import query_engine  # noqa: E402
+import segments  # noqa: E402
+
+TEXTS = [
+    "report draft archive",
+    "report final",
+    "draft final notes",
+    "terms of delivery contract signed",
+    "delivery of terms, the contract was never signed",
+    "the report",
+]
+
+
+@pytest.fixture
+def text_analyzer(monkeypatch):
+    # a couple of stopwords instead of the NLTK corpus
+    monkeypatch.setattr(analyzer, "_stopwords", frozenset({"of", "the", "was"}))
+    return analyzer.Analyzer()
+
+
+def build(folder, text_analyzer, positions=True):
+    manifest = segments.new_manifest(positions=positions)
+    # a segment per document, so that cursors cross segments
+    writer = segments.SegmentWriter(folder, manifest, memory_budget=1)
+    for text in TEXTS:
+        term_positions = {}
+        for term, position in text_analyzer.positions(text):
+            term_positions.setdefault(term, []).append(position)
+        writer.add(Counter({term: len(found) for term, found in term_positions.items()}), term_positions)
+    writer.flush()
+    segments.save_manifest(folder, manifest)
+    return segments.SegmentedIndex(folder)
+
+
+@pytest.fixture
+def index(tmp_path, text_analyzer):
+    with build(str(tmp_path), text_analyzer) as index:
+        yield index
+
+
+def search(query, index, text_analyzer):
+    return query_engine.evaluate(query_engine.parse(query, text_analyzer), index)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("report", [0, 1, 5]),
+    ("report draft", [0]),
+    ("report AND final", [1]),
+    ("draft OR final", [0, 1, 2]),
+    ("report NOT archive", [1, 5]),
+    ("NOT report", [2, 3, 4]),
+    ("report missing", []),
+    ("missing OR final", [1, 2]),
+    # stopwords are dropped
+    ("the OR report", [0, 1, 5]),
+    ("REPORT Draft", [0]),
+])
+def test_boolean_operators(index, text_analyzer, query, expected):
+    assert search(query, index, text_analyzer) == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    # AND binds tighter than OR
+    ("archive OR report final", [0, 1]),
+    ("(archive OR report) final", [1]),
+    # NOT binds tightest
+    ("NOT archive report", [1, 5]),
+    ("NOT (archive OR final) report", [5]),
+    ("draft OR NOT report", [0, 2, 3, 4]),
+])
+def test_precedence(index, text_analyzer, query, expected):
+    assert search(query, index, text_analyzer) == expected
+
+
+@pytest.mark.parametrize("query", ["(report draft", "report )", "NOT", "report ("])
+def test_syntax_errors(text_analyzer, query):
+    with pytest.raises(query_engine.QuerySyntaxError):
+        query_engine.Parser(query, text_analyzer).parse()
+
+
+def test_invalid_query_is_read_as_words(index, text_analyzer):
+    assert search("(report draft", index, text_analyzer) == [0]
+    assert search("report ) final", index, text_analyzer) == [1]
+
+
+def test_empty_query(index, text_analyzer):
+    assert query_engine.parse("the of", text_analyzer) is None
+    assert search("the of", index, text_analyzer) == []
+
+
+@pytest.mark.parametrize("query, expected", [
+    ('"terms of delivery"', [3]),
+    ('"delivery of terms"', [4]),
+    # the stopword inside the phrase keeps its place
+    ('"terms delivery"', []),
+    ('"contract signed"', [3]),
+    ('"report"', [0, 1, 5]),
+    ("contract NEAR/1 signed", [3]),
+    ("signed NEAR/1 contract", [3]),
+    ("contract NEAR/3 signed", [3, 4]),
+    ('contract NEAR/5 signed NOT "terms of delivery"', [4]),
+    ('"terms of delivery" OR report final', [1, 3]),
+])
+def test_phrase_and_near(index, text_analyzer, query, expected):
+    assert search(query, index, text_analyzer) == expected
+
+
+def test_phrase_without_positions_is_an_and(tmp_path, text_analyzer):
+    with build(str(tmp_path), text_analyzer, positions=False) as index:
+        assert not index.has_positions
+        assert search('"terms of delivery"', index, text_analyzer) == [3, 4]
+        assert search("contract NEAR/1 signed", index, text_analyzer) == [3, 4]
+
+
+def test_phrase_skips_deleted_docs(tmp_path, text_analyzer):
+    build(str(tmp_path), text_analyzer).close()
+    manifest = segments.load_manifest(str(tmp_path))
+    manifest["deleted"].append(3)
+    segments.save_manifest(str(tmp_path), manifest)
+    with segments.SegmentedIndex(str(tmp_path)) as index:
+        assert search('"terms of delivery"', index, text_analyzer) == []
+        assert search("contract NEAR/3 signed", index, text_analyzer) == [4]
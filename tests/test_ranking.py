@@ -0,0 +1,102 @@
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ranking  # noqa: E402
+import segments  # noqa: E402
+
+TERMS = ["t{}".format(i) for i in range(12)]
+
+
+def build(folder, n_docs, deleted, seed=0):
+    """Segmented index of random docs with ``deleted`` doc ids tombstoned, returns the docs' counts."""
+    rnd = random.Random(seed)
+    manifest = segments.new_manifest(positions=False)
+    # a small budget for several segments
+    writer = segments.SegmentWriter(folder, manifest, memory_budget=4000)
+    docs = []
+    for _ in range(n_docs):
+        # skewed so that some terms are in most docs
+        counts = {}
+        for term in rnd.sample(TERMS, rnd.randint(1, 6)):
+            if rnd.random() < 0.9 - TERMS.index(term) * 0.07:
+                counts[term] = rnd.randint(1, 5)
+        counts = counts or {TERMS[-1]: 1}
+        docs.append(counts)
+        writer.add(counts)
+    writer.flush()
+    manifest["deleted"].extend(sorted(deleted))
+    segments.save_manifest(folder, manifest)
+    return docs
+
+
+def brute_force(docs, deleted, terms):
+    """BM25 scores of the live docs matching any of ``terms``, statistics over all written docs."""
+    n_docs = len(docs)
+    lengths = [sum(counts.values()) for counts in docs]
+    avg_doc_length = sum(lengths) / n_docs
+    scores = {}
+    for term in set(terms):
+        df = sum(1 for counts in docs if term in counts)
+        if not df:
+            continue
+        term_idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        for doc_id, counts in enumerate(docs):
+            if term in counts and doc_id not in deleted:
+                score = term_idf * counts[term] * (ranking.K1 + 1) / (
+                    counts[term] + ranking.K1 * (1 - ranking.B + ranking.B * lengths[doc_id] / avg_doc_length))
+                scores[doc_id] = scores.get(doc_id, 0.) + score
+    return scores
+
+
+def test_idf_is_never_negative():
+    assert ranking.idf(10, 10) > 0
+    assert ranking.idf(12, 10) == 0
+
+
+def test_top_k_with_deleted_docs_matches_brute_force(tmp_path):
+    rnd = random.Random(1)
+    n_docs = 300
+    # most docs of the frequent terms gone: df of those terms is above the number of live docs
+    deleted = set(rnd.sample(range(n_docs), 220))
+    docs = build(str(tmp_path), n_docs, deleted)
+    with segments.SegmentedIndex(str(tmp_path)) as index:
+        assert len(index.segments) > 1
+        for query in (TERMS[:2], TERMS[:4], TERMS[3:9], TERMS):
+            expected = brute_force(docs, deleted, query)
+            for k in (1, 5, 20, 1000):
+                hits = ranking.top_k(index, query, k)
+                assert all(doc_id not in deleted for _, doc_id in hits)
+                assert len(hits) == min(k, len(expected))
+                for score, doc_id in hits:
+                    assert math.isclose(score, expected[doc_id], rel_tol=1e-9)
+                best = sorted(expected.values(), reverse=True)[:k]
+                assert [score for score, _ in hits] == pytest.approx(best, rel=1e-9)
+
+
+def test_top_k_all_matches_brute_force(tmp_path):
+    rnd = random.Random(2)
+    n_docs = 400
+    deleted = set(rnd.sample(range(n_docs), 60))
+    docs = build(str(tmp_path), n_docs, deleted, seed=3)
+    with segments.SegmentedIndex(str(tmp_path)) as index:
+        for query in (TERMS[:1], TERMS[:2], TERMS[:3], TERMS[2:5], [TERMS[0], TERMS[10]]):
+            expected = {doc_id: score for doc_id, score in brute_force(docs, deleted, query).items()
+                        if all(term in docs[doc_id] for term in query)}
+            ranked = sorted(expected.items(), key=lambda item: (-item[1], item[0]))
+            for k in (1, 3, 10, 1000):
+                hits = ranking.top_k_all(index, query, k)
+                assert [doc_id for _, doc_id in hits] == [doc_id for doc_id, _ in ranked[:k]]
+                assert [score for score, _ in hits] == pytest.approx([score for _, score in ranked[:k]], rel=1e-9)
+
+
+def test_top_k_all_without_a_term_is_empty(tmp_path):
+    build(str(tmp_path), 50, set())
+    with segments.SegmentedIndex(str(tmp_path)) as index:
+        assert ranking.top_k_all(index, [TERMS[0], "missing"], 10) == []
+        assert ranking.top_k_all(index, [TERMS[0]], 0) == []
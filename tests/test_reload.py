@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, ROOT)
+
+import analyzer  # noqa: E402
+import corpus  # noqa: E402
+import segments  # noqa: E402
+from fakedrive import FakeDrive  # noqa: E402
+from gdriveloader import GDriveFiles, GDriveIndex  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # no NLTK corpus needed, the corpus words are random letters
+    monkeypatch.setattr(analyzer, "_stopwords", frozenset())
+    monkeypatch.setattr(analyzer, "_analyzers", {})
+    monkeypatch.chdir(tmp_path)
+
+
+def load_files(drive, client_id):
+    # a small segment budget, so that a load writes several segments
+    return GDriveFiles(drive, client_id, logging.getLogger("test"), workers=2, positions=True, store=True,
+                       segment_budget=200000)
+
+
+def load(drive, client_id, incremental=False):
+    gfiles = load_files(drive, client_id)
+    gfiles.load(incremental=incremental)
+    return gfiles
+
+
+def change(drive, file):
+    """Adds or replaces a file of the drive, as the changes feed reports it."""
+    if file["id"] not in drive.files_by_id:
+        drive.order.append(file["id"])
+    drive.files_by_id[file["id"]] = file
+    drive.changes_log.append({"fileId": file["id"], "removed": False, "file": drive.resource(file)})
+
+
+def edited(file, words):
+    content = corpus.make_docx(words)
+    return dict(file, content=content, md5Checksum=hashlib.md5(content).hexdigest(), size=str(len(content)),
+                version=str(int(file["version"]) + 1), mimeType=corpus.DOCX_MIME)
+
+
+def merge_all(drive, client_id, monkeypatch):
+    """Merges all segments of the index into one without deleted docs."""
+    with monkeypatch.context() as patch:
+        patch.setattr(segments, "plan_merge", lambda manifest: (0, len(manifest["segments"]))
+                      if len(manifest["segments"]) > 1 or manifest["deleted"] else None)
+        load_files(drive, client_id).merge_segments()
+    assert len(segments.load_manifest(os.path.join("drive_files", client_id))["segments"]) == 1
+
+
+def results(client_id, queries, ranked):
+    index = GDriveIndex(client_id)
+    res = {}
+    for query in queries:
+        docs = index.find(query, ranked=ranked)
+        # doc ids differ between the builds, ties of the score are ordered by name
+        if ranked:
+            docs = sorted(docs, key=lambda doc: (-round(doc[2], 9), doc[0]))
+        res[query] = [[doc[0], doc[1]] + ([pytest.approx(doc[2], rel=1e-9)] if ranked else []) for doc in docs]
+        res[query, "snippets"] = index.snippets(query, sorted(doc[0] for doc in docs))
+    return res
+
+
+def test_reload_matches_a_fresh_build(monkeypatch):
+    files = corpus.generate(40, words=60, vocabulary_size=300, duplicates=0, copies=0.15)
+    vocabulary = corpus.vocabulary(300)
+    drive = FakeDrive(files)
+    load(drive, "cid")
+    originals = {file["name"] for file in files if " copy " not in file["name"]}
+    copied = next(file for file in files if " copy " in file["name"])
+    # the first file with its content is the indexed one
+    original = next(file for file in files if file["md5Checksum"] == copied["md5Checksum"])
+    # removed: a plain file and a file with a copy, which takes its document over
+    plain = [file for file in files if file["name"] in originals and file["md5Checksum"] != copied["md5Checksum"]]
+    drive.delete(plain[0]["id"])
+    drive.delete(original["id"])
+    # edited, one of them into the content of another file
+    change(drive, edited(plain[1], vocabulary[:20]))
+    change(drive, edited(plain[2], vocabulary[100:150] + ["phrase", "of", "words"]))
+    change(drive, dict(plain[3], content=plain[4]["content"], md5Checksum=plain[4]["md5Checksum"],
+                       size=plain[4]["size"], version="2"))
+    # added
+    for i, file in enumerate(corpus.generate(5, words=60, vocabulary_size=300, duplicates=0, seed=1)):
+        change(drive, dict(file, id="new{}".format(i), name="new {}".format(file["name"]),
+                           webViewLink="https://drive.google.com/file/d/new{}/view".format(i)))
+    gfiles = load(drive, "cid", incremental=True)
+    assert gfiles.failed == []
+    manifest = segments.load_manifest(os.path.join("drive_files", "cid"))
+    # the reload appended segments and left tombstones
+    assert len(manifest["segments"]) > 1 and manifest["deleted"]
+    fresh_drive = FakeDrive(drive.listed())
+    load(fresh_drive, "fresh")
+
+    with open(os.path.join("drive_files", "cid", "docs_urls.json")) as json_file:
+        ids = {url["id"] for url in json.load(json_file).values()}
+    assert plain[0]["id"] not in ids and original["id"] not in ids and "new0" in ids
+    queries = vocabulary[:60:3] + ['"phrase of words"', vocabulary[100] + " NEAR/3 words",
+                                   vocabulary[0] + " OR " + vocabulary[120], vocabulary[1] + " NOT " + vocabulary[2]]
+    assert results("cid", queries, ranked=False) == results("fresh", queries, ranked=False)
+    assert results("cid", ['"phrase of words"'], ranked=False)['"phrase of words"']
+    # once merged, the statistics are over the same docs and the scores agree as well
+    merge_all(drive, "cid", monkeypatch)
+    merge_all(fresh_drive, "fresh", monkeypatch)
+    assert results("cid", queries, ranked=True) == results("fresh", queries, ranked=True)
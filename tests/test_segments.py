@@ -0,0 +1,131 @@
+import os
+import random
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import docstore  # noqa: E402
+import segments  # noqa: E402
+
+WORDS = ["w{}".format(i) for i in range(15)]
+
+
+def random_docs(n_docs, seed=0):
+    rnd = random.Random(seed)
+    return [[rnd.choice(WORDS[:rnd.randint(1, len(WORDS))]) for _ in range(rnd.randint(1, 12))]
+            for _ in range(n_docs)]
+
+
+def write(folder, docs, memory_budget, deleted=()):
+    """Index of ``docs`` (lists of words) with positions and stored text, returns its manifest."""
+    os.makedirs(folder, exist_ok=True)
+    manifest = segments.new_manifest(positions=True, store=True)
+    writer = segments.SegmentWriter(folder, manifest, memory_budget)
+    for words in docs:
+        term_positions = {}
+        for position, word in enumerate(words):
+            term_positions.setdefault(word, []).append(position)
+        stored = docstore.BlockCompressor(block_chars=16)
+        list(stored.feed([" ".join(words)]))
+        writer.add(Counter(words), term_positions, stored)
+    writer.flush()
+    manifest["deleted"].extend(deleted)
+    segments.save_manifest(folder, manifest)
+    return manifest
+
+
+def dump(folder):
+    """Postings with positions of every term and the stored text of every live doc."""
+    with segments.SegmentedIndex(folder) as index:
+        postings = {}
+        for term in index.terms():
+            cursor = index.cursor(term)
+            postings[term] = []
+            while cursor.doc is not None:
+                postings[term].append((cursor.doc, cursor.freq, list(cursor.positions())))
+                cursor.advance()
+        texts = {doc_id: "".join(index.text_blocks(doc_id)) for doc_id in index.doc_ids()}
+        return postings, texts, dict(index.coll_freqs()), index.n_docs, index.total_length
+
+
+def test_merge_of_all_segments_matches_a_fresh_build(tmp_path):
+    docs = random_docs(200)
+    deleted = sorted(random.Random(1).sample(range(len(docs)), 50))
+    folder = str(tmp_path / "merged")
+    manifest = write(folder, docs, memory_budget=3000, deleted=deleted)
+    assert len(manifest["segments"]) > 4
+    remap = segments.merge(folder, manifest, 0, len(manifest["segments"]))
+    segments.save_manifest(folder, manifest)
+    live = [doc_id for doc_id in range(len(docs)) if doc_id not in deleted]
+    # live docs are renumbered in order, tombstones are gone
+    assert remap == {doc_id: i for i, doc_id in enumerate(live)}
+    assert manifest["deleted"] == []
+    assert len(manifest["segments"]) == 1
+    assert sorted(os.listdir(folder)) == sorted([segments.SEGMENTS_FILE, manifest["segments"][0]["file"],
+                                                 manifest["segments"][0]["store"]])
+
+    fresh = str(tmp_path / "fresh")
+    write(fresh, [docs[doc_id] for doc_id in live], memory_budget=1 << 20)
+    assert dump(folder) == dump(fresh)
+
+
+def test_merge_of_a_range_remaps_only_its_docs(tmp_path):
+    docs = random_docs(150, seed=2)
+    folder = str(tmp_path)
+    manifest = write(folder, docs, memory_budget=2000)
+    parts = manifest["segments"]
+    assert len(parts) > 4
+    start, end = 1, 4
+    first, last = parts[start]["base"], parts[end - 1]["base"] + parts[end - 1]["count"]
+    # one tombstone before, three inside and one after the range
+    deleted = [parts[0]["base"], first, first + 2, last - 1, last]
+    manifest["deleted"].extend(deleted)
+    segments.save_manifest(folder, manifest)
+    postings, texts, _, n_docs, _ = dump(folder)
+
+    remap = segments.merge(folder, manifest, start, end)
+    segments.save_manifest(folder, manifest)
+    assert sorted(remap) == [doc_id for doc_id in range(first, last) if doc_id not in deleted]
+    assert sorted(remap.values()) == list(range(first, first + len(remap)))
+    # tombstones outside the range stay, the docs after it keep their ids
+    assert manifest["deleted"] == [parts[0]["base"], last]
+    assert manifest["segments"][start]["base"] == first
+    assert manifest["segments"][start + 1]["base"] == last
+
+    merged_postings, merged_texts, _, merged_n_docs, _ = dump(folder)
+    assert merged_postings == {term: [(remap.get(doc_id, doc_id), freq, positions)
+                                      for doc_id, freq, positions in entries]
+                               for term, entries in postings.items()}
+    assert merged_texts == {remap.get(doc_id, doc_id): text for doc_id, text in texts.items()}
+    # the deleted docs of the range no longer count
+    assert merged_n_docs == n_docs - 3
+
+
+def test_merge_of_deleted_docs_only_drops_the_range(tmp_path):
+    folder = str(tmp_path)
+    manifest = write(folder, [["a"], ["b"], ["a", "c"]], memory_budget=1, deleted=[1])
+    assert segments.plan_merge(manifest) == (1, 2)
+    remap = segments.merge(folder, manifest, 1, 2)
+    segments.save_manifest(folder, manifest)
+    assert remap == {}
+    assert [part["base"] for part in manifest["segments"]] == [0, 2]
+    assert manifest["deleted"] == []
+    postings, texts, coll_freqs, n_docs, _ = dump(folder)
+    assert postings == {"a": [(0, 1, [0]), (2, 1, [0])], "c": [(2, 1, [1])]}
+    assert texts == {0: "a", 2: "a c"}
+    assert coll_freqs == {"a": 2, "c": 1}
+    assert n_docs == 2
+
+
+def test_plan_merge_picks_segments_of_one_size_level():
+    manifest = segments.new_manifest(positions=False)
+    sizes = [100, 20, 20, 20, 20, 3]
+    base = 0
+    for count in sizes:
+        manifest["segments"].append({"file": "", "base": base, "count": count})
+        base += count
+    assert segments.plan_merge(manifest) == (1, 5)
+    # with most of its docs deleted the large segment is rewritten first
+    manifest["deleted"] = list(range(60))
+    assert segments.plan_merge(manifest) == (0, 1)
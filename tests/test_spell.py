@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segments  # noqa: E402
+from symspell import SymSpell  # noqa: E402
+
+
+def build(folder, docs, deleted=(), memory_budget=1 << 20):
+    manifest = segments.new_manifest(positions=False)
+    writer = segments.SegmentWriter(folder, manifest, memory_budget)
+    for counts in docs:
+        writer.add(counts)
+    writer.flush()
+    manifest["deleted"].extend(deleted)
+    segments.save_manifest(folder, manifest)
+    return manifest
+
+
+def test_spelling_dictionary_counts_occurrences(tmp_path):
+    # "report" is in three documents, "repost" is repeated in one of them
+    build(str(tmp_path), [{"report": 1, "repost": 10}, {"report": 1}, {"report": 2}])
+    with segments.SegmentedIndex(str(tmp_path)) as index:
+        vocabulary = dict(index.coll_freqs())
+    assert vocabulary == {"report": 4, "repost": 10}
+    # both are one edit away, the more frequent word wins
+    assert SymSpell.build(vocabulary).lookup("reporst") == "repost"
+
+
+def test_collection_frequencies_are_summed_over_segments(tmp_path):
+    # a tiny budget flushes a segment per document
+    manifest = build(str(tmp_path), [{"report": 3}, {"report": 2, "budget": 1}, {"budget": 4}], memory_budget=1)
+    assert len(manifest["segments"]) == 3
+    with segments.SegmentedIndex(str(tmp_path)) as index:
+        assert dict(index.coll_freqs()) == {"budget": 5, "report": 5}
+
+
+def test_deleted_documents_count_until_merged(tmp_path):
+    manifest = build(str(tmp_path), [{"report": 1}, {"report": 2}, {"budget": 1}], deleted=[0])
+    with segments.SegmentedIndex(str(tmp_path)) as index:
+        assert dict(index.coll_freqs()) == {"budget": 1, "report": 3}
+    segments.merge(str(tmp_path), manifest, 0, len(manifest["segments"]))
+    segments.save_manifest(str(tmp_path), manifest)
+    with segments.SegmentedIndex(str(tmp_path)) as index:
+        assert dict(index.coll_freqs()) == {"budget": 1, "report": 2}